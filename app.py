@@ -1,27 +1,77 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, abort, send_file, \
+    Response, stream_with_context
 import modules.model as model
+import modules.session_manager as session_manager
+from modules.session_manager import read_only
+import modules.datatables as datatables
+import modules.pdf_acts as pdf_acts
+import modules.hardware_import as hardware_import
+import modules.export as export
+import modules.search_index as search_index
+import modules.instrumentation as instrumentation
+import modules.http_cache as http_cache
+import modules.fragment_cache as fragment_cache
+import modules.ownership as ownership
+import modules.labels as labels
+from modules.audit import audit_flusher, get_changes, AUDIT_PAGE_SIZE
+from modules.stocktake import stocktakes, StocktakeError, LISTS, LIST_PAGE_SIZE
+from modules.arrange_batch import ArrangeBatch, ArrangeBatchError, form_fields
+from modules.arrange_jobs import arrange_jobs, ARRANGE_ASYNC, EVENTS_POLL_SEC, EVENTS_RETRY_MS, \
+    EVENTS_TIMEOUT_SEC
+import click
+import csv
+import json
+import os
 import secrets
-import pdfkit
+import time
+from datetime import date
 
 app = Flask(__name__)
+# static files are served with fingerprinted names and long caching (http_cache), other files are not cached
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 
-secret = secrets.token_urlsafe(32)
+# the same key in all worker processes and after restarts, otherwise flashed messages of another worker are lost
+secret = os.environ.get('HARDWARE_SECRET_KEY') or secrets.token_urlsafe(32)
 app.secret_key = secret
+session_manager.init_app(app)
+instrumentation.init_app(app)
+http_cache.init_app(app)
+arrange_jobs.init_app(app)
+audit_flusher.init_app(app)
+# pages and JSON answered with 304 while the inventory is not changed
+versioned = http_cache.versioned(model.change_version)
+# ownership as of ?date=, today by default: the date is a part of the ETag, so it changes at midnight
+versioned_as_of = http_cache.versioned(model.change_version, get_key=lambda: _as_of_date().isoformat())
 
 
 @app.route('/')
+@read_only
+@versioned
 def hardware_list():
-    list_of_hardware = model.Hardware.get_list_of_hardware()
-    return render_template('hardwareList.html', list_of_hardware=list_of_hardware)
+    page_length = datatables.DEFAULT_PAGE_LENGTH
+    records_total, _, list_of_hardware = model.Hardware.get_hardware_page(
+        start=0, length=page_length, order_column=datatables.DEFAULT_ORDER_COLUMN)
+    return render_template('hardwareList.html', hardware_rows=datatables.hardware_rows_html(list_of_hardware),
+                           records_total=records_total, page_length=page_length)
+
+
+@app.route('/hardware_table')
+@read_only
+def hardware_table_data():
+    table_request = datatables.DataTablesRequest(request.args)
+    records_total, records_filtered, list_of_hardware = model.Hardware.get_hardware_page(
+        **table_request.page_params())
+    data = datatables.hardware_rows(list_of_hardware)
+    return jsonify(table_request.response(records_total, records_filtered, data))
 
 
 @app.route('/prepare_for_arrange', methods=['POST'])
+@read_only
 def prepare_for_arrange():
     data = request.form.to_dict(flat=False)
     if not data:
-        print('No data')
-        redirect(url_for('hardware_list'))
+        app.logger.info('Arrange requested without selected hardware')
+        return redirect(url_for('hardware_list'))
     else:
         selected_hardware = data['hardware_id']
         arrange_params = model.PreArrange(hardware=selected_hardware)
@@ -30,15 +80,119 @@ def prepare_for_arrange():
 
 @app.route('/arrange_hardware', methods=['POST'])
 def arrange_hardware():
-    # pdfkit.from_file('./templates/arrange_hardware.html', r'd:\TEST.pdf')
     form_data = request.form.to_dict(flat=False)
+    if ARRANGE_ASYNC:
+        # large acts may run longer than the proxy timeout, the page follows the progress of the job
+        job, _ = arrange_jobs.submit(form_data, idempotency_key=request.form.get('idempotency_key'))
+        return render_template('arrange_job.html', job=job)
     arrange_ins = model.ArrangeHardware(**form_data)
     message, status = arrange_ins()
+    if status == model.ArrangeHardware.STATUS_MESSAGES[0]['status']:
+        # PDF of the act is rendered in the background, available on /acts/<doc_num>/pdf
+        pdf_acts.pdf_acts.submit(arrange_ins.doc_num)
     flash(message, status)
     return redirect(url_for('hardware_list'))
 
 
+@app.route('/arrange_jobs/<job_id>/done')
+def arrange_job_done(job_id):
+    """
+    Show the result of the finished job on the hardware list like the synchronous act
+    """
+    job = arrange_jobs.status(job_id)
+    if job is None:
+        abort(404)
+    if arrange_jobs.is_finished(job):
+        # the act was saved by the job thread, show the list from the primary
+        session_manager.mark_write()
+        flash(job['message'], job['message_status'])
+    return redirect(url_for('hardware_list'))
+
+
+@app.route('/api/arrange_jobs', methods=['POST'])
+def submit_arrange_job():
+    """
+    Enqueue an arrange act. Fields of the arrange form as form data or JSON (values or lists of values).
+    The key from the Idempotency-Key header (or idempotency_key field) is applied once:
+    repeated requests return the first job with status 200
+    """
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            abort(400, 'JSON object with the fields of the act expected')
+        form_data = form_fields(payload)
+    else:
+        form_data = request.form.to_dict(flat=False)
+    idempotency_key = request.headers.get('Idempotency-Key') or (form_data.get('idempotency_key') or [None])[0]
+    try:
+        job, created = arrange_jobs.submit(form_data, idempotency_key=idempotency_key)
+    except (KeyError, ValueError, TypeError) as error:
+        abort(400, f'Invalid arrange act: {error}')
+    return jsonify(_job_urls(job)), 202 if created else 200
+
+
+@app.route('/api/arrange_jobs/<job_id>')
+def arrange_job_status(job_id):
+    job = arrange_jobs.status(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(_job_urls(job))
+
+
+@app.route('/api/arrange_jobs/<job_id>/events')
+def arrange_job_events(job_id):
+    """
+    Server-sent events with the job status on every change until the job is finished.
+    The stream ends after EVENTS_TIMEOUT_SEC so watchers don't hold the server threads, EventSource reconnects
+    """
+    if arrange_jobs.status(job_id) is None:
+        abort(404)
+
+    def events():
+        last, deadline = None, time.monotonic() + EVENTS_TIMEOUT_SEC
+        yield f'retry: {EVENTS_RETRY_MS}\n\n'
+        while time.monotonic() < deadline:
+            job = _job_urls(arrange_jobs.status(job_id))
+            if job != last:
+                yield f'data: {json.dumps(job)}\n\n'
+                last = job
+            if arrange_jobs.is_finished(job):
+                return
+            time.sleep(EVENTS_POLL_SEC)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/arrange_batch', methods=['POST'])
+def arrange_batch():
+    """
+    Many acts in one call: {"acts": [{"hardware_id": [...], "it_worker": 1, "employee": 2, "operation": 1,
+    "employee_2": null, "doc_date": "YYYY-MM-DD"}, ...]}. Acts are applied in the given order,
+    results are returned in the same order
+    """
+    payload = request.get_json(silent=True)
+    acts = payload.get('acts') if isinstance(payload, dict) else payload
+    if not isinstance(acts, list):
+        abort(400, 'JSON list of acts expected')
+    try:
+        batch = ArrangeBatch(acts)
+    except ArrangeBatchError as error:
+        abort(400, str(error))
+    # PDFs are rendered on the first request of /acts/<doc_num>/pdf or by /acts/pdf_export
+    return jsonify(results=batch())
+
+
+def _job_urls(job) -> dict:
+    job['url'] = url_for('arrange_job_status', job_id=job['job_id'])
+    job['events_url'] = url_for('arrange_job_events', job_id=job['job_id'])
+    if job['doc_num']:
+        job['pdf_url'] = url_for('act_pdf', doc_num=job['doc_num'])
+    return job
+
+
 @app.route('/edit_hardware/<hardware_id>', methods=['GET'])
+@read_only
 def pre_edit_hardware(hardware_id):
     hardware_info = model.HardwareEdit(hardware_id=hardware_id)
     hardware_info()
@@ -53,8 +207,582 @@ def edit_hardware():
     return redirect(url_for('hardware_list'))
 
 
-@app.route('/arrange_info/<hardware_id>')
+@app.route('/arrange_info/<int:hardware_id>')
+@read_only
+@versioned
 def arrangement_info(hardware_id):
-    hardware_arran_history = model.ArrangeHardware.get_hardware_arrangement(hardware_id=hardware_id)
-    print(hardware_arran_history)
-    return redirect(url_for('hardware_list'))
+    history, next_cursor = _history_page(model.ArrangeHardware.get_hardware_arrangement, hardware_id)
+    hardware = model.Hardware.get_hardware(hardware_id)
+    title = f'{hardware.code_format} {hardware.name}' if hardware else hardware_id
+    return render_template('arrange_history.html', history=history, next_cursor=next_cursor, title=title)
+
+
+@app.route('/worker_history/<int:worker_id>')
+@read_only
+@versioned
+def worker_history(worker_id):
+    history, next_cursor = _history_page(model.ArrangeHardware.get_worker_arrangement, worker_id)
+    worker = model.Worker.get_worker(worker_id)
+    title = worker.name if worker else worker_id
+    return render_template('arrange_history.html', history=history, next_cursor=next_cursor, title=title)
+
+
+@app.route('/api/hardware/<int:hardware_id>/history')
+@read_only
+@versioned
+def hardware_history_api(hardware_id):
+    history, next_cursor = _history_page(model.ArrangeHardware.get_hardware_arrangement, hardware_id)
+    return jsonify(history=[arrange.to_dict() for arrange in history], next=next_cursor)
+
+
+@app.route('/api/workers/<int:worker_id>/history')
+@read_only
+@versioned
+def worker_history_api(worker_id):
+    history, next_cursor = _history_page(model.ArrangeHardware.get_worker_arrangement, worker_id)
+    return jsonify(history=[arrange.to_dict() for arrange in history], next=next_cursor)
+
+
+@app.route('/api/ownership/hardware/<int:hardware_id>')
+@read_only
+@versioned_as_of
+def hardware_ownership_api(hardware_id):
+    """
+    Owner of the hardware at the end of ?date=YYYY-MM-DD (today by default)
+    """
+    as_of = _as_of_date()
+    owner = ownership.hardware_owner(hardware_id, as_of)
+    return jsonify(as_of=as_of.isoformat(), **_ownership_row(owner))
+
+
+@app.route('/api/ownership/workers/<int:worker_id>')
+@read_only
+@versioned_as_of
+def worker_ownership_api(worker_id):
+    """
+    Hardware held by the worker at the end of ?date=YYYY-MM-DD
+    """
+    as_of = _as_of_date()
+    return jsonify(worker_id=worker_id, **_holdings_response(ownership.holdings([worker_id], as_of), as_of))
+
+
+@app.route('/api/ownership/departments/<int:department_id>')
+@read_only
+@versioned_as_of
+def department_ownership_api(department_id):
+    """
+    Hardware held at the end of ?date=YYYY-MM-DD by the current workers of the department
+    """
+    as_of = _as_of_date()
+    worker_ids = ownership.department_workers(department_id)
+    if worker_ids is None:
+        abort(404)
+    return jsonify(department_id=department_id, worker_ids=worker_ids,
+                   **_holdings_response(ownership.holdings(worker_ids, as_of), as_of))
+
+
+@app.route('/api/audit/hardware/<int:hardware_id>')
+@read_only
+def hardware_audit_api(hardware_id):
+    """
+    Field changes of the hardware (edits and arrange acts), newest first: ?after=<cursor>&limit=<n>
+    """
+    changes, next_cursor = _audit_page(hardware_id=hardware_id)
+    return jsonify(changes=changes, next=next_cursor)
+
+
+@app.route('/api/audit/users/<path:user_name>')
+@read_only
+def user_audit_api(user_name):
+    """
+    Field changes made by the user (REMOTE_USER or client address), newest first
+    """
+    changes, next_cursor = _audit_page(changed_by=user_name)
+    return jsonify(changes=changes, next=next_cursor)
+
+
+def _audit_page(**criteria):
+    limit = request.args.get('limit', AUDIT_PAGE_SIZE, type=int)
+    try:
+        return get_changes(after=request.args.get('after'), limit=limit, **criteria)
+    except ValueError:
+        abort(400, 'Invalid audit cursor')
+
+
+def _as_of_date() -> date:
+    try:
+        return date.fromisoformat(request.args['date']) if request.args.get('date') else date.today()
+    except ValueError:
+        abort(400, 'Date must be YYYY-MM-DD')
+
+
+def _ownership_row(row) -> dict:
+    return dict(row, doc_date=row['doc_date'].isoformat() if row['doc_date'] else None)
+
+
+def _holdings_response(result, as_of) -> dict:
+    names = ownership.hardware_names([row['hardware_id'] for row in result['hardware']])
+    hardware = []
+    for row in result['hardware']:
+        name, serial_num = names.get(row['hardware_id'], (None, None))
+        hardware.append(dict(_ownership_row(row), name=name, serial_num=serial_num))
+    return {
+        'as_of': as_of.isoformat(),
+        'snapshot_date': result['snapshot_date'].isoformat() if result['snapshot_date'] else None,
+        'events_replayed': result['events_replayed'],
+        'count': len(hardware),
+        'hardware': hardware,
+    }
+
+
+def _history_page(get_history, object_id):
+    """
+    Read ?after=<cursor>&limit=<n> and return the history page
+    """
+    limit = request.args.get('limit', model.ArrangeHardware.HISTORY_PAGE_SIZE, type=int)
+    try:
+        return get_history(object_id, after=request.args.get('after'), limit=limit)
+    except ValueError:
+        abort(400, 'Invalid history cursor')
+
+
+@app.route('/api/search')
+def search():
+    """
+    Typeahead: ?q=<inventory code, serial number, name or worker name>&limit=<n>.
+    Not versioned: the index of every process is refreshed on its own, the same change version
+    may give other results in another process
+    """
+    limit = min(max(request.args.get('limit', search_index.SEARCH_LIMIT, type=int), 1), search_index.SEARCH_MAX_LIMIT)
+    results = search_index.search_index.search(request.args.get('q', ''), limit=limit)
+    for result in results:
+        if result['type'] == search_index.HARDWARE:
+            result['url'] = url_for('arrangement_info', hardware_id=result['id'])
+        else:
+            result['url'] = url_for('worker_history', worker_id=result['id'])
+    return jsonify(results)
+
+
+@app.route('/hardware/import', methods=['POST'])
+def import_hardware():
+    """
+    Bulk import of hardware from the uploaded CSV/XLSX file (form field "file").
+    Returns the number of imported rows and errors of the rejected rows
+    """
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        abort(400, 'File is required')
+
+    file_format = os.path.splitext(upload.filename)[1]
+    try:
+        report = hardware_import.HardwareImport(upload.stream, file_format=file_format)()
+    except hardware_import.ImportFormatError as error:
+        abort(400, str(error))
+    return jsonify(report)
+
+
+@app.route('/export/inventory.<file_format>')
+@read_only
+def export_inventory(file_format):
+    return _export_response(export.inventory_query(), file_format, f'inventory-{date.today()}')
+
+
+@app.route('/export/acts.<file_format>')
+@read_only
+def export_acts(file_format):
+    """
+    Arrange history of the period (?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD, both optional)
+    """
+    try:
+        date_from = date.fromisoformat(request.args['date_from']) if request.args.get('date_from') else None
+        date_to = date.fromisoformat(request.args['date_to']) if request.args.get('date_to') else None
+    except ValueError:
+        abort(400, 'Dates must be YYYY-MM-DD')
+    return _export_response(export.acts_query(date_from, date_to), file_format,
+                            f'acts-{date_from or "start"}-{date_to or date.today()}')
+
+
+def _export_response(query, file_format, name):
+    """
+    Stream the export to the client chunk by chunk
+    """
+    try:
+        chunks = export.export(query, file_format)
+    except export.ExportFormatError as error:
+        abort(400, str(error))
+    return Response(stream_with_context(chunks), mimetype=export.FORMATS[file_format],
+                    headers={'Content-Disposition': f'attachment; filename={name}.{file_format}'})
+
+
+@app.route('/acts/<int:doc_num>/pdf')
+def act_pdf(doc_num):
+    """
+    PDF of the act if it is rendered, otherwise start rendering and return the status (202)
+    """
+    path = pdf_acts.pdf_acts.submit(doc_num)
+    status = pdf_acts.pdf_acts.status(path)
+    if status['status'] == pdf_acts.READY:
+        return send_file(path, mimetype='application/pdf', download_name=f'act-{doc_num}.pdf')
+    if status['status'] == pdf_acts.NOT_FOUND:
+        abort(404)
+
+    status['url'] = url_for('act_pdf', doc_num=doc_num)
+    return jsonify(status), 500 if status['status'] == pdf_acts.FAILED else 202
+
+
+@app.route('/acts/pdf_export')
+def acts_pdf_export():
+    """
+    Zip with PDFs of all acts of the period (?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD).
+    Acts are rendered in parallel, poll until the zip is returned
+    """
+    try:
+        date_from = date.fromisoformat(request.args['date_from'])
+        date_to = date.fromisoformat(request.args['date_to'])
+    except (KeyError, ValueError):
+        abort(400, 'date_from and date_to are required (YYYY-MM-DD)')
+
+    paths, status = pdf_acts.pdf_acts.export(date_from, date_to)
+    if status['status'] == pdf_acts.READY:
+        if not paths:
+            return jsonify(status)
+        zip_path = pdf_acts.pdf_acts.export_zip(paths, f'{date_from}-{date_to}')
+        return send_file(zip_path, mimetype='application/zip', download_name=f'acts-{date_from}-{date_to}.zip')
+
+    status['url'] = request.full_path
+    return jsonify(status), 500 if status['status'] == pdf_acts.FAILED else 202
+
+
+@app.route('/labels.<file_format>')
+@read_only
+def label_sheet(file_format):
+    """
+    Label sheets of ?ids=1,2,10-20 or of the hardware matching ?search=..., &symbology=code128|qr,
+    &layout=a4-3x8, &page=N for one svg sheet. PDF is rendered in the background: 202 until it is ready
+    """
+    if file_format not in labels.FORMATS:
+        abort(404)
+    symbology = request.args.get('symbology', labels.CODE128)
+    layout_name = request.args.get('layout', labels.DEFAULT_LAYOUT)
+    try:
+        hardware_ids = labels.parse_ids(request.args.get('ids'))
+        if not hardware_ids and not request.args.get('search'):
+            raise labels.LabelError('ids or search is required')
+        label_list = labels.load_labels(hardware_ids, request.args.get('search'))
+        pages = _label_pages(label_list, symbology, layout_name)
+    except labels.LabelError as error:
+        abort(400, str(error))
+
+    if file_format == 'svg':
+        page = request.args.get('page', 1, type=int)
+        if not 1 <= page <= len(pages):
+            abort(404)
+        return Response(pages[page - 1], mimetype=labels.FORMATS['svg'])
+    html = _label_html(pages, layout_name, len(label_list))
+    if file_format == 'html':
+        return html
+
+    path = labels.label_sheets.pdf_path(html)
+    pdf_acts.pdf_acts.submit_html(html, path)
+    status = pdf_acts.pdf_acts.status(path)
+    if status['status'] == pdf_acts.READY:
+        return send_file(path, mimetype='application/pdf', download_name='labels.pdf')
+    status['url'] = request.full_path
+    return jsonify(status), 500 if status['status'] == pdf_acts.FAILED else 202
+
+
+@app.route('/api/stocktakes', methods=['POST'])
+def stocktake_open():
+    """
+    Start a stocktake: {"name": "...", "department_id": 1}. Without department_id all hardware in use is expected
+    """
+    payload = request.get_json(silent=True) or {}
+    department_id = payload.get('department_id')
+    if department_id is not None and not isinstance(department_id, int):
+        abort(400, 'department_id must be an integer')
+    return jsonify(stocktakes.open(payload.get('name'), department_id)), 201
+
+
+@app.route('/api/stocktakes/<int:stocktake_id>')
+def stocktake_summary(stocktake_id):
+    """
+    Stocktake with the counts of the lists (always read from the primary: scans are reconciled there)
+    """
+    summary = stocktakes.summary(stocktake_id)
+    if summary is None:
+        abort(404)
+    return jsonify(summary)
+
+
+@app.route('/api/stocktakes/<int:stocktake_id>/scans', methods=['POST'])
+def stocktake_scans(stocktake_id):
+    """
+    Batch of a scanner: {"scanner": "tsd-1", "location": <worker id>, "codes": ["000123", ...]}
+    or {"scans": [{"code", "location", "scanner"}, ...]}. Returns the reconciliation of the scanned codes
+    and the counts of the lists
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        abort(400, 'JSON object expected')
+    scans = payload.get('scans')
+    if scans is None and isinstance(payload.get('codes'), list):
+        scans = [{'code': code, 'location': payload.get('location'), 'scanner': payload.get('scanner')}
+                 for code in payload['codes']]
+    if not isinstance(scans, list) or not all(isinstance(scan, dict) for scan in scans):
+        abort(400, 'List of scans or codes expected')
+    try:
+        result = stocktakes.add_scans(stocktake_id, scans)
+    except StocktakeError as error:
+        abort(400, str(error))
+    if result is None:
+        abort(404)
+    return jsonify(result)
+
+
+@app.route('/api/stocktakes/<int:stocktake_id>/scans/file', methods=['POST'])
+def stocktake_scans_file(stocktake_id):
+    """
+    Scans of a scanner without network: CSV file (form field "file") with columns code, location[, scanner]
+    """
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        abort(400, 'File is required')
+    try:
+        result = stocktakes.import_file(stocktake_id, upload.stream)
+    except StocktakeError as error:
+        abort(400, str(error))
+    if result is None:
+        abort(404)
+    return jsonify(result)
+
+
+@app.route('/api/stocktakes/<int:stocktake_id>/<list_name>')
+def stocktake_list(stocktake_id, list_name):
+    """
+    Page of the list missing|found|misassigned|unexpected: ?after=<cursor>&limit=<n>
+    """
+    if list_name not in LISTS or stocktakes.get(stocktake_id) is None:
+        abort(404)
+    try:
+        items, next_cursor = stocktakes.items(stocktake_id, list_name, after=request.args.get('after'),
+                                              limit=request.args.get('limit', LIST_PAGE_SIZE, type=int))
+    except ValueError:
+        abort(400, 'Invalid stocktake cursor')
+    return jsonify(items=items, next=next_cursor)
+
+
+@app.route('/api/stocktakes/<int:stocktake_id>/close', methods=['POST'])
+def stocktake_close(stocktake_id):
+    if stocktakes.get(stocktake_id) is None:
+        abort(404)
+    return jsonify(stocktakes.close(stocktake_id))
+
+
+def _label_pages(label_list, symbology, layout_name) -> list:
+    return labels.label_sheets.pages(labels.label_sheets.render(label_list, symbology, layout_name), layout_name)
+
+
+def _label_html(pages, layout_name, count) -> str:
+    return render_template('label_sheets.html', pages=pages, layout=labels.LAYOUTS[layout_name], count=count)
+
+
+@app.route('/holdings')
+@read_only
+@versioned
+def holdings():
+    """
+    Dashboard of hardware counts, read from the holdings summary
+    """
+    return render_template('holdings.html', totals=model.HoldingsSummary.totals(),
+                           departments=model.HoldingsSummary.by_department(),
+                           workers=model.HoldingsSummary.by_worker())
+
+
+@app.route('/pool_status')
+def pool_status():
+    return jsonify(session_manager.pool_status())
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Request, SQL and pool metrics in Prometheus text format (HARDWARE_METRICS=1)
+    """
+    if not instrumentation.METRICS_ENABLED:
+        abort(404)
+    return Response(instrumentation.metrics.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/slow_requests')
+def slow_requests():
+    if not instrumentation.METRICS_ENABLED:
+        abort(404)
+    return jsonify(instrumentation.metrics.slow_requests_list())
+
+
+@app.route('/reference_cache_status')
+def reference_cache_status():
+    return jsonify(model.reference_cache.stats())
+
+
+@app.route('/row_cache_status')
+def row_cache_status():
+    return jsonify(fragment_cache.row_cache.stats())
+
+
+@app.route('/audit_status')
+def audit_status():
+    return jsonify(audit_flusher.stats())
+
+
+@app.route('/label_cache_status')
+def label_cache_status():
+    return jsonify(labels.label_sheets.stats())
+
+
+@app.route('/search_index_status')
+def search_index_status():
+    return jsonify(search_index.search_index.stats())
+
+
+@app.cli.command('rebuild-holdings')
+def rebuild_holdings():
+    """Recompute the holdings summary from hardware and hardware_use"""
+    rows = model.HoldingsSummary.rebuild()
+    click.echo(f'Holdings summary rebuilt: {rows} row(s)')
+
+
+@app.cli.command('ownership-snapshots')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), help='Last day to snapshot (yesterday by default)')
+@click.option('--period', type=click.Choice(ownership.PERIODS), default='month', show_default=True)
+def ownership_snapshots_command(until, period):
+    """Take the missing ownership snapshots of the period ends"""
+    try:
+        taken = ownership.backfill(until and until.date(), period)
+    except ownership.OwnershipError as error:
+        raise click.ClickException(str(error))
+    for snapshot in taken:
+        click.echo(f'{snapshot["snapshot_date"]}: {snapshot["hardware_count"]} hardware in use, '
+                   f'{snapshot["events"]} act(s) replayed')
+    click.echo(f'Snapshots taken: {len(taken)}')
+
+
+@app.cli.command('prune-pdf-cache')
+@click.option('--days', type=int, default=pdf_acts.PDF_CACHE_DAYS, show_default=True)
+def prune_pdf_cache_command(days):
+    """Remove rendered PDF acts and zips older than DAYS, they are rendered again on request"""
+    click.echo(f'PDF cache files removed: {pdf_acts.pdf_acts.prune(days)}')
+
+
+@app.cli.command('flush-audit')
+def flush_audit_command():
+    """Move the audit outbox to the audit log now"""
+    click.echo(f'Audit outbox rows flushed: {audit_flusher.flush_all()}')
+
+
+@app.cli.command('labels')
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--ids', help='Hardware ids, e.g. 1,2,10-20')
+@click.option('--search', help='Hardware matching the table search')
+@click.option('--symbology', type=click.Choice(labels.SYMBOLOGIES), default=labels.CODE128, show_default=True)
+@click.option('--layout', 'layout_name', type=click.Choice(list(labels.LAYOUTS)), default=labels.DEFAULT_LAYOUT,
+              show_default=True)
+def labels_command(output, ids, search, symbology, layout_name):
+    """Label sheets of the inventory codes to OUTPUT (.html, .svg for one sheet per file, or .pdf)"""
+    try:
+        hardware_ids = labels.parse_ids(ids)
+        if not hardware_ids and not search:
+            raise labels.LabelError('--ids or --search is required')
+        label_list = labels.load_labels(hardware_ids, search)
+        pages = _label_pages(label_list, symbology, layout_name)
+    except labels.LabelError as error:
+        raise click.ClickException(str(error))
+
+    name, extension = os.path.splitext(output)
+    if extension == '.svg':
+        for number, page in enumerate(pages, start=1):
+            with open(f'{name}-{number}.svg' if len(pages) > 1 else output, 'w', encoding='utf-8') as file:
+                file.write(page)
+    elif extension == '.pdf':
+        pdf_acts.render_pdf(_label_html(pages, layout_name, len(label_list)), output)
+    else:
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write(_label_html(pages, layout_name, len(label_list)))
+    click.echo(f'{len(label_list)} label(s) on {len(pages)} sheet(s): {output}')
+
+
+@app.cli.command('stocktake-open')
+@click.option('--name')
+@click.option('--department', 'department_id', type=int, help='Only the hardware of the workers of the department')
+def stocktake_open_command(name, department_id):
+    """Start a stocktake of the hardware in use"""
+    stocktake = stocktakes.open(name, department_id)
+    click.echo(f'Stocktake {stocktake["stocktake_id"]} opened: {stocktake["expected_count"]} hardware expected')
+
+
+@app.cli.command('stocktake-scans')
+@click.argument('stocktake_id', type=int)
+@click.argument('file_path', type=click.Path(exists=True, dir_okay=False))
+def stocktake_scans_command(stocktake_id, file_path):
+    """Load scans from a CSV file (columns code, location[, scanner]) and print the counts of the lists"""
+    try:
+        with open(file_path, 'rb') as file:
+            result = stocktakes.import_file(stocktake_id, file)
+    except StocktakeError as error:
+        raise click.ClickException(str(error))
+    if result is None:
+        raise click.ClickException(f'Stocktake {stocktake_id} not found')
+    click.echo(f'Accepted: {result["accepted"]}, rejected: {len(result["rejected"])}')
+    click.echo(', '.join(f'{name}: {count}' for name, count in result['counts'].items()))
+
+
+@app.cli.command('import-hardware')
+@click.argument('file_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=hardware_import.BATCH_SIZE, show_default=True)
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False), help='Write rejected rows to this CSV file')
+def import_hardware_command(file_path, batch_size, errors_path):
+    """Bulk import of hardware from CSV/XLSX file"""
+    with open(file_path, 'rb') as file:
+        report = hardware_import.HardwareImport(file, file_format=os.path.splitext(file_path)[1],
+                                                batch_size=batch_size)()
+    click.echo(f'Imported: {report["imported"]}, rejected: {report["failed"]}')
+    if errors_path and report['errors']:
+        with open(errors_path, 'w', newline='', encoding='utf-8') as errors_file:
+            writer = csv.DictWriter(errors_file, fieldnames=['row', 'hardware_id', 'message'])
+            writer.writeheader()
+            writer.writerows(report['errors'])
+
+
+@app.cli.command('arrange-batch')
+@click.argument('file_path', type=click.Path(exists=True, dir_okay=False))
+def arrange_batch_command(file_path):
+    """Apply arrange acts from a JSON file (list of acts as in /api/arrange_batch)"""
+    with open(file_path, encoding='utf-8') as file:
+        payload = json.load(file)
+    try:
+        results = ArrangeBatch(payload.get('acts') if isinstance(payload, dict) else payload)()
+    except ArrangeBatchError as error:
+        raise click.ClickException(str(error))
+    for index, result in enumerate(results):
+        click.echo(f'{index}: {result["message"]}')
+    applied = sum(1 for result in results if result['doc_num'])
+    click.echo(f'Applied: {applied}, rejected: {len(results) - applied}')
+
+
+@app.cli.command('export')
+@click.argument('what', type=click.Choice(['inventory', 'acts']))
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(list(export.FORMATS)), default='csv', show_default=True)
+@click.option('--date-from', type=click.DateTime(['%Y-%m-%d']), help='Acts only')
+@click.option('--date-to', type=click.DateTime(['%Y-%m-%d']), help='Acts only')
+def export_command(what, output, file_format, date_from, date_to):
+    """Export inventory or arrange acts to a file"""
+    if what == 'inventory':
+        query = export.inventory_query()
+    else:
+        query = export.acts_query(date_from and date_from.date(), date_to and date_to.date())
+
+    mode, encoding = ('wb', None) if file_format == 'xlsx' else ('w', 'utf-8')
+    with open(output, mode, encoding=encoding, newline=None if encoding is None else '') as output_file:
+        for chunk in export.export(query, file_format):
+            output_file.write(chunk)
@@ -0,0 +1,78 @@
+"""
+Arrange act throughput on a local SQLite database.
+
+    python -m benchmarks.arrange_benchmark [--sizes 1 100 1000] [--repeat 3]
+
+Every round accepts N free items to an employee and returns them back,
+each act is one ArrangeHardware() call (one transaction).
+"""
+import argparse
+import os
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(prefix='hardware_bench_'), 'bench.db')
+os.environ.setdefault('HARDWARE_DB_URL', f'sqlite:///{DB_FILE}')
+
+import modules.model as model  # noqa: E402
+from modules.session_manager import get_engine, remove_session  # noqa: E402
+
+
+def seed(hardware_count):
+    engine = get_engine()
+    model.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(model.Brand.__table__.insert(), [{'brand_id': 1, 'name': 'HP'}])
+        conn.execute(model.HardwareType.__table__.insert(), [{'type_id': 1, 'name': 'Laptop'}])
+        conn.execute(model.HardwareCondition.__table__.insert(), [{'condition_id': 1, 'name': 'New'}])
+        conn.execute(model.ArrangeStatus.__table__.insert(),
+                     [{'arr_status_id': model.ArrangeStatus.FREE, 'name': 'Free'},
+                      {'arr_status_id': model.ArrangeStatus.IN_USE, 'name': 'In use'}])
+        conn.execute(model.ArrangeOperation.__table__.insert(),
+                     [{'operation_id': model.ArrangeOperation.ACCEPT, 'name': 'Accept'},
+                      {'operation_id': model.ArrangeOperation.RETURN, 'name': 'Return'},
+                      {'operation_id': model.ArrangeOperation.TRANSFER, 'name': 'Transfer'}])
+        conn.execute(model.Department.__table__.insert(),
+                     [{'department_id': model.Department.IT, 'name': 'IT'}, {'department_id': 2, 'name': 'HR'}])
+        conn.execute(model.Worker.__table__.insert(),
+                     [{'worker_id': 1, 'name': 'IT worker', 'department_id': model.Department.IT},
+                      {'worker_id': 2, 'name': 'Employee', 'department_id': 2}])
+        if hardware_count:
+            conn.execute(model.Hardware.__table__.insert(),
+                         [{'hardware_id': i, 'name': f'Laptop {i}', 'id_condition': 1, 'id_type': 1, 'id_brand': 1}
+                          for i in range(1, hardware_count + 1)])
+    model.HoldingsSummary.rebuild()
+
+
+def act(hardware_ids, operation_id, doc_num):
+    return model.ArrangeHardware(
+        hardware_id=[str(i) for i in hardware_ids], it_worker=['1'], employee=['2'], operation=[str(operation_id)],
+        doc_num=[str(doc_num)], doc_date=[''], employee_2=[''])
+
+
+def run(sizes, repeat):
+    seed(max(sizes))
+    doc_num = 0
+    for size in sizes:
+        hardware_ids = list(range(1, size + 1))
+        timings = []
+        for _ in range(repeat):
+            for operation_id in (model.ArrangeOperation.ACCEPT, model.ArrangeOperation.RETURN):
+                doc_num += 1
+                arrange = act(hardware_ids, operation_id, doc_num)
+                start = time.perf_counter()
+                message, status = arrange()
+                timings.append(time.perf_counter() - start)
+                remove_session()
+                assert status == model.ArrangeHardware.STATUS_MESSAGES[0]['status'], message
+
+        best = min(timings)
+        print(f'{size:>6} items: best {best * 1000:8.2f} ms/act, {size / best:10.0f} items/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
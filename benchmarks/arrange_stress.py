@@ -0,0 +1,141 @@
+"""
+Concurrent arrange acts on a local SQLite database.
+
+    python -m benchmarks.arrange_stress [--threads 8] [--rounds 20] [--items 50]
+
+In every round all threads try to accept the same items to different employees at the same moment.
+Exactly one act per round must succeed, every item must end up with one owner and no act number
+may be given out twice. Regression check of concurrent acts: exits with status 1 if any of it fails
+or a thread raises.
+"""
+import argparse
+import threading
+from collections import Counter
+
+from benchmarks.arrange_benchmark import seed, act
+from benchmarks.checks import check, main
+import modules.model as model
+from modules.session_manager import get_engine, remove_session
+from sqlalchemy import select, func
+
+FIRST_EMPLOYEE_ID = 100
+
+
+def add_employees(count):
+    with get_engine().begin() as conn:
+        conn.execute(model.Worker.__table__.insert(),
+                     [{'worker_id': FIRST_EMPLOYEE_ID + i, 'name': f'Employee {i}', 'department_id': 2}
+                      for i in range(count)])
+
+
+def employee_act(hardware_ids, employee_id, operation_id):
+    arrange = act(hardware_ids, operation_id, doc_num=0)
+    arrange.employee_id = employee_id
+    return arrange
+
+
+def run_threads(target, args_list):
+    """
+    Run target in a thread per args, the exceptions of the threads are failures of the check
+    """
+    errors = []
+
+    def worker(*args):
+        try:
+            target(*args)
+        except Exception as error:
+            errors.append(error)
+
+    workers = [threading.Thread(target=worker, args=args) for args in args_list]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    check(not errors, f'{len(errors)} thread(s) failed, first: {errors[0]!r}' if errors else '')
+
+
+def run_round(threads, hardware_ids):
+    barrier = threading.Barrier(threads)
+    results = {}
+
+    def worker(employee_id):
+        arrange = employee_act(hardware_ids, employee_id, model.ArrangeOperation.ACCEPT)
+        try:
+            barrier.wait()
+            message, status = arrange()
+            results[employee_id] = (status, arrange.doc_num)
+        except Exception:
+            # the other threads must not wait for this one
+            barrier.abort()
+            raise
+        finally:
+            remove_session()
+
+    run_threads(worker, [(FIRST_EMPLOYEE_ID + i,) for i in range(threads)])
+    return results
+
+
+def check_owners(hardware_ids, owner_id):
+    hardware_use = model.HardwareUse.__table__
+    with get_engine().connect() as conn:
+        owners = conn.execute(select(hardware_use.c.employee_id, hardware_use.c.status_id)
+                              .where(hardware_use.c.hardware_id.in_(hardware_ids))).all()
+    check(len(owners) == len(hardware_ids), 'hardware_use rows are missing')
+    check(all(row == (owner_id, model.ArrangeStatus.IN_USE) for row in owners), f'mixed owners: {set(owners)}')
+
+
+def allocate_numbers(threads, per_thread):
+    allocated = []
+    lock = threading.Lock()
+
+    def worker():
+        numbers = [model.DocCounter.allocate('stress') for _ in range(per_thread)]
+        with lock:
+            allocated.extend(numbers)
+
+    run_threads(worker, [()] * threads)
+    return allocated
+
+
+def run(threads, rounds, items):
+    seed(items)
+    add_employees(threads)
+    hardware_ids = list(range(1, items + 1))
+    success = model.ArrangeHardware.STATUS_MESSAGES[0]['status']
+    doc_nums = []
+
+    for round_num in range(rounds):
+        results = run_round(threads, hardware_ids)
+        winners = [employee_id for employee_id, (status, _) in results.items() if status == success]
+        check(len(winners) == 1, f'round {round_num}: {len(winners)} acts accepted the same hardware')
+        check_owners(hardware_ids, winners[0])
+        doc_nums.append(results[winners[0]][1])
+
+        arrange = employee_act(hardware_ids, winners[0], model.ArrangeOperation.RETURN)
+        message, status = arrange()
+        remove_session()
+        check(status == success, f'round {round_num}: return failed: {message}')
+        doc_nums.append(arrange.doc_num)
+
+    duplicates = [num for num, count in Counter(doc_nums).items() if count > 1]
+    check(not duplicates, f'act numbers given out twice: {duplicates}')
+
+    arranges = model.ArrangeHardware.__table__
+    with get_engine().connect() as conn:
+        history_rows = conn.execute(select(func.count()).select_from(arranges)).scalar()
+    check(history_rows == rounds * 2 * items, f'unexpected history rows: {history_rows}')
+
+    numbers = allocate_numbers(threads, 200)
+    check(len(numbers) == len(set(numbers)), 'document counter returned the same number twice')
+
+    print(f'{rounds} rounds x {threads} threads x {items} items: no double allocation, '
+          f'{len(doc_nums)} unique act numbers, {len(numbers)} unique counter numbers')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--items', type=int, default=50)
+    args = parser.parse_args()
+    main(run, args.threads, args.rounds, args.items)
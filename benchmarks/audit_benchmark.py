@@ -0,0 +1,111 @@
+"""
+Cost of the audit trail on the edit and arrange paths, and throughput of the outbox flusher.
+
+    python -m benchmarks.audit_benchmark [--edits 2000] [--items 100]
+
+Hardware edits (3 changed fields each) and accept/return acts of --items hardware are timed
+without audit, with the audit outbox (one row per edit / per hardware in the same transaction) and
+with one audit row per field inserted synchronously. Then the outbox is flushed to the audit log.
+"""
+import argparse
+import itertools
+import json
+import statistics
+import time
+from datetime import date
+from unittest import mock
+
+from benchmarks.arrange_benchmark import act, seed
+from benchmarks.suite import StatementCounter
+import modules.model as model
+from modules.audit import AuditFlusher, get_changes
+from modules.session_manager import get_engine, remove_session
+
+
+def edit(hardware_id, round_):
+    hardware = model.Hardware(hardware_id=hardware_id, hardware_name=f'Laptop {hardware_id} r{round_}',
+                              condition_id=1, type_id=1, brand_id=1, validation_date=date(2020, 1, 1),
+                              serial=f'SN{hardware_id}-{round_}', description=f'round {round_}')
+    hardware.edit_hardware()
+    remove_session()
+
+
+# outbox ids of the synchronous rows, unique as (outbox_id, field) of the log needs
+SYNC_IDS = itertools.count(-1, -1)
+
+
+def per_field_rows(db_session, rows):
+    """
+    One audit log row per field, one statement each, as without the outbox
+    """
+    for row in rows:
+        outbox_id = next(SYNC_IDS)
+        for field, (old_value, new_value) in json.loads(row['changes']).items():
+            db_session.execute(model.AuditLog.__table__.insert().values(
+                outbox_id=outbox_id, hardware_id=row['hardware_id'], action=row['action'], field=field,
+                old_value=old_value, new_value=new_value, changed_by=row['changed_by'], doc_num=row['doc_num'], changed=row['changed']))
+
+
+def clear_per_field_rows():
+    log = model.AuditLog.__table__
+    with get_engine().begin() as conn:
+        conn.execute(log.delete().where(log.c.outbox_id < 0))
+
+
+def timed_edits(edits, round_, counter) -> tuple:
+    timings = []
+    counter.count = 0
+    for hardware_id in range(1, edits + 1):
+        start = time.perf_counter()
+        edit(hardware_id, round_)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), counter.count / edits
+
+
+def timed_acts(items, rounds, counter) -> tuple:
+    timings = []
+    counter.count = 0
+    for _ in range(rounds):
+        for operation_id in (model.ArrangeOperation.ACCEPT, model.ArrangeOperation.RETURN):
+            start = time.perf_counter()
+            message, status = act(range(1, items + 1), operation_id, 0)()
+            timings.append((time.perf_counter() - start) * 1000)
+            remove_session()
+            assert status == model.ArrangeHardware.STATUS_MESSAGES[0]['status'], message
+    return statistics.median(timings), counter.count / (2 * rounds)
+
+
+def run(edits, items, rounds=10):
+    seed(max(edits, items))
+    counter = StatementCounter()
+    variants = [
+        ('no audit', mock.patch.object(model.AuditOutbox, 'add')),
+        ('outbox', mock.patch.object(model.AuditOutbox, 'add', model.AuditOutbox.add)),
+        ('per field', mock.patch.object(model.AuditOutbox, 'add', per_field_rows)),
+    ]
+    print(f'{edits} edits, acts of {items} items')
+    for round_, (name, patch) in enumerate(variants):
+        with patch:
+            edit_ms, edit_statements = timed_edits(edits, round_, counter)
+            act_ms, act_statements = timed_acts(items, rounds, counter)
+        print(f'{name:>10}: edit median {edit_ms:6.2f} ms ({edit_statements:.1f} statements), '
+              f'act median {act_ms:7.2f} ms ({act_statements:.1f} statements)')
+    clear_per_field_rows()
+
+    flusher = AuditFlusher()
+    pending = flusher.stats()['pending']
+    start = time.perf_counter()
+    moved = flusher.flush_all()
+    ms = (time.perf_counter() - start) * 1000
+    assert moved == pending and flusher.stats()['pending'] == 0
+    changes, _ = get_changes(hardware_id=1, limit=500)
+    print(f'flush: {moved} outbox rows in {ms:.0f} ms ({moved / ms * 1000:.0f} rows/s), '
+          f'{len(changes)} field changes of hardware 1')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--edits', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=100)
+    args = parser.parse_args()
+    run(args.edits, args.items)
@@ -0,0 +1,77 @@
+"""
+Batch of arrange acts (ArrangeBatch) compared with the same acts applied one at a time.
+
+    python -m benchmarks.batch_arrange_benchmark [--acts 200] [--items 5] [--workers 50]
+
+--acts acts of --items hardware each are accepted by --workers employees in turn and returned back,
+once with one ArrangeHardware() call per act and once with two ArrangeBatch calls.
+"""
+import argparse
+import time
+
+from benchmarks.arrange_benchmark import act, seed
+from benchmarks.suite import StatementCounter
+import modules.model as model
+from modules.arrange_batch import ArrangeBatch
+from modules.session_manager import get_engine, remove_session
+
+FIRST_WORKER_ID = 1000
+
+
+def add_workers(workers):
+    with get_engine().begin() as conn:
+        conn.execute(model.Worker.__table__.insert(),
+                     [{'worker_id': FIRST_WORKER_ID + i, 'name': f'Worker {i}', 'department_id': 2}
+                      for i in range(workers)])
+
+
+def acts(count, items, workers, operation_id) -> list:
+    return [{'hardware_id': list(range(n * items + 1, (n + 1) * items + 1)), 'it_worker': 1,
+             'employee': FIRST_WORKER_ID + n % workers, 'operation': operation_id} for n in range(count)]
+
+
+def one_by_one(batch_acts):
+    for fields in batch_acts:
+        arrange = act(fields['hardware_id'], fields['operation'], 0)
+        arrange.employee_id = fields['employee']
+        message, status = arrange()
+        remove_session()
+        assert status == model.ArrangeHardware.STATUS_MESSAGES[0]['status'], message
+
+
+def batch(batch_acts):
+    results = ArrangeBatch(batch_acts)()
+    remove_session()
+    failed = [result['message'] for result in results if not result['doc_num']]
+    assert not failed, failed[:3]
+
+
+def measure(function, batch_acts, counter) -> tuple:
+    counter.count = 0
+    start = time.perf_counter()
+    function(batch_acts)
+    return (time.perf_counter() - start) * 1000, counter.count
+
+
+def run(count, items, workers):
+    seed(count * items)
+    add_workers(workers)
+    counter = StatementCounter()
+    accept = acts(count, items, workers, model.ArrangeOperation.ACCEPT)
+    return_ = acts(count, items, workers, model.ArrangeOperation.RETURN)
+
+    print(f'{count} acts x {items} items, {workers} employees')
+    for name, function in [('one by one', one_by_one), ('batch', batch)]:
+        accept_ms, accept_statements = measure(function, accept, counter)
+        return_ms, return_statements = measure(function, return_, counter)
+        print(f'{name:>10}: accept {accept_ms:8.1f} ms ({accept_statements} statements), '
+              f'return {return_ms:8.1f} ms ({return_statements} statements)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--acts', type=int, default=200)
+    parser.add_argument('--items', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=50)
+    args = parser.parse_args()
+    run(args.acts, args.items, args.workers)
@@ -0,0 +1,24 @@
+"""
+Helpers of the regression checks in benchmarks/ (replica_check, arrange_stress, list_statements_check).
+A failed check prints the reason and exits with status 1, also under python -O
+"""
+import sys
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def check(condition, message):
+    if not condition:
+        raise CheckFailed(message)
+
+
+def main(run, *args):
+    """
+    Run the check, exit with status 1 if it failed
+    """
+    try:
+        run(*args)
+    except CheckFailed as error:
+        sys.exit(f'FAILED: {error}')
@@ -0,0 +1,165 @@
+"""
+Synthetic dataset with the real schema on a local SQLite database.
+
+    python -m benchmarks.dataset [--scale small|medium|large] [--items N] [--history N]
+
+Departments, workers, lookups, hardware, the current use of the hardware (hardware_use),
+arrange history (arranges, several acts per item), document counter and holdings summary.
+The data is generated from a fixed random seed, the same arguments give the same database.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from benchmarks.arrange_benchmark import DB_FILE, seed
+import modules.model as model
+from modules.session_manager import get_engine
+
+# items, acts per item in the history
+SCALES = {
+    'small': (1000, 10),
+    'medium': (50000, 10),
+    'large': (500000, 4),
+}
+ITEMS_PER_WORKER = 20
+DEPARTMENTS = 20
+IN_USE_SHARE = 0.5
+ACT_SIZE = 5  # items per act in the history
+FIRST_WORKER_ID = 1000
+INSERT_CHUNK = 10000
+
+TYPES = ['Laptop', 'Desktop', 'Monitor', 'Phone', 'Printer', 'Router', 'Tablet', 'Scanner']
+BRANDS = ['HP', 'Dell', 'Lenovo', 'Apple', 'Samsung', 'Canon', 'Cisco', 'Asus']
+CONDITIONS = ['New', 'Good', 'Used', 'Broken']
+
+
+class Dataset:
+    """
+    Sizes and ids of the generated data, used by the benchmarks to pick realistic arguments
+    """
+
+    def __init__(self, items, history, random_seed=1):
+        self.items = items
+        self.history = history
+        self.workers = max(items // ITEMS_PER_WORKER, 10)
+        self.worker_ids = list(range(FIRST_WORKER_ID, FIRST_WORKER_ID + self.workers))
+        self.it_worker_id = 1
+        self.random = random.Random(random_seed)
+        self.owners = {}  # hardware_id -> employee_id of the hardware in use
+        self.history_rows = 0
+        self.last_doc_num = 0
+        self._free = None
+
+    def take_free(self, count) -> list:
+        """
+        Free hardware not given to another benchmark case yet
+        """
+        if self._free is None:
+            self._free = [hardware_id for hardware_id in range(self.items, 0, -1) if hardware_id not in self.owners]
+        if len(self._free) < count:
+            raise ValueError(f'Not enough free hardware for the benchmark: {count} needed, {len(self._free)} left')
+        taken, self._free = self._free[-count:], self._free[:-count]
+        return sorted(taken)
+
+    def busiest_worker(self):
+        """
+        Employee with the most hardware in use
+        """
+        holdings = {}
+        for employee_id in self.owners.values():
+            holdings[employee_id] = holdings.get(employee_id, 0) + 1
+        return max(holdings, key=holdings.get)
+
+
+def generate(items, history, random_seed=1) -> Dataset:
+    """
+    Create the schema and fill it. Returns sizes and ids of the generated data
+    """
+    dataset = Dataset(items, history, random_seed)
+    rnd = dataset.random
+    seed(0)
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(model.Department.__table__.insert(),
+                     [{'department_id': i, 'name': f'Department {i}'} for i in range(3, DEPARTMENTS + 1)])
+        conn.execute(model.HardwareType.__table__.insert(),
+                     [{'type_id': i, 'name': name} for i, name in enumerate(TYPES[1:], start=2)])
+        conn.execute(model.Brand.__table__.insert(),
+                     [{'brand_id': i, 'name': name} for i, name in enumerate(BRANDS[1:], start=2)])
+        conn.execute(model.HardwareCondition.__table__.insert(),
+                     [{'condition_id': i, 'name': name} for i, name in enumerate(CONDITIONS[1:], start=2)])
+        conn.execute(model.Worker.__table__.insert(),
+                     [{'worker_id': worker_id, 'name': f'Worker {worker_id}', 'department_id': rnd.randint(2, DEPARTMENTS)}
+                      for worker_id in dataset.worker_ids])
+
+    for first in range(1, items + 1, INSERT_CHUNK):
+        ids = range(first, min(first + INSERT_CHUNK, items + 1))
+        hardware, hardware_use, arranges = [], [], []
+        for hardware_id in ids:
+            hardware.append({'hardware_id': hardware_id, 'name': f'{rnd.choice(TYPES)} {rnd.randint(100, 9999)}',
+                             'id_condition': rnd.randint(1, len(CONDITIONS)), 'id_type': rnd.randint(1, len(TYPES)),
+                             'id_brand': rnd.randint(1, len(BRANDS)), 'serial_num': f'SN{rnd.getrandbits(40):012X}'})
+            hardware_use.append(_history(dataset, hardware_id, arranges))
+        with engine.begin() as conn:
+            conn.execute(model.Hardware.__table__.insert(), hardware)
+            conn.execute(model.HardwareUse.__table__.insert(), hardware_use)
+            if arranges:
+                conn.execute(model.ArrangeHardware.__table__.insert(), arranges)
+        dataset.history_rows += len(arranges)
+
+    with engine.begin() as conn:
+        conn.execute(model.DocCounter.__table__.insert().values(name=model.DocCounter.ARRANGE,
+                                                                 last_value=dataset.last_doc_num))
+    model.HoldingsSummary.rebuild()
+    return dataset
+
+
+def _history(dataset, hardware_id, arranges) -> dict:
+    """
+    Arrange history of one item: accept/return pairs, the last act decides the current use.
+    Items are grouped ACT_SIZE per act number
+    """
+    rnd = dataset.random
+    acts = 2 * rnd.randint(0, dataset.history)
+    if rnd.random() < IN_USE_SHARE:
+        acts += 1  # ends with accept, item is in use
+    doc_date = date.today() - timedelta(days=acts * 30)
+    employee_id = None
+    for act in range(acts):
+        operation_id = model.ArrangeOperation.ACCEPT if act % 2 == 0 else model.ArrangeOperation.RETURN
+        if operation_id == model.ArrangeOperation.ACCEPT:
+            employee_id = rnd.choice(dataset.worker_ids)
+        doc_num = (dataset.history_rows + len(arranges)) // ACT_SIZE + 1
+        arranges.append({'hardware_id': hardware_id, 'employee_id': employee_id, 'it_worker_id': dataset.it_worker_id,
+                         'operation_id': operation_id, 'doc_num': doc_num, 'doc_date': doc_date})
+        dataset.last_doc_num = max(dataset.last_doc_num, doc_num)
+        doc_date += timedelta(days=rnd.randint(1, 30))
+
+    if acts % 2 == 1:
+        dataset.owners[hardware_id] = employee_id
+        return {'hardware_id': hardware_id, 'employee_id': employee_id, 'status_id': model.ArrangeStatus.IN_USE,
+                'doc_num': arranges[-1]['doc_num'], 'doc_date': arranges[-1]['doc_date']}
+    return {'hardware_id': hardware_id, 'employee_id': None, 'status_id': model.ArrangeStatus.FREE,
+            'doc_num': arranges[-1]['doc_num'] if acts else None, 'doc_date': arranges[-1]['doc_date'] if acts else None}
+
+
+def scale_arguments(parser):
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--items', type=int, help='overrides the number of items of the scale')
+    parser.add_argument('--history', type=int, help='overrides the average number of acts per item')
+
+
+def scale_size(args) -> tuple:
+    items, history = SCALES[args.scale]
+    return args.items or items, history if args.history is None else args.history
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    scale_arguments(parser)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    generated = generate(*scale_size(args))
+    print(f'{generated.items} items, {generated.workers} workers, {len(generated.owners)} in use, '
+          f'{generated.history_rows} history rows in {time.perf_counter() - start:.1f} s: {DB_FILE}')
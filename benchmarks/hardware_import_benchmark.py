@@ -0,0 +1,48 @@
+"""
+Bulk hardware import throughput on a local SQLite database.
+
+    python -m benchmarks.hardware_import_benchmark [--rows 50000] [--batch-size 1000]
+
+Generates a CSV file with --rows rows (1% of them invalid) and imports it with HardwareImport.
+"""
+import argparse
+import csv
+import os
+import resource
+import tempfile
+import time
+
+from benchmarks.arrange_benchmark import seed
+import modules.hardware_import as hardware_import
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(hardware_import.COLUMNS)
+        for i in range(1, rows + 1):
+            brand = 'HP' if i % 100 else 'Unknown brand'  # 1% invalid rows
+            writer.writerow([i, f'Laptop {i}', 'New', 'Laptop', brand, '2020-01-01', f'SN{i:010d}', ''])
+
+
+def run(rows, batch_size):
+    seed(0)
+    path = os.path.join(tempfile.mkdtemp(prefix='hardware_import_'), 'import.csv')
+    write_csv(path, rows)
+
+    start = time.perf_counter()
+    with open(path, 'rb') as file:
+        report = hardware_import.HardwareImport(file, file_format='csv', batch_size=batch_size)()
+    elapsed = time.perf_counter() - start
+
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{rows} rows, batch {batch_size}: {elapsed:.2f} s, {rows / elapsed:,.0f} rows/s, '
+          f'imported {report["imported"]}, rejected {report["failed"]}, max RSS {max_rss_mb:.0f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=hardware_import.BATCH_SIZE)
+    args = parser.parse_args()
+    run(args.rows, args.batch_size)
@@ -0,0 +1,42 @@
+"""
+Startup (import of modules.model and of the app) time.
+
+    python -m benchmarks.import_benchmark [--repeat 5]
+
+Every import runs in a new python process. The DB url points to a directory which does not exist,
+so an import connecting to the DB fails: the models are declared, the schema is not reflected at startup.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.checks import check, main
+
+IMPORTS = {'modules.model': 'import modules.model', 'app': 'import app'}
+
+
+def import_time(code, env, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], env=env, capture_output=True, text=True)
+        timings.append(time.perf_counter() - start)
+        check(result.returncode == 0, f'{code} failed without a DB:\n{result.stderr}')
+    return min(timings)
+
+
+def run(repeat):
+    missing_db = os.path.join(tempfile.gettempdir(), 'hardware_no_such_dir', 'hardware.db')
+    env = dict(os.environ, HARDWARE_DB_URL=f'sqlite:///{missing_db}')
+    for name, code in IMPORTS.items():
+        print(f'import {name + ":":15} {import_time(code, env, repeat) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main(run, args.repeat)
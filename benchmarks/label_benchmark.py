@@ -0,0 +1,83 @@
+"""
+Label sheets of inventory codes (modules/labels.py) for many hardware.
+
+    python -m benchmarks.label_benchmark [--labels 10000] [--workers 4] [--changed 0.01]
+
+Times loading of the labels, first rendering in the process and in the pool of --workers processes,
+a reprint from the cache, a reprint after --changed share of the hardware was edited and the assembly
+of the sheets. QR labels are timed too if segno is installed.
+"""
+import argparse
+import time
+
+from benchmarks.arrange_benchmark import seed
+import modules.labels as labels
+import modules.model as model
+from modules.session_manager import get_engine, remove_session
+
+
+def timed(function, *args) -> tuple:
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def touch(hardware_ids):
+    """
+    Edit of the hardware: new serial number and log_date, the label must be rendered again
+    """
+    hardware = model.Hardware.__table__
+    with get_engine().begin() as conn:
+        conn.execute(hardware.update().where(hardware.c.hardware_id.in_(hardware_ids))
+                     .values(serial_num=hardware.c.serial_num + 'R'))
+
+
+def run(count, workers, changed):
+    seed(count)
+    hardware = model.Hardware.__table__
+    with get_engine().begin() as conn:
+        conn.execute(hardware.update().values(serial_num='SN' + hardware.c.hardware_id))
+    hardware_ids = list(range(1, count + 1))
+
+    ms, label_list = timed(labels.load_labels, hardware_ids)
+    remove_session()
+    print(f'{count} labels loaded in {ms:.0f} ms')
+
+    in_process = labels.LabelSheets(workers=1)
+    ms, _ = timed(in_process.render, label_list)
+    print(f'      in process: {ms:8.0f} ms')
+
+    pool = labels.LabelSheets(workers=workers)
+    warm_up = labels.LABEL_CHUNK * 2
+    ms, _ = timed(pool.render, [label._replace(name='warm up') for label in label_list[:warm_up]])
+    print(f'   pool start-up: {ms:8.0f} ms ({workers} workers, {warm_up} labels)')
+    ms, fragments = timed(pool.render, label_list)
+    print(f'      {workers} workers: {ms:8.0f} ms')
+    ms, _ = timed(pool.render, label_list)
+    print(f'         reprint: {ms:8.0f} ms (cache {pool.stats()["size_kib"] / 1024:.1f} MiB)')
+
+    touch(hardware_ids[::int(1 / changed)])
+    label_list = labels.load_labels(hardware_ids)
+    remove_session()
+    ms, fragments = timed(pool.render, label_list)
+    print(f'{changed:.0%} changed reprint: {ms:6.0f} ms')
+
+    ms, pages = timed(pool.pages, fragments)
+    print(f'{len(pages)} sheets assembled in {ms:.0f} ms ({sum(len(page) for page in pages) / 1024 / 1024:.1f} MiB svg)')
+
+    try:
+        ms, _ = timed(pool.render, label_list, labels.QR)
+    except labels.LabelError as error:
+        print(f'QR: {error}')
+    else:
+        print(f'      QR, {workers} workers: {ms:8.0f} ms')
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--labels', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=labels.LABEL_WORKERS)
+    parser.add_argument('--changed', type=float, default=0.01)
+    args = parser.parse_args()
+    run(args.labels, args.workers, args.changed)
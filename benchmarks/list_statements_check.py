@@ -0,0 +1,86 @@
+"""
+Regression check: the hardware list costs the same number of SQL statements whatever the number of rows.
+
+    python -m benchmarks.list_statements_check [--items 200]
+
+The synthetic dataset is generated with --items and with 10 times more items. For both the statements of
+the list page (/), of the DataTables request of the largest page and of Hardware.get_hardware_page() of all
+rows rendered by the table macro are counted (before_cursor_execute on SQLite). Condition, type, brand,
+use and employee are loaded with the page, so the counts must be equal, and all rows must take only the
+count and one SELECT (lazy loads of a few brands or types would not grow with the rows but are still
+extra statements). The row cache is cleared before every request, otherwise cached rows would hide lazy loads.
+"""
+import argparse
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks.checks import check, main
+from benchmarks.dataset import generate
+import modules.datatables as datatables
+import modules.model as model
+from modules.fragment_cache import row_cache
+from modules.session_manager import get_engine, remove_session
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+        event.listen(Engine, 'before_cursor_execute', self.count_statement)
+
+    def count_statement(self, *args):
+        self.count += 1
+
+
+def all_rows_html():
+    _, _, list_of_hardware = model.Hardware.get_hardware_page(length=None)
+    return datatables.hardware_rows_html(list_of_hardware)
+
+
+def count_statements(app, counter) -> dict:
+    client = app.test_client()
+    requests = {
+        '/': lambda: client.get('/'),
+        '/hardware_table': lambda: client.get('/hardware_table', query_string={
+            'draw': 1, 'start': 0, 'length': max(datatables.PAGE_LENGTHS), 'search[value]': 'o'}),
+    }
+    counts = {}
+    for name, request in requests.items():
+        row_cache.clear()
+        model.reference_cache.invalidate()
+        counter.count = 0
+        response = request()
+        check(response.status_code == 200, f'{name} answered {response.status_code}')
+        counts[name] = counter.count
+
+    row_cache.clear()
+    with app.test_request_context('/'):
+        counter.count = 0
+        rows = all_rows_html()
+        counts['all rows'] = counter.count
+        remove_session()
+    return counts, len(rows)
+
+
+def run(items):
+    from app import app
+
+    counter = StatementCounter()
+    results = []
+    for size in (items, items * 10):
+        model.Base.metadata.drop_all(get_engine())
+        generate(size, history=1)
+        counts, rows = count_statements(app, counter)
+        check(rows == size, f'{rows} rows rendered of {size}')
+        check(counts['all rows'] == 2, f'all rows: {counts["all rows"]} statements, count and one SELECT expected')
+        print(f'{size:7} items: ' + ', '.join(f'{name} {count} statements' for name, count in counts.items()))
+        results.append(counts)
+    check(results[0] == results[1], f'statement counts grow with the rows: {results[0]} -> {results[1]}')
+    print('statement counts do not depend on the number of rows')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=200)
+    args = parser.parse_args()
+    main(run, args.items)
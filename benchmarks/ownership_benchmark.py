@@ -0,0 +1,135 @@
+"""
+Point-in-time ownership queries (modules/ownership.py) with and without snapshots on the synthetic dataset.
+
+    python -m benchmarks.ownership_benchmark [--scale small|medium|large] [--items N] [--history N]
+                                             [--period month] [--queries 50]
+
+Measures who held an item, what a worker and a department held at the end of past days, once replaying
+the history from the first act and once from the nearest monthly snapshot, and the time to take the snapshots.
+Results with snapshots are checked against the full replay, and a back-dated act must invalidate the snapshots.
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from benchmarks.dataset import generate, scale_arguments, scale_size
+import modules.model as model
+import modules.ownership as ownership
+from modules.session_manager import get_engine, remove_session
+
+
+def timed(function, *args) -> tuple:
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def as_of_dates(rnd, count) -> list:
+    # the dataset history covers about the last year
+    return [date.today() - timedelta(days=rnd.randint(1, 360)) for _ in range(count)]
+
+
+def departments_with_workers() -> list:
+    workers = model.Worker.__table__
+    with get_engine().connect() as conn:
+        return sorted(set(conn.execute(workers.select().with_only_columns(workers.c.department_id)).scalars()))
+
+
+def measure(cases) -> dict:
+    """
+    name -> (median ms, max ms, median acts replayed, results)
+    """
+    report = {}
+    for name, function, arguments in cases:
+        timings, replayed, results = [], [], []
+        for args in arguments:
+            ms, result = timed(function, *args)
+            timings.append(ms)
+            replayed.append(result.get('events_replayed', 1))
+            results.append(result)
+        report[name] = (statistics.median(timings), max(timings), statistics.median(replayed), results)
+    return report
+
+
+def print_report(title, report):
+    print(title)
+    for name, (median_ms, max_ms, replayed, _) in report.items():
+        print(f'  {name:>10}: median {median_ms:9.2f} ms, max {max_ms:9.2f} ms, {replayed:9.0f} acts replayed')
+
+
+def check_invalidation(dataset):
+    """
+    Back-dated act deletes the snapshots of its date and later, the next backfill takes them again
+    """
+    runs = model.OwnershipSnapshotRun.__table__
+    with get_engine().connect() as conn:
+        before = set(conn.execute(runs.select().with_only_columns(runs.c.snapshot_date)).scalars())
+    doc_date = date.today() - timedelta(days=45)
+    hardware_id = dataset.take_free(1)[0]
+    arrange = model.ArrangeHardware(hardware_id=[str(hardware_id)], it_worker=['1'], employee=[str(dataset.worker_ids[0])],
+                                    operation=[str(model.ArrangeOperation.ACCEPT)], doc_num=['0'],
+                                    doc_date=[doc_date.isoformat()], employee_2=[''])
+    message, status = arrange()
+    remove_session()
+    assert status == model.ArrangeHardware.STATUS_MESSAGES[0]['status'], message
+    with get_engine().connect() as conn:
+        after = set(conn.execute(runs.select().with_only_columns(runs.c.snapshot_date)).scalars())
+    assert after == {day for day in before if day < doc_date}, (sorted(before), sorted(after))
+
+    as_of = max(before)
+    held = ownership.holdings([dataset.worker_ids[0]], as_of)
+    assert any(row['hardware_id'] == hardware_id for row in held['hardware'])
+    retaken = ownership.backfill()
+    assert {snapshot['snapshot_date'] for snapshot in retaken} == before - after
+    assert ownership.holdings([dataset.worker_ids[0]], as_of)['hardware'] == held['hardware']
+    print(f'back-dated act {doc_date} invalidated {len(before - after)} snapshot(s), taken again')
+
+
+def run(items, history, period, queries):
+    start = time.perf_counter()
+    dataset = generate(items, history)
+    print(f'{dataset.items} items, {dataset.workers} workers, {dataset.history_rows} acts in the history '
+          f'({time.perf_counter() - start:.1f} s to generate)')
+
+    rnd = random.Random(3)
+    hardware_ids = [rnd.randint(1, dataset.items) for _ in range(queries)]
+    worker_ids = [rnd.choice(dataset.worker_ids) for _ in range(queries)]
+    department_ids = departments_with_workers()
+    dates = as_of_dates(rnd, queries)
+    cases = [
+        ('item', ownership.hardware_owner, list(zip(hardware_ids, dates))),
+        ('worker', ownership.holdings, [([worker_id], day) for worker_id, day in zip(worker_ids, dates)]),
+        ('department', lambda department_id, day: ownership.holdings(ownership.department_workers(department_id), day),
+         [(rnd.choice(department_ids), day) for day in dates[:max(queries // 5, 1)]]),
+        ('all', ownership.holdings, [(None, day) for day in dates[:3]]),
+    ]
+
+    replay = measure(cases)
+    print_report('without snapshots (replay from the first act):', replay)
+
+    ms, taken = timed(ownership.backfill, None, period)
+    print(f'{len(taken)} {period} snapshot(s) taken in {ms:.0f} ms '
+          f'({sum(snapshot["hardware_count"] for snapshot in taken)} rows)')
+
+    snapshots = measure(cases)
+    print_report('with snapshots:', snapshots)
+
+    for name in replay:
+        assert _without_replay_info(replay[name][3]) == _without_replay_info(snapshots[name][3]), name
+    print('results with snapshots match the full replay')
+    check_invalidation(dataset)
+
+
+def _without_replay_info(results) -> list:
+    return [result.get('hardware', result) for result in results]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    scale_arguments(parser)
+    parser.add_argument('--period', choices=ownership.PERIODS, default='month')
+    parser.add_argument('--queries', type=int, default=50)
+    args = parser.parse_args()
+    run(*scale_size(args), args.period, args.queries)
@@ -0,0 +1,75 @@
+"""
+Check of the read replica routing on two local SQLite files (primary and a copy as the replica).
+
+    python -m benchmarks.replica_check [--sticky 1]
+
+The replica is a copy of the primary made before an arrange act, so it "lags" behind:
+read-only views of other users read the replica, the user who made the act reads the primary
+until the sticky window (--sticky seconds) is over, writes always go to the primary.
+Regression check of the replica routing: exits with status 1 if any step fails.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.checks import check, main
+
+DB_DIR = tempfile.mkdtemp(prefix='hardware_replica_')
+PRIMARY_FILE = os.path.join(DB_DIR, 'primary.db')
+REPLICA_FILE = os.path.join(DB_DIR, 'replica.db')
+
+
+def history(client, hardware_id) -> list:
+    response = client.get(f'/api/hardware/{hardware_id}/history')
+    check(response.status_code == 200, f'history of {hardware_id}: status {response.status_code}')
+    return response.get_json()['history']
+
+
+def run(sticky):
+    import modules.session_manager as session_manager
+    from benchmarks.arrange_benchmark import seed
+
+    seed(10)
+    session_manager.get_engine().dispose()
+    shutil.copyfile(PRIMARY_FILE, REPLICA_FILE)
+
+    from app import app
+    writer, reader = app.test_client(), app.test_client()
+    check(history(reader, 1) == [] and history(writer, 1) == [], 'the seeded hardware has history')
+
+    act = {'hardware_id': [1, 2], 'it_worker': 1, 'employee': 2, 'operation': 1}
+    response = writer.post('/api/arrange_batch', json={'acts': [act]})
+    check(response.status_code == 200 and response.get_json()['results'][0]['doc_num'] == 1,
+          f'act failed: {response.get_data(as_text=True)}')
+    check(writer.get_cookie(session_manager.STICKY_COOKIE) is not None, 'no sticky cookie after the write')
+    print('write went to the primary, the replica lags behind')
+
+    check(len(history(writer, 1)) == 1, 'writer does not read own act from the primary')
+    print('writer reads own act from the primary')
+    check(history(reader, 1) == [], 'other users read the primary')
+    print('other users read the replica')
+
+    time.sleep(sticky + 0.1)
+    check(history(writer, 1) == [], f'writer still reads the primary after {sticky} s')
+    print(f'writer reads the replica again after {sticky} s')
+
+    inventory = json.loads(writer.get('/export/inventory.json').get_data(as_text=True))
+    check(not any(row['doc_num'] for row in inventory), f'export reads the primary: {inventory[:2]}')
+    print('export reads the replica')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sticky', type=int, default=1, help='seconds the writer reads from the primary')
+    args = parser.parse_args()
+    # settings are read on import of the modules
+    os.environ['HARDWARE_DB_URL'] = f'sqlite:///{PRIMARY_FILE}'
+    os.environ['HARDWARE_DB_READ_URL'] = f'sqlite:///{REPLICA_FILE}'
+    os.environ['HARDWARE_DB_READ_STICKY_SEC'] = str(args.sticky)
+    try:
+        main(run, args.sticky)
+    finally:
+        shutil.rmtree(DB_DIR, ignore_errors=True)
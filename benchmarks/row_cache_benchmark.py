@@ -0,0 +1,81 @@
+"""
+Rendering time of the hardware table rows with and without the row fragment cache.
+
+    python -m benchmarks.row_cache_benchmark [--items 20000] [--changed 0.01] [--repeat 3]
+
+Seeds a synthetic inventory (benchmarks/dataset.py), loads all rows once and renders them with
+the fill_hardware_table macro: without cache, into an empty cache, from a warm cache and after
+--changed share of the items was edited (only the changed rows are rendered again).
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.dataset import generate
+from app import app
+import modules.datatables as datatables
+import modules.model as model
+from modules.fragment_cache import row_cache
+from modules.session_manager import get_engine, remove_session
+
+
+def load_rows() -> list:
+    remove_session()
+    return model.Hardware.get_hardware_page(start=0, length=None)[2]
+
+
+def render(rows, repeat=1) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        datatables.hardware_rows_html(rows)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def edit(items, share):
+    """
+    Rename every 1/share-th item. log_date is set by the column onupdate
+    """
+    step = max(int(1 / share), 1)
+    hardware = model.Hardware.__table__
+    with get_engine().begin() as conn:
+        conn.execute(hardware.update().where(hardware.c.hardware_id % step == 0)
+                     .values(name=hardware.c.name + ' (edited)'))
+    return items // step
+
+
+def run(items, share, repeat):
+    generate(items, history=2)
+    with app.test_request_context():
+        rows = load_rows()
+        max_bytes = row_cache.max_bytes
+        row_cache.max_bytes = 0
+        uncached_ms = render(rows, repeat)
+        row_cache.max_bytes = max_bytes
+
+        cold_ms = render(rows)
+        warm_ms = render(rows, repeat)
+        changed = edit(items, share)
+        rows = load_rows()
+        hits_before = row_cache.hits
+        partial_ms = render(rows)
+        partial_hits = row_cache.hits - hits_before
+
+    stats = row_cache.stats()
+    print(f'{len(rows)} rows')
+    print(f'   without cache: {uncached_ms:8.1f} ms')
+    print(f'     empty cache: {cold_ms:8.1f} ms')
+    print(f'      warm cache: {warm_ms:8.1f} ms ({uncached_ms / warm_ms:.0f}x faster)')
+    print(f'{changed:>6} changed: {partial_ms:8.1f} ms, {partial_hits} rows from the cache')
+    print(f'cache: {stats["entries"]} entries, {stats["size_kib"]:.0f} KiB of {stats["max_kib"]:.0f} KiB, '
+          f'hit rate {stats["hit_rate"]}, {stats["evictions"]} evictions')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--changed', type=float, default=0.01, help='share of the items edited before the last run')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.items, args.changed, args.repeat)
@@ -0,0 +1,101 @@
+"""
+Typeahead search index build time and query latency on a local SQLite database.
+
+    python -m benchmarks.search_benchmark [--items 100000] [--workers 2000] [--queries 200]
+
+Seeds --items hardware with varied names and serial numbers, builds the index and measures
+latency of code, serial, name prefix, name fragment, misspelled and worker name queries,
+and of incremental updates after an edit and an arrange act.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.arrange_benchmark import seed, act
+import modules.model as model
+from modules.search_index import search_index
+from modules.session_manager import get_engine, remove_session
+
+MODELS = ['Latitude', 'ThinkPad', 'EliteBook', 'ProBook', 'MacBook', 'OptiPlex', 'iPhone', 'Galaxy', 'LaserJet',
+          'Monitor', 'Docking station', 'Router']
+FIRST_NAMES = ['Aziz', 'Bobur', 'Dilnoza', 'Farrukh', 'Gulnora', 'Jasur', 'Kamola', 'Nodira', 'Rustam', 'Sardor']
+LAST_NAMES = ['Abdullaev', 'Karimov', 'Rakhimova', 'Sultanov', 'Tashkentova', 'Usmanov', 'Yusupov', 'Zakirov']
+
+
+def add_data(items, workers):
+    rnd = random.Random(1)
+    with get_engine().begin() as conn:
+        conn.execute(model.Hardware.__table__.insert(),
+                     [{'hardware_id': i, 'name': f'{rnd.choice(MODELS)} {rnd.randint(100, 9999)}',
+                       'serial_num': f'{rnd.choice("ABCDEFGH")}{rnd.randint(10 ** 8, 10 ** 9 - 1)}',
+                       'id_condition': 1, 'id_type': 1, 'id_brand': 1} for i in range(1, items + 1)])
+        conn.execute(model.Worker.__table__.insert(),
+                     [{'worker_id': 1000 + i, 'name': f'{rnd.choice(LAST_NAMES)} {rnd.choice(FIRST_NAMES)} {i}',
+                       'department_id': 2} for i in range(workers)])
+
+
+def queries(items, count):
+    rnd = random.Random(2)
+    with get_engine().connect() as conn:
+        sample = conn.execute(model.Hardware.__table__.select().order_by(model.Hardware.hardware_id)
+                              .limit(count)).all()
+    hardware_ids = [rnd.randint(1, items) for _ in range(count)]
+    return {
+        'inventory code': [str(i).zfill(8) for i in hardware_ids],
+        'code prefix': [str(i)[:3] for i in hardware_ids],
+        'serial prefix': [row.serial_num[:6] for row in sample],
+        'name prefix': [row.name.split()[0][:4] for row in sample],
+        'name fragment': [row.name.split()[0][2:6] for row in sample],
+        'misspelled': [row.name.split()[0].replace('a', 'e', 1) for row in sample],
+        'worker name': [f'{rnd.choice(LAST_NAMES)[:5]}' for _ in range(count)],
+    }
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def run(items, workers, count):
+    seed(0)
+    add_data(items, workers)
+    model.HoldingsSummary.rebuild()
+
+    build_ms, _ = measure(search_index.ensure_built)
+    stats = search_index.stats()
+    print(f'build: {build_ms:.0f} ms for {stats["documents"]} documents, {stats["terms"]} terms, '
+          f'{stats["trigrams"]} trigrams')
+
+    for name, texts in queries(items, count).items():
+        timings, found = [], 0
+        for text in texts:
+            elapsed, results = measure(search_index.search, text)
+            timings.append(elapsed)
+            found += bool(results)
+        timings.sort()
+        print(f'{name:>15}: median {statistics.median(timings):6.2f} ms, p99 {timings[int(len(timings) * 0.99) - 1]:6.2f} ms, '
+              f'max {timings[-1]:6.2f} ms, {found}/{len(texts)} with results')
+
+    hardware = model.Hardware(hardware_id=1, hardware_name='Renamed laptop', condition_id=1, type_id=1, brand_id=1,
+                              validation_date=None, serial='ZZ123')
+    edit_ms, _ = measure(hardware.edit_hardware)
+    remove_session()
+    assert search_index.search('ZZ123')[0]['id'] == 1
+
+    arrange = act(list(range(1, 1001)), model.ArrangeOperation.ACCEPT, doc_num=0)
+    arrange_ms, (message, status) = measure(arrange)
+    remove_session()
+    assert status == model.ArrangeHardware.STATUS_MESSAGES[0]['status'], message
+    assert search_index.search('00000001')[0]['owner'] == 'Employee'
+    print(f'edit of 1 item: {edit_ms:.1f} ms, arrange act of 1000 items: {arrange_ms:.1f} ms (incl. index update)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    run(args.items, args.workers, args.queries)
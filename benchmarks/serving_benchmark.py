@@ -0,0 +1,135 @@
+"""
+Throughput of the production serving profile (gunicorn.conf.py, needs gunicorn) with 1..N worker processes.
+
+    python -m benchmarks.serving_benchmark [--workers 1 2 4] [--clients 8] [--duration 10] [--items 20000]
+
+For every number of workers gunicorn is started on a local SQLite database and --clients client processes
+send requests for --duration seconds: the hardware list page (/, full render without ETag) and arrange
+acts (/api/arrange_batch, accept and return of 5 items of the client). Prints requests per second, latency
+and the speed-up against one worker. Every act must succeed: a DB connection shared by two workers would
+fail them. SQLite takes one writer at a time, so on SQLite the acts scale less than on MSSQL.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 8765
+ACT_ITEMS = 5
+
+
+def list_page(conn, client, number):
+    conn.request('GET', '/')
+    response = conn.getresponse()
+    response.read()
+    return response.status == 200
+
+
+def arrange(conn, client, number):
+    """
+    Accept the items of the client, then return them
+    """
+    operation = 1 if number % 2 == 0 else 2
+    hardware_ids = list(range(client * ACT_ITEMS + 1, (client + 1) * ACT_ITEMS + 1))
+    body = json.dumps({'acts': [{'hardware_id': hardware_ids, 'it_worker': 1, 'employee': 2, 'operation': operation}]})
+    conn.request('POST', '/api/arrange_batch', body=body, headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    result = json.loads(response.read())
+    return response.status == 200 and result['results'][0]['doc_num'] is not None
+
+
+SCENARIOS = {'/': list_page, '/api/arrange_batch': arrange}
+
+
+def client_load(scenario, client, duration) -> tuple:
+    """
+    Requests of one client process over a keep-alive connection
+    :return: (latencies in ms, failed requests)
+    """
+    request = SCENARIOS[scenario]
+    conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=60)
+    latencies, failed = [], 0
+    deadline = time.perf_counter() + duration
+    number = 0
+    # an even number of requests: the items of the client are returned at the end
+    while time.perf_counter() < deadline or number % 2:
+        start = time.perf_counter()
+        if request(conn, client, number):
+            latencies.append((time.perf_counter() - start) * 1000)
+        else:
+            failed += 1
+        number += 1
+    conn.close()
+    return latencies, failed
+
+
+def start_server(workers, db_url, log_path) -> subprocess.Popen:
+    env = dict(os.environ, HARDWARE_DB_URL=db_url, HARDWARE_WORKERS=str(workers), HARDWARE_BIND=f'127.0.0.1:{PORT}')
+    log = open(log_path, 'a')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], cwd=ROOT, env=env,
+                              stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=5)
+            conn.request('GET', '/pool_status')
+            if conn.getresponse().status == 200:
+                # the other workers finish their warm-up meanwhile
+                time.sleep(1)
+                return server
+        except OSError:
+            time.sleep(0.2)
+        if server.poll() is not None:
+            break
+    server.terminate()
+    raise RuntimeError(f'gunicorn did not start, see {log_path}')
+
+
+def measure(pool, scenario, clients, duration) -> dict:
+    results = pool.starmap(client_load, [(scenario, client, duration) for client in range(clients)])
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    failed = sum(client_failed for _, client_failed in results)
+    if failed:
+        raise RuntimeError(f'{failed} request(s) of {scenario} failed')
+    return {'rps': len(latencies) / duration, 'p50': statistics.median(latencies),
+            'p95': latencies[int(len(latencies) * 0.95)]}
+
+
+def run(worker_counts, clients, duration, items):
+    from benchmarks.arrange_benchmark import DB_FILE, seed
+
+    seed(max(items, clients * ACT_ITEMS))
+    log_path = os.path.join(tempfile.gettempdir(), 'serving_benchmark.log')
+    print(f'{items} items, {clients} clients, {duration} s per case, {os.cpu_count()} CPU(s), log: {log_path}')
+
+    baseline = {}
+    with multiprocessing.get_context('spawn').Pool(clients) as pool:
+        for workers in worker_counts:
+            server = start_server(workers, f'sqlite:///{DB_FILE}', log_path)
+            try:
+                for scenario in SCENARIOS:
+                    result = measure(pool, scenario, clients, duration)
+                    baseline.setdefault(scenario, result['rps'])
+                    print(f'{workers:2} worker(s) {scenario:>20}: {result["rps"]:7.1f} req/s '
+                          f'(x{result["rps"] / baseline[scenario]:.2f}), '
+                          f'median {result["p50"]:6.1f} ms, p95 {result["p95"]:6.1f} ms')
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--items', type=int, default=20000)
+    args = parser.parse_args()
+    run(args.workers, args.clients, args.duration, args.items)
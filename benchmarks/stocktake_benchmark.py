@@ -0,0 +1,150 @@
+"""
+Stocktake with many scanners sending batches at once (modules/stocktake.py).
+
+    python -m benchmarks.stocktake_benchmark [--items 100000] [--history 1] [--scanners 40] [--batch 50]
+
+Opens a stocktake of all hardware in use of the synthetic dataset, then --scanners threads walk the workers
+and send --batch scans per call: most hardware at its owner, some at another worker, some free or unknown
+codes, some scanned twice, some not scanned at all. Prints the latency of the batches and the time of one
+full recompute of the lists, and checks the incremental lists against the full recompute.
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+
+from benchmarks.dataset import generate
+import modules.model as model
+from modules.stocktake import FOUND, MISASSIGNED, MISSING, UNEXPECTED, Stocktakes
+from modules.session_manager import get_engine
+
+SKIPPED = 0.05  # share of the expected hardware not scanned
+MISPLACED = 0.03  # scanned at the place of another worker
+EXTRA = 0.02  # free hardware or unknown codes, per scan
+REPEATED = 0.02  # scanned again
+
+
+def scan_plan(dataset, scanners, rnd) -> list:
+    """
+    Scans of every scanner: the workers are split between the scanners
+    """
+    holdings = {}
+    for hardware_id, employee_id in dataset.owners.items():
+        holdings.setdefault(employee_id, []).append(hardware_id)
+    free = [hardware_id for hardware_id in range(1, dataset.items + 1) if hardware_id not in dataset.owners]
+    plans = [[] for _ in range(scanners)]
+    for number, worker_id in enumerate(sorted(holdings)):
+        plan = plans[number % scanners]
+        for hardware_id in holdings[worker_id]:
+            if rnd.random() < SKIPPED:
+                continue
+            location = rnd.choice(dataset.worker_ids) if rnd.random() < MISPLACED else worker_id
+            plan.append({'code': f'{hardware_id:06d}', 'location': location})
+            if rnd.random() < REPEATED:
+                plan.append({'code': f'{hardware_id:06d}', 'location': location})
+            if rnd.random() < EXTRA:
+                code = rnd.choice(free) if rnd.random() < 0.5 else dataset.items + rnd.randint(1, 10000)
+                plan.append({'code': f'{code:06d}', 'location': worker_id})
+    for number, plan in enumerate(plans):
+        for scan in plan:
+            scan['scanner'] = f'scanner-{number}'
+    return plans
+
+
+def scanner(engine, stocktake_id, plan, batch, timings, errors):
+    try:
+        for first in range(0, len(plan), batch):
+            start = time.perf_counter()
+            engine.add_scans(stocktake_id, plan[first:first + batch])
+            timings.append((time.perf_counter() - start) * 1000)
+    except Exception as error:
+        errors.append(error)
+
+
+def recompute(stocktake_id) -> dict:
+    """
+    Lists from the expected holdings and all scans at once, as without the incremental state
+    """
+    expected_table = model.StocktakeExpected.__table__
+    scans = model.StocktakeScan.__table__
+    hardware_use = model.HardwareUse.__table__
+    with get_engine().connect() as conn:
+        expected = dict(conn.execute(expected_table.select()
+                                     .with_only_columns(expected_table.c.hardware_id, expected_table.c.employee_id)
+                                     .where(expected_table.c.stocktake_id == stocktake_id)).all())
+        last_scan = dict(conn.execute(scans.select().with_only_columns(scans.c.hardware_id, scans.c.location_id)
+                                      .where(scans.c.stocktake_id == stocktake_id).order_by(scans.c.seq)).all())
+        in_use = dict(conn.execute(hardware_use.select()
+                                   .with_only_columns(hardware_use.c.hardware_id, hardware_use.c.employee_id)
+                                   .where(hardware_use.c.status_id == model.ArrangeStatus.IN_USE)).all())
+    lists = {MISSING: set(expected) - set(last_scan), FOUND: set(), MISASSIGNED: set(), UNEXPECTED: set()}
+    for hardware_id, location_id in last_scan.items():
+        owner = expected.get(hardware_id, in_use.get(hardware_id))
+        if owner is None:
+            lists[UNEXPECTED].add(hardware_id)
+        else:
+            lists[FOUND if owner == location_id else MISASSIGNED].add(hardware_id)
+    return lists
+
+
+def incremental_lists(engine, stocktake_id) -> dict:
+    lists = {}
+    for list_name in (MISSING, FOUND, MISASSIGNED, UNEXPECTED):
+        lists[list_name], after = set(), None
+        while True:
+            items, after = engine.items(stocktake_id, list_name, after=after, limit=1000)
+            lists[list_name].update(item['hardware_id'] for item in items)
+            if after is None:
+                break
+    return lists
+
+
+def run(items, history, scanners, batch):
+    start = time.perf_counter()
+    dataset = generate(items, history)
+    print(f'{items} items, {len(dataset.owners)} in use ({time.perf_counter() - start:.1f} s to generate)')
+
+    engine = Stocktakes()
+    start = time.perf_counter()
+    stocktake = engine.open('benchmark')
+    engine.state(stocktake['stocktake_id'])
+    print(f'stocktake opened and indexed in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+    plans = scan_plan(dataset, scanners, random.Random(2))
+    timings, errors = [], []
+    threads = [threading.Thread(target=scanner, args=(engine, stocktake['stocktake_id'], plan, batch, timings, errors))
+               for plan in plans]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    scans = sum(len(plan) for plan in plans)
+    timings.sort()
+    print(f'{scanners} scanners, {len(timings)} batches of {batch}: {scans / elapsed:.0f} scans/s, '
+          f'batch median {statistics.median(timings):.1f} ms, p95 {timings[int(len(timings) * 0.95)]:.1f} ms, '
+          f'max {timings[-1]:.1f} ms')
+
+    start = time.perf_counter()
+    expected = recompute(stocktake['stocktake_id'])
+    print(f'full recompute: {(time.perf_counter() - start) * 1000:.0f} ms')
+    print(', '.join(f'{name}: {count}' for name, count in engine.summary(stocktake['stocktake_id'])['counts'].items()))
+
+    # a second process (new state) must reach the same lists from the saved scans
+    for name, check in (('incremental', engine), ('other process', Stocktakes())):
+        assert incremental_lists(check, stocktake['stocktake_id']) == expected, f'{name} lists differ from the recompute'
+    print('lists match the full recompute')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--history', type=int, default=1)
+    parser.add_argument('--scanners', type=int, default=40)
+    parser.add_argument('--batch', type=int, default=50)
+    args = parser.parse_args()
+    run(args.items, args.history, args.scanners, args.batch)
@@ -0,0 +1,206 @@
+"""
+Benchmark suite of the model layer hot paths on a synthetic SQLite dataset (benchmarks/dataset.py).
+
+    python -m benchmarks.suite [--scale small|medium|large] [--repeat 5] [--output results.json]
+                               [--compare previous.json]
+
+Every case is run --repeat times. Reported per case: median/min/max time, SQL statements per run
+and peak of Python memory allocations (tracemalloc). Results are written to JSON with the commit
+and versions, --compare prints the change against a previous result file.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks.arrange_benchmark import act
+from benchmarks.dataset import generate, scale_arguments, scale_size
+import modules.model as model
+from modules.session_manager import remove_session
+
+ACT_ITEMS = [1, 100]
+REGRESSION_THRESHOLD = 0.2  # --compare marks changes of the median time above 20%
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+        event.listen(Engine, 'after_cursor_execute', self.count_statement)
+
+    def count_statement(self, *args):
+        self.count += 1
+
+
+def measure(case, repeat, counter) -> dict:
+    """
+    :param case: function(run number) -> function to measure. Preparation is not measured
+    """
+    timings, statements, peaks = [], [], []
+    for run_num in range(repeat):
+        function = case(run_num)
+        remove_session()
+        model.reference_cache.invalidate()
+        counter.count = 0
+        tracemalloc.start()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        statements.append(counter.count)
+        remove_session()
+
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'min_ms': round(min(timings) * 1000, 3),
+        'max_ms': round(max(timings) * 1000, 3),
+        'statements': max(statements),
+        'peak_kib': round(max(peaks) / 1024, 1),
+    }
+
+
+def cases(dataset) -> dict:
+    """
+    name -> function(run number) -> measured function
+    """
+    def list_page(**params):
+        return lambda run_num: lambda: model.Hardware.get_hardware_page(**params)
+
+    def pre_arrange(count):
+        hardware_ids = [str(hardware_id) for hardware_id in range(1, count + 1)]
+        return lambda run_num: lambda: model.PreArrange(hardware=hardware_ids)
+
+    def accept(count):
+        hardware_ids = dataset.take_free(count)
+
+        def prepare(run_num):
+            if run_num > 0:
+                _check(act(hardware_ids, model.ArrangeOperation.RETURN, 0))  # accepted by the previous run
+            arrange = act(hardware_ids, model.ArrangeOperation.ACCEPT, 0)
+            return lambda: _check(arrange)
+        return prepare
+
+    def return_(count):
+        hardware_ids = dataset.take_free(count)
+
+        def prepare(run_num):
+            _check(act(hardware_ids, model.ArrangeOperation.ACCEPT, 0))
+            arrange = act(hardware_ids, model.ArrangeOperation.RETURN, 0)
+            return lambda: _check(arrange)
+        return prepare
+
+    def transfer(count):
+        hardware_ids = dataset.take_free(count)
+        first, second = dataset.worker_ids[:2]
+
+        def prepare(run_num):
+            if run_num == 0:
+                accept = act(hardware_ids, model.ArrangeOperation.ACCEPT, 0)
+                accept.employee_id = first
+                _check(accept)
+            # hardware moves back and forth between two workers
+            arrange = act(hardware_ids, model.ArrangeOperation.TRANSFER, 0)
+            arrange.employee_id, arrange.employee2_id = (first, second) if run_num % 2 == 0 else (second, first)
+            return lambda: _check(arrange)
+        return prepare
+
+    def history(get_history, object_id):
+        return lambda run_num: lambda: get_history(object_id)
+
+    def edit(run_num):
+        hardware = model.Hardware(hardware_id=1, hardware_name=f'Edited {run_num}', condition_id=1,
+                                  type_id=1 + run_num % 2, brand_id=1, validation_date=None)
+        return hardware.edit_hardware
+
+    result = {
+        'list_page_first': list_page(start=0, length=10),
+        'list_page_deep': list_page(start=dataset.items // 2, length=10),
+        'list_page_search': list_page(start=0, length=10, search='lapt'),
+        'list_page_sort_status': list_page(start=0, length=10, order_column=8, order_dir='desc'),
+    }
+    for count in ACT_ITEMS:
+        result[f'pre_arrange_{count}'] = pre_arrange(count)
+        result[f'arrange_accept_{count}'] = accept(count)
+        result[f'arrange_return_{count}'] = return_(count)
+        result[f'arrange_transfer_{count}'] = transfer(count)
+    result.update({
+        'history_hardware': history(model.ArrangeHardware.get_hardware_arrangement, 1),
+        'history_worker': history(model.ArrangeHardware.get_worker_arrangement, dataset.busiest_worker()),
+        'edit_hardware': edit,
+    })
+    return result
+
+
+def _check(arrange):
+    message, status = arrange()
+    remove_session()
+    assert status == model.ArrangeHardware.STATUS_MESSAGES[0]['status'], message
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    print(f'\ncompared with {previous["meta"].get("commit")} ({previous["meta"].get("date")}):')
+    for name, result in results['cases'].items():
+        before = previous['cases'].get(name)
+        if not before:
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0
+        mark = ' <-- slower' if change > REGRESSION_THRESHOLD else ''
+        print(f'{name:>24}: {before["median_ms"]:9.2f} -> {result["median_ms"]:9.2f} ms ({change:+.0%}), '
+              f'statements {before["statements"]} -> {result["statements"]}{mark}')
+
+
+def run(args):
+    items, history = scale_size(args)
+    start = time.perf_counter()
+    dataset = generate(items, history)
+    print(f'dataset: {items} items, {dataset.workers} workers, {dataset.history_rows} history rows '
+          f'({time.perf_counter() - start:.1f} s)')
+
+    counter = StatementCounter()
+    results = {
+        'meta': {'commit': git_commit(), 'date': datetime.now().isoformat(timespec='seconds'),
+                 'scale': args.scale, 'items': items, 'history': history, 'history_rows': dataset.history_rows,
+                 'repeat': args.repeat, 'python': platform.python_version(), 'sqlalchemy': sqlalchemy.__version__},
+        'cases': {},
+    }
+    for name, case in cases(dataset).items():
+        if args.cases and name not in args.cases:
+            continue
+        result = measure(case, args.repeat, counter)
+        results['cases'][name] = result
+        print(f'{name:>24}: median {result["median_ms"]:9.2f} ms, min {result["min_ms"]:9.2f} ms, '
+              f'{result["statements"]:4} statements, peak {result["peak_kib"]:9.1f} KiB')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    scale_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--cases', nargs='+', help='run only these cases')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    run(parser.parse_args())
@@ -0,0 +1,26 @@
+"""
+Production serving profile: gunicorn -c gunicorn.conf.py
+
+The app is imported once in the master (preload_app) and forked to the workers,
+every worker opens its own DB connections and loads the reference data before it takes requests.
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'wsgi:app'
+bind = os.environ.get('HARDWARE_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('HARDWARE_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('HARDWARE_THREADS', 4))
+preload_app = True
+# arrange acts and exports may run long, PDF and label sheets are rendered off the request
+timeout = int(os.environ.get('HARDWARE_WORKER_TIMEOUT', 120))
+# a worker is replaced after this many requests (0: never), limits the growth of its caches
+max_requests = int(os.environ.get('HARDWARE_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('HARDWARE_ACCESS_LOG')
+
+
+def post_fork(server, worker):
+    from modules.serving import warm_up_worker
+    warm_up_worker()
@@ -0,0 +1,11 @@
+-- Document number counters (DocCounter in modules/model.py).
+-- Arrange act numbers continue from the last number already used.
+
+CREATE TABLE doc_counters (
+    name       NVARCHAR(50) NOT NULL PRIMARY KEY,
+    last_value INT          NOT NULL DEFAULT 0
+);
+
+INSERT INTO doc_counters (name, last_value)
+SELECT 'arrange', COALESCE(MAX(doc_num), 0)
+FROM (SELECT doc_num FROM hardware_use UNION ALL SELECT doc_num FROM arranges) AS acts;
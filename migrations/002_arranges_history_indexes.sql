@@ -0,0 +1,6 @@
+-- Indexes for the arrange history pages (ArrangeHardware.get_history).
+-- Pages are read with keyset pagination on (doc_date, arrange_id) for one hardware item or one worker.
+
+CREATE INDEX ix_arranges_hardware_doc_date ON arranges (hardware_id, doc_date, arrange_id);
+CREATE INDEX ix_arranges_employee_doc_date ON arranges (employee_id, doc_date, arrange_id);
+CREATE INDEX ix_arranges_employee2_doc_date ON arranges (employee2_id, doc_date, arrange_id);
@@ -0,0 +1,4 @@
+-- Indexes for reading whole acts (ArrangeHardware.get_act) and acts of a period (PDF export).
+
+CREATE INDEX ix_arranges_doc_num ON arranges (doc_num);
+CREATE INDEX ix_arranges_doc_date ON arranges (doc_date, doc_num);
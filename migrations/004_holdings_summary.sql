@@ -0,0 +1,16 @@
+-- Materialized hardware counts by owner, type and status (HoldingsSummary in modules/model.py).
+-- employee_id 0 = no owner, hardware_type_id 0 = no type. Rebuild with `flask rebuild-holdings`.
+
+CREATE TABLE holdings_summary (
+    employee_id      INT NOT NULL,
+    hardware_type_id INT NOT NULL,
+    status_id        INT NOT NULL,
+    hardware_count   INT NOT NULL DEFAULT 0,
+    CONSTRAINT pk_holdings_summary PRIMARY KEY (employee_id, hardware_type_id, status_id)
+);
+
+INSERT INTO holdings_summary (employee_id, hardware_type_id, status_id, hardware_count)
+SELECT COALESCE(u.employee_id, 0), COALESCE(h.id_type, 0), COALESCE(u.status_id, 1), COUNT(*)
+FROM hardware AS h
+LEFT JOIN hardware_use AS u ON u.hardware_id = h.hardware_id
+GROUP BY COALESCE(u.employee_id, 0), COALESCE(h.id_type, 0), COALESCE(u.status_id, 1);
@@ -0,0 +1,16 @@
+-- Arrange acts submitted for background processing (ArrangeJob in modules/model.py).
+-- idempotency_key is unique: a double submit of the same form returns the first job.
+
+CREATE TABLE arrange_jobs (
+    job_id          VARCHAR(32)  NOT NULL,
+    idempotency_key VARCHAR(100) NOT NULL,
+    status          VARCHAR(20)  NOT NULL DEFAULT 'queued',
+    hardware_count  INT          NOT NULL DEFAULT 0,
+    doc_num         INT          NULL,
+    message         NVARCHAR(MAX) NULL,
+    message_status  VARCHAR(30)  NULL,
+    created         DATETIME     NULL,
+    finished        DATETIME     NULL,
+    CONSTRAINT pk_arrange_jobs PRIMARY KEY (job_id),
+    CONSTRAINT uq_arrange_jobs_idempotency_key UNIQUE (idempotency_key)
+);
@@ -0,0 +1,22 @@
+-- Owners of the hardware at the end of past days (OwnershipSnapshot in modules/model.py, modules/ownership.py).
+-- A snapshot is used only when its row in ownership_snapshot_runs exists; a back-dated act deletes the runs
+-- of its date and later. Take the snapshots with `flask ownership-snapshots --period month`.
+
+CREATE TABLE ownership_snapshots (
+    snapshot_date DATE NOT NULL,
+    hardware_id   INT  NOT NULL,
+    employee_id   INT  NOT NULL,
+    doc_num       INT  NULL,
+    doc_date      DATE NULL,
+    CONSTRAINT pk_ownership_snapshots PRIMARY KEY (snapshot_date, hardware_id)
+);
+
+CREATE INDEX ix_ownership_snapshots_employee ON ownership_snapshots (snapshot_date, employee_id);
+
+CREATE TABLE ownership_snapshot_runs (
+    snapshot_date  DATE     NOT NULL,
+    hardware_count INT      NOT NULL DEFAULT 0,
+    events         INT      NOT NULL DEFAULT 0,
+    created        DATETIME NULL,
+    CONSTRAINT pk_ownership_snapshot_runs PRIMARY KEY (snapshot_date)
+);
@@ -0,0 +1,32 @@
+-- Audit trail of hardware edits and arrange acts (AuditOutbox, AuditLog in modules/model.py).
+-- audit_outbox is written in the transaction of the change and emptied by the flusher of modules/audit.py,
+-- audit_log is append-only, one row per changed field.
+
+CREATE TABLE audit_outbox (
+    outbox_id   INT IDENTITY(1, 1) NOT NULL,
+    hardware_id INT           NOT NULL,
+    action      VARCHAR(20)   NOT NULL,
+    changes     NVARCHAR(MAX) NOT NULL,
+    changed_by  NVARCHAR(100) NULL,
+    doc_num     INT           NULL,
+    changed     DATETIME      NULL,
+    CONSTRAINT pk_audit_outbox PRIMARY KEY (outbox_id)
+);
+
+CREATE TABLE audit_log (
+    audit_id    INT IDENTITY(1, 1) NOT NULL,
+    outbox_id   INT           NOT NULL,
+    hardware_id INT           NOT NULL,
+    action      VARCHAR(20)   NOT NULL,
+    field       VARCHAR(50)   NOT NULL,
+    old_value   NVARCHAR(MAX) NULL,
+    new_value   NVARCHAR(MAX) NULL,
+    changed_by  NVARCHAR(100) NULL,
+    doc_num     INT           NULL,
+    changed     DATETIME      NOT NULL,
+    CONSTRAINT pk_audit_log PRIMARY KEY (audit_id)
+);
+
+CREATE INDEX ix_audit_log_hardware ON audit_log (hardware_id, audit_id);
+CREATE INDEX ix_audit_log_changed_by ON audit_log (changed_by, audit_id);
+CREATE UNIQUE INDEX uq_audit_log_outbox_field ON audit_log (outbox_id, field);
@@ -0,0 +1,33 @@
+-- Stocktake by scanning inventory codes (Stocktake, StocktakeExpected, StocktakeScan in modules/model.py).
+-- stocktake_expected is the copy of the holdings taken when the stocktake is opened,
+-- stocktake_scans is append-only and read by every server process after the last seq it has applied;
+-- seq is taken from stocktakes.scan_count in the transaction inserting the scans.
+
+CREATE TABLE stocktakes (
+    stocktake_id   INT IDENTITY(1, 1) NOT NULL,
+    name           NVARCHAR(100) NULL,
+    department_id  INT           NULL,
+    status         VARCHAR(20)   NOT NULL,
+    expected_count INT           NOT NULL,
+    scan_count     INT           NOT NULL,
+    created        DATETIME      NULL,
+    closed         DATETIME      NULL,
+    CONSTRAINT pk_stocktakes PRIMARY KEY (stocktake_id)
+);
+
+CREATE TABLE stocktake_expected (
+    stocktake_id INT NOT NULL,
+    hardware_id  INT NOT NULL,
+    employee_id  INT NOT NULL,
+    CONSTRAINT pk_stocktake_expected PRIMARY KEY (stocktake_id, hardware_id)
+);
+
+CREATE TABLE stocktake_scans (
+    stocktake_id INT          NOT NULL,
+    seq          INT          NOT NULL,
+    hardware_id  INT          NOT NULL,
+    location_id  INT          NOT NULL,
+    scanner      NVARCHAR(50) NULL,
+    scanned      DATETIME     NULL,
+    CONSTRAINT pk_stocktake_scans PRIMARY KEY (stocktake_id, seq)
+);
@@ -0,0 +1,5 @@
+-- Heartbeat of the arrange jobs (ArrangeJob in modules/model.py), renewed by the server process running them.
+-- A queued or running job without a recent heartbeat belongs to a stopped process and is marked failed,
+-- its idempotency key is then released for a retry.
+
+ALTER TABLE arrange_jobs ADD heartbeat DATETIME NULL;
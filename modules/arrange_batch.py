@@ -0,0 +1,218 @@
+from collections import Counter
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+from modules.model import ArrangeConflict, ArrangeHardware, ArrangeOperation, ArrangeStatus, AuditOutbox, DocCounter, \
+    Hardware, HardwareUse, HoldingsSummary, OwnershipSnapshotRun, chunks, hardware_changed
+from modules.session_manager import get_engine, load_session
+
+
+BATCH_MAX_ACTS = 1000
+TRANSACTION_ACTS = 100  # acts applied per transaction
+
+
+class ArrangeBatchError(ValueError):
+    """
+    Batch can not be processed at all (too many acts, missing or invalid fields)
+    """
+
+
+# Optional fields of the act: number is allocated on save, empty date is today, employee_2 for transfers only
+OPTIONAL_FIELDS = {'doc_num': 0, 'doc_date': '', 'employee_2': ''}
+
+
+def form_fields(act: dict) -> dict:
+    """
+    Fields of an act given as JSON (values or lists of values) in the form layout ArrangeHardware expects
+    """
+    fields = {key: [value] for key, value in OPTIONAL_FIELDS.items()}
+    for key, value in act.items():
+        if value is None:
+            value = OPTIONAL_FIELDS.get(key, value)
+        fields[key] = value if isinstance(value, list) else [value]
+    return fields
+
+
+class ArrangeBatch:
+    """
+    Many arrange acts in one call (e.g. re-issuing of hardware at the start of the year).
+    All acts are validated in the given order against one snapshot of the hardware use, updated in memory
+    by every valid act, so an act may use hardware returned by a previous act of the batch.
+    Valid acts get a contiguous block of act numbers and are applied in transactions of TRANSACTION_ACTS acts:
+    conditional UPDATEs per act, one insert of the history and one update of the holdings summary
+    per transaction. If another act changed the hardware meanwhile the transaction is rolled back
+    and its acts are applied one by one as usual (keeping their numbers)
+    """
+
+    def __init__(self, acts: list, transaction_acts=TRANSACTION_ACTS):
+        """
+        :param acts: fields of the arrange form per act (see form_fields())
+        """
+        if len(acts) > BATCH_MAX_ACTS:
+            raise ArrangeBatchError(f'At most {BATCH_MAX_ACTS} acts per batch, {len(acts)} given')
+        self.acts = []
+        for index, act in enumerate(acts):
+            try:
+                self.acts.append(ArrangeHardware(**form_fields(act)))
+            except (KeyError, ValueError, TypeError, AttributeError) as error:
+                raise ArrangeBatchError(f'Act {index}: invalid field {error}') from error
+        self.transaction_acts = transaction_acts
+        self.db_session = None
+        self.results = [None] * len(self.acts)
+        self.before = {}  # act index -> (status_id, owner) of its hardware before the act (holdings summary)
+        self.changed_ids = set()
+        self.created_use = set()  # hardware_use rows created by the committed transactions of the batch
+
+    def __call__(self) -> list:
+        """
+        :return: per act in the given order {'doc_num', 'message', 'status'} as STATUS_MESSAGES
+        """
+        self.db_session = load_session()
+        valid = self.validate(self.load_snapshot())
+        if valid:
+            first_doc_num = DocCounter.allocate(DocCounter.ARRANGE, count=len(valid))
+            for doc_num, index in enumerate(valid, start=first_doc_num):
+                self.acts[index].doc_num = doc_num
+            try:
+                for indexes in chunks(valid, self.transaction_acts):
+                    self.apply(indexes)
+            finally:
+                # also when a later transaction failed: the committed ones changed the hardware
+                if self.changed_ids:
+                    hardware_changed(sorted(self.changed_ids))
+        return self.results
+
+    def load_snapshot(self) -> dict:
+        """
+        hardware_id -> Hardware with its use, all hardware of the batch
+        """
+        hardware_ids = sorted({hardware_id for act in self.acts for hardware_id in act.hardware_id})
+        snapshot = {}
+        # a session of its own: the objects are detached when it is closed, so the commits of the batch
+        # don't expire them (no reload per object) and objects of the request session are not touched
+        with Session(bind=get_engine()) as snapshot_session:
+            for ids in chunks(hardware_ids):
+                for hardware in snapshot_session.query(Hardware).options(joinedload(Hardware.hardware_use)) \
+                        .filter(Hardware.hardware_id.in_(ids)):
+                    snapshot[hardware.hardware_id] = hardware
+        return snapshot
+
+    def validate(self, snapshot) -> list:
+        """
+        Check the acts in order against the snapshot, updated by every valid act
+        :return: indexes of the valid acts
+        """
+        # hardware_id -> (status_id, owner) as it will be after the previous acts of the batch
+        state = {hardware_id: (hardware.hardware_use.status_id or ArrangeStatus.FREE, hardware.hardware_use.employee_id)
+                 if hardware.hardware_use else (ArrangeStatus.FREE, None)
+                 for hardware_id, hardware in snapshot.items()}
+        valid = []
+        for index, act in enumerate(self.acts):
+            act.db_session = self.db_session
+            act.hardware_arrange = [snapshot[hardware_id] for hardware_id in dict.fromkeys(act.hardware_id)
+                                    if hardware_id in snapshot]
+            # same checks as ArrangeHardware.validate_operation()
+            if act.operation_id == ArrangeOperation.ACCEPT:
+                act.unavailable_hardware = [hardware for hardware in act.hardware_arrange
+                                            if state[hardware.hardware_id][0] == ArrangeStatus.IN_USE]
+                status_code = 1
+            elif act.operation_id in [ArrangeOperation.RETURN, ArrangeOperation.TRANSFER]:
+                act.unavailable_hardware = [hardware for hardware in act.hardware_arrange
+                                            if state[hardware.hardware_id][1] != act.employee_id]
+                status_code = 2
+            if act.unavailable_hardware:
+                self.results[index] = self.result(act, status_code)
+                continue
+
+            self.before[index] = [state[hardware.hardware_id] for hardware in act.hardware_arrange]
+            target = act.operation_target()
+            if target is not None:
+                for hardware in act.hardware_arrange:
+                    state[hardware.hardware_id] = target[:2]
+            valid.append(index)
+        return valid
+
+    def apply(self, indexes):
+        """
+        Apply the acts in one transaction
+        """
+        acts = [self.acts[index] for index in indexes]
+        try:
+            self.create_missing_hardware(acts)
+            summary_changes = Counter()
+            history, audit = [], []
+            for index, act in zip(indexes, acts):
+                self.update_hardware_use(act)
+                target = act.operation_target()
+                if target is not None:
+                    for hardware, (status_id, employee_id) in zip(act.hardware_arrange, self.before[index]):
+                        summary_changes[HoldingsSummary.key(hardware, employee_id=employee_id,
+                                                            status_id=status_id)] -= 1
+                        summary_changes[HoldingsSummary.key(hardware, employee_id=target[1],
+                                                            status_id=target[0])] += 1
+                history += act.history_rows()
+                audit += act.audit_rows(self.before[index])
+            if history:
+                self.db_session.execute(ArrangeHardware.__table__.insert(), history)
+                OwnershipSnapshotRun.invalidate_from(self.db_session, min(act.doc_date for act in acts))
+            AuditOutbox.add(self.db_session, audit)
+            HoldingsSummary.apply(self.db_session, summary_changes)
+            self.db_session.commit()
+        except (ArrangeConflict, IntegrityError):
+            self.db_session.rollback()
+            self.apply_one_by_one(indexes)
+            return
+        except Exception:
+            self.db_session.rollback()
+            raise
+
+        for index, act in zip(indexes, acts):
+            self.results[index] = self.result(act, 0)
+            self.changed_ids.update(hardware.hardware_id for hardware in act.hardware_arrange)
+            self.created_use.update(hardware.hardware_id for hardware in act.hardware_arrange
+                                    if not hardware.hardware_use)
+
+    def create_missing_hardware(self, acts):
+        """
+        Rows of hardware_use for the hardware used first time
+        """
+        missing = {}
+        for act in acts:
+            for hardware in act.hardware_arrange:
+                if not hardware.hardware_use and hardware.hardware_id not in self.created_use:
+                    missing[hardware.hardware_id] = {'hardware_id': hardware.hardware_id}
+        if missing:
+            self.db_session.execute(HardwareUse.__table__.insert(), list(missing.values()))
+
+    def update_hardware_use(self, act):
+        target = act.operation_target()
+        if target is None:
+            return
+        status_id, employee_id, expected = target
+        hardware_use = HardwareUse.__table__
+        for hardware_ids in chunks([hardware.hardware_id for hardware in act.hardware_arrange]):
+            result = self.db_session.execute(
+                hardware_use.update().where(hardware_use.c.hardware_id.in_(hardware_ids)).where(expected)
+                .values(doc_date=act.doc_date, doc_num=act.doc_num, status_id=status_id, employee_id=employee_id)
+            )
+            if result.rowcount != len(hardware_ids):
+                raise ArrangeConflict()
+
+    def apply_one_by_one(self, indexes):
+        """
+        Hardware was changed by another act after the snapshot: every act is validated and applied
+        in its own transaction with the number reserved for it
+        """
+        self.db_session.expire_all()
+        for index in indexes:
+            act = self.acts[index]
+            act.reserved_doc_num = act.doc_num
+            message, status = act()
+            if status == ArrangeHardware.STATUS_MESSAGES[0]['status']:
+                self.created_use.update(act.hardware_id)
+            self.results[index] = {'doc_num': act.doc_num if status == ArrangeHardware.STATUS_MESSAGES[0]['status']
+                                   else None, 'message': message, 'status': status}
+
+    @staticmethod
+    def result(act, status_code) -> dict:
+        message, status = act.get_status_message(status_code)
+        return {'doc_num': act.doc_num if status_code == 0 else None, 'message': message, 'status': status}
@@ -0,0 +1,168 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from modules.model import ArrangeHardware, ArrangeJob
+import modules.pdf_acts as pdf_acts
+
+
+logger = logging.getLogger(__name__)
+
+# /arrange_hardware enqueues the act and shows its progress instead of applying it in the request
+ARRANGE_ASYNC = os.environ.get('HARDWARE_ARRANGE_ASYNC', '0') == '1'
+ARRANGE_JOB_WORKERS = int(os.environ.get('HARDWARE_ARRANGE_JOB_WORKERS', 2))
+# The process renews the heartbeat of its jobs this often, a job without it for ARRANGE_JOB_STALE_SEC is failed
+HEARTBEAT_SEC = 10
+ARRANGE_JOB_STALE_SEC = int(os.environ.get('HARDWARE_ARRANGE_JOB_STALE_SEC', 60))
+STALE_MESSAGE = 'The server process of the act stopped, the act was not saved. Submit it again'
+# Events stream polls the job this often and ends after the timeout: it holds a server thread,
+# the browser reconnects after EVENTS_RETRY_MS
+EVENTS_POLL_SEC = 0.5
+EVENTS_TIMEOUT_SEC = 15
+EVENTS_RETRY_MS = 1000
+
+
+class ArrangeJobs:
+    """
+    Arrange acts applied in a thread pool of the server process.
+    Jobs are stored in the arrange_jobs table (status, result) so the result can be read
+    from any server process; the progress of a running act is kept in memory of the process running it.
+    A job of a stopped process was rolled back by the DB: its heartbeat gets old and the status read fails it,
+    a retry with the same idempotency key then applies the act
+    """
+
+    def __init__(self, workers=ARRANGE_JOB_WORKERS, stale_sec=ARRANGE_JOB_STALE_SEC):
+        self.workers = workers
+        self.stale_sec = stale_sec
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._progress = {}  # job id -> {'stage', 'done'} of the queued and running jobs
+        self._heartbeat = None
+        self._heartbeat_pid = None
+
+    def init_app(self, app):
+        self.app = app
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='arrange-job')
+            return self._executor
+
+    def _ensure_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is None or self._heartbeat_pid != os.getpid() or not self._heartbeat.is_alive():
+                self._heartbeat_pid = os.getpid()
+                self._heartbeat = threading.Thread(target=self._beat, name='arrange-job-heartbeat', daemon=True)
+                self._heartbeat.start()
+
+    def _beat(self):
+        while True:
+            time.sleep(HEARTBEAT_SEC)
+            with self._lock:
+                job_ids = list(self._progress)
+            if not job_ids:
+                continue
+            try:
+                ArrangeJob.beat(job_ids)
+            except Exception:
+                logger.exception('Heartbeat of the arrange jobs failed')
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        # outside of the lock, running jobs report their progress under it
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def submit(self, form_data, idempotency_key=None) -> tuple:
+        """
+        Enqueue the act
+        :param form_data: fields of the arrange form (lists of values)
+        :param idempotency_key: key of the submitted form, None for a new key
+        :return: (job, False if the job with this key was submitted before)
+        """
+        arrange = ArrangeHardware(**form_data)
+        job_id = uuid.uuid4().hex
+        while not ArrangeJob.create(job_id, idempotency_key or job_id, len(arrange.hardware_id)):
+            job = self.status(idempotency_key=idempotency_key)
+            # a failed act (a stopped process included) was rolled back, the retry takes over its key
+            if job is not None and not (job['status'] == ArrangeJob.FAILED and
+                                        ArrangeJob.release_key(idempotency_key)):
+                logger.info('Arrange act with idempotency key %s is already submitted', idempotency_key)
+                return job, False
+
+        with self._lock:
+            self._progress[job_id] = {'stage': ArrangeJob.QUEUED, 'done': 0}
+        self._ensure_heartbeat()
+        self.executor.submit(self._run, job_id, arrange)
+        return self.status(job_id), True
+
+    def _run(self, job_id, arrange):
+        with self.app.app_context():
+            ArrangeJob.update(job_id, status=ArrangeJob.RUNNING)
+            arrange.on_progress = lambda stage, done: self._set_progress(job_id, stage, done)
+            try:
+                message, message_status = arrange()
+            except Exception as error:
+                logger.exception('Arrange job %s failed', job_id)
+                ArrangeJob.update(job_id, status=ArrangeJob.FAILED, message=str(error), message_status='bg-danger',
+                                  finished=datetime.now())
+                return
+            finally:
+                with self._lock:
+                    self._progress.pop(job_id, None)
+
+            # the act is committed: the job is done whatever happens to its PDF,
+            # a failed job would release the key and a retry would apply the act again
+            success = message_status == ArrangeHardware.STATUS_MESSAGES[0]['status']
+            ArrangeJob.update(job_id, status=ArrangeJob.DONE, message=message, message_status=message_status,
+                              doc_num=arrange.doc_num if success else None, finished=datetime.now())
+            if success:
+                try:
+                    pdf_acts.pdf_acts.submit(arrange.doc_num)
+                except Exception:
+                    logger.exception('PDF of act %s was not submitted, it is rendered on the first request',
+                                     arrange.doc_num)
+
+    def _set_progress(self, job_id, stage, done):
+        with self._lock:
+            self._progress[job_id] = {'stage': stage, 'done': done}
+
+    def status(self, job_id=None, idempotency_key=None) -> dict:
+        """
+        Job status with the progress of the act if it is running in this process, None if not found.
+        A queued or running job of another process without a recent heartbeat is failed
+        """
+        job = ArrangeJob.get(job_id=job_id, idempotency_key=idempotency_key)
+        if job is None:
+            return None
+        with self._lock:
+            progress = self._progress.get(job['job_id'])
+        stale_before = datetime.now() - timedelta(seconds=self.stale_sec)
+        if (progress is None and job['status'] in (ArrangeJob.QUEUED, ArrangeJob.RUNNING)
+                and (job['heartbeat'] is None or job['heartbeat'] < stale_before)):
+            if ArrangeJob.fail_stale(job['job_id'], stale_before, STALE_MESSAGE):
+                logger.warning('Arrange job %s of a stopped process is failed', job['job_id'])
+            job = ArrangeJob.get(job_id=job['job_id'])
+        if progress is not None and job['status'] in (ArrangeJob.QUEUED, ArrangeJob.RUNNING):
+            job['stage'], job['done'] = progress['stage'], progress['done']
+        else:
+            job['stage'] = job['status']
+            job['done'] = job['hardware_count'] if job['status'] == ArrangeJob.DONE else 0
+        job['success'] = job['message_status'] == ArrangeHardware.STATUS_MESSAGES[0]['status']
+        for field in ('created', 'finished', 'heartbeat'):
+            job[field] = job[field].isoformat(timespec='seconds') if job[field] else None
+        return job
+
+    @staticmethod
+    def is_finished(job) -> bool:
+        return job['status'] in (ArrangeJob.DONE, ArrangeJob.FAILED)
+
+
+arrange_jobs = ArrangeJobs()
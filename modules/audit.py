@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import threading
+import time
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from modules.model import AuditLog, AuditOutbox, chunks
+from modules.session_manager import get_engine, get_engine_for_read
+
+
+logger = logging.getLogger(__name__)
+
+# Outbox rows are moved to the audit log this often, at most AUDIT_FLUSH_BATCH rows per transaction
+AUDIT_FLUSH_SEC = float(os.environ.get('HARDWARE_AUDIT_FLUSH_SEC', 2))
+AUDIT_FLUSH_BATCH = int(os.environ.get('HARDWARE_AUDIT_FLUSH_BATCH', 1000))
+AUDIT_PAGE_SIZE = 50
+AUDIT_MAX_PAGE_SIZE = 500
+
+
+class AuditFlusher:
+    """
+    Background thread of the server process moving the audit outbox to the audit log.
+    Every batch is one transaction: insert the field rows, delete the outbox rows.
+    Flushers of several processes may take the same rows, the unique (outbox_id, field) of the log
+    rolls back the later one
+    """
+
+    def __init__(self, interval=AUDIT_FLUSH_SEC, batch_size=AUDIT_FLUSH_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.flushed = 0
+        self.last_flush = None
+
+    def init_app(self, app):
+        # started by the first request, so the thread runs in the serving process (not in a parent forking workers)
+        app.before_request(self.ensure_started)
+
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._stop.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='audit-flusher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush_all()
+            except Exception:
+                logger.exception('Audit outbox flush failed')
+
+    def flush_all(self) -> int:
+        """
+        Flush until the outbox is empty
+        :return: number of outbox rows moved
+        """
+        total = 0
+        while True:
+            moved = self.flush()
+            total += moved
+            if moved < self.batch_size:
+                return total
+
+    def flush(self) -> int:
+        """
+        Move the oldest batch of the outbox to the audit log
+        :return: number of outbox rows moved
+        """
+        outbox = AuditOutbox.__table__
+        try:
+            with get_engine().begin() as conn:
+                rows = conn.execute(select(outbox).order_by(outbox.c.outbox_id).limit(self.batch_size)).all()
+                if not rows:
+                    return 0
+                log_rows = [log_row for row in rows for log_row in audit_log_rows(row)]
+                if log_rows:
+                    conn.execute(AuditLog.__table__.insert(), log_rows)
+                # by ids, not by range: a transaction committed later may have taken a lower id
+                for ids in chunks([row.outbox_id for row in rows]):
+                    conn.execute(outbox.delete().where(outbox.c.outbox_id.in_(ids)))
+        except IntegrityError:
+            logger.info('Audit outbox rows were flushed by another process')
+            return 0
+        self.flushed += len(rows)
+        self.last_flush = time.time()
+        return len(rows)
+
+    def stats(self) -> dict:
+        with get_engine().connect() as conn:
+            pending = conn.execute(select(func.count()).select_from(AuditOutbox.__table__)).scalar()
+        return {'pending': pending, 'flushed': self.flushed, 'last_flush': self.last_flush,
+                'interval': self.interval, 'batch_size': self.batch_size,
+                'running': self._thread is not None and self._thread.is_alive()}
+
+
+def audit_log_rows(outbox_row) -> list:
+    """
+    Rows of the audit log of one outbox row, one per changed field
+    """
+    return [{
+        'outbox_id': outbox_row.outbox_id,
+        'hardware_id': outbox_row.hardware_id,
+        'action': outbox_row.action,
+        'field': field,
+        'old_value': old_value,
+        'new_value': new_value,
+        'changed_by': outbox_row.changed_by,
+        'doc_num': outbox_row.doc_num,
+        'changed': outbox_row.changed,
+    } for field, (old_value, new_value) in json.loads(outbox_row.changes).items()]
+
+
+def get_changes(hardware_id=None, changed_by=None, after=None, limit=AUDIT_PAGE_SIZE) -> tuple:
+    """
+    Page of the audit log of the hardware or of the user, newest first. Changes still in the outbox are not shown
+    :param after: cursor of the previous page
+    :return: (list of changes, cursor of the next page or None)
+    """
+    log = AuditLog.__table__
+    limit = min(max(limit, 1), AUDIT_MAX_PAGE_SIZE)
+    query = select(log)
+    if hardware_id is not None:
+        query = query.where(log.c.hardware_id == hardware_id)
+    if changed_by is not None:
+        query = query.where(log.c.changed_by == changed_by)
+    if after:
+        query = query.where(log.c.audit_id < int(after))
+    query = query.order_by(log.c.audit_id.desc()).limit(limit + 1)
+
+    with get_engine_for_read().connect() as conn:
+        rows = conn.execute(query).mappings().all()
+    changes = [dict(row, changed=row['changed'].isoformat(timespec='seconds')) for row in rows[:limit]]
+    next_cursor = str(rows[limit - 1]['audit_id']) if len(rows) > limit else None
+    return changes, next_cursor
+
+
+audit_flusher = AuditFlusher()
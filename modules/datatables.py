@@ -0,0 +1,113 @@
+from flask import get_template_attribute
+from markupsafe import escape
+from modules.fragment_cache import row_cache
+
+
+PAGE_LENGTHS = [5, 10, 20, 50, 100]
+DEFAULT_PAGE_LENGTH = 10
+DEFAULT_ORDER_COLUMN = 1  # Hardware name
+
+
+class DataTablesRequest:
+    """
+    Parameters of the DataTables server-side processing request (draw, start, length, search, order)
+    https://datatables.net/manual/server-side
+    """
+
+    def __init__(self, args):
+        self.draw = self._int(args, 'draw', 0)
+        self.start = max(self._int(args, 'start', 0), 0)
+        self.length = self._int(args, 'length', DEFAULT_PAGE_LENGTH)
+        if not 0 < self.length <= max(PAGE_LENGTHS):
+            self.length = DEFAULT_PAGE_LENGTH
+        self.search = args.get('search[value]', '').strip()
+        self.order_column = self._int(args, 'order[0][column]', DEFAULT_ORDER_COLUMN)
+        self.order_dir = 'desc' if args.get('order[0][dir]') == 'desc' else 'asc'
+
+    @staticmethod
+    def _int(args, key, default):
+        try:
+            return int(args.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def page_params(self) -> dict:
+        """
+        Arguments for Hardware.get_hardware_page()
+        """
+        return {
+            'start': self.start,
+            'length': self.length,
+            'search': self.search,
+            'order_column': self.order_column,
+            'order_dir': self.order_dir,
+        }
+
+    def response(self, records_total, records_filtered, data) -> dict:
+        return {
+            'draw': self.draw,
+            'recordsTotal': records_total,
+            'recordsFiltered': records_filtered,
+            'data': data,
+        }
+
+
+def hardware_rows(list_of_hardware) -> list:
+    """
+    Rows of the hardware table in the same layout as the fill_hardware_table macro.
+    The last element of the row holds css classes of the cells {cell index: class}
+    """
+    actions = get_template_attribute('_macros_.html', 'hardware_actions')
+    return [row_cache.get_or_render(('data',) + row_key(hardware), lambda: _hardware_row(hardware, actions))
+            for hardware in list_of_hardware]
+
+
+def hardware_rows_html(list_of_hardware) -> list:
+    """
+    Html of the rows rendered by the fill_hardware_table macro (first page of the list)
+    """
+    fill_hardware_table = get_template_attribute('_macros_.html', 'fill_hardware_table')
+    return [row_cache.get_or_render(('html',) + row_key(hardware), lambda: fill_hardware_table(hardware))
+            for hardware in list_of_hardware]
+
+
+def row_key(hardware) -> tuple:
+    """
+    Cache key of the table row. log_date of hardware and hardware_use is updated on every write;
+    names of the condition, type and brand are in the key because they are changed in other tables
+    """
+    hardware_use = hardware.hardware_use
+    return (hardware.hardware_id, hardware.log_date, hardware_use.log_date if hardware_use else None,
+            hardware_use.status_id if hardware_use else None,
+            hardware.hardware_condition.name if hardware.hardware_condition else None,
+            hardware.hardware_type.name if hardware.hardware_type else None,
+            hardware.hardware_brand.name if hardware.hardware_brand else None)
+
+
+def _hardware_row(hardware, actions) -> list:
+    cell_classes = {}
+    if hardware.hardware_condition_id == 2:
+        cell_classes[4] = 'bg-muted'
+    if hardware.hardware_use:
+        cell_classes[8] = hardware.hardware_use.status_color()
+
+    return [
+        '{:0>9s}'.format(str(hardware.hardware_id)),
+        _text(hardware.name),
+        _text(hardware.validation_date),
+        _text(hardware.serial_num),
+        _text(hardware.hardware_condition.name if hardware.hardware_condition else None),
+        _text(hardware.hardware_type.name if hardware.hardware_type else None),
+        _text(hardware.hardware_brand.name if hardware.hardware_brand else None),
+        _text(hardware.description),
+        '',
+        str(actions(hardware)).strip(),
+        cell_classes,
+    ]
+
+
+def _text(value) -> str:
+    """
+    Cell text escaped for html, empty string for None
+    """
+    return str(escape(value)) if value is not None else ''
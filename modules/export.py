@@ -0,0 +1,187 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import date, datetime
+from sqlalchemy import select
+from modules.model import (ArrangeHardware, ArrangeOperation, ArrangeStatus, Brand, Hardware, HardwareCondition,
+                           HardwareType, HardwareUse, Worker)
+from modules.session_manager import get_engine_for_read
+
+
+YIELD_PER = 1000
+FORMATS = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+class ExportFormatError(ValueError):
+    """
+    Unknown export format or missing optional dependency
+    """
+
+
+def inventory_query():
+    """
+    Hardware with its lookups and current use (status, owner, last act). One row per hardware
+    """
+    hardware = Hardware.__table__
+    hardware_use = HardwareUse.__table__
+    employee = Worker.__table__.alias('employee')
+    return select(
+        hardware.c.hardware_id,
+        hardware.c.name,
+        HardwareCondition.__table__.c.name.label('condition'),
+        HardwareType.__table__.c.name.label('type'),
+        Brand.__table__.c.name.label('brand'),
+        hardware.c.serial_num,
+        hardware.c.descrip.label('description'),
+        hardware.c.validation_date,
+        ArrangeStatus.__table__.c.name.label('status'),
+        employee.c.worker_id.label('employee_id'),
+        employee.c.name.label('employee'),
+        hardware_use.c.doc_num,
+        hardware_use.c.doc_date,
+    ).select_from(
+        hardware
+        .outerjoin(HardwareCondition.__table__)
+        .outerjoin(HardwareType.__table__)
+        .outerjoin(Brand.__table__)
+        .outerjoin(hardware_use)
+        .outerjoin(ArrangeStatus.__table__)
+        .outerjoin(employee, employee.c.worker_id == hardware_use.c.employee_id)
+    ).order_by(hardware.c.hardware_id)
+
+
+def acts_query(date_from=None, date_to=None):
+    """
+    Arrange history rows of the period with hardware, operation and worker names
+    """
+    arranges = ArrangeHardware.__table__
+    hardware = Hardware.__table__
+    employee = Worker.__table__.alias('employee')
+    employee2 = Worker.__table__.alias('employee2')
+    it_worker = Worker.__table__.alias('it_worker')
+    query = select(
+        arranges.c.doc_num,
+        arranges.c.doc_date,
+        ArrangeOperation.__table__.c.name.label('operation'),
+        arranges.c.hardware_id,
+        hardware.c.name.label('hardware'),
+        hardware.c.serial_num,
+        employee.c.name.label('employee'),
+        employee2.c.name.label('employee2'),
+        it_worker.c.name.label('it_worker'),
+    ).select_from(
+        arranges
+        .outerjoin(hardware, hardware.c.hardware_id == arranges.c.hardware_id)
+        .outerjoin(ArrangeOperation.__table__)
+        .outerjoin(employee, employee.c.worker_id == arranges.c.employee_id)
+        .outerjoin(employee2, employee2.c.worker_id == arranges.c.employee2_id)
+        .outerjoin(it_worker, it_worker.c.worker_id == arranges.c.it_worker_id)
+    )
+    if date_from:
+        query = query.where(arranges.c.doc_date >= date_from)
+    if date_to:
+        query = query.where(arranges.c.doc_date <= date_to)
+    return query.order_by(arranges.c.doc_date, arranges.c.doc_num, arranges.c.arrange_id)
+
+
+def stream_rows(query, yield_per=YIELD_PER):
+    """
+    Generator of (column names, chunk of rows). Rows are fetched from a server side cursor in chunks,
+    the whole result is never in memory
+    """
+    engine = get_engine_for_read()
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=yield_per).execute(query)
+        columns = list(result.keys())
+        empty = True
+        for partition in result.partitions(yield_per):
+            empty = False
+            yield columns, partition
+        if empty:
+            yield columns, []
+
+
+def export(query, file_format):
+    """
+    Generator of the export file content (str/bytes chunks)
+    """
+    if file_format == 'csv':
+        return _csv_chunks(query)
+    if file_format == 'json':
+        return _json_chunks(query)
+    if file_format == 'xlsx':
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise ExportFormatError('XLSX export requires openpyxl (pip install openpyxl)')
+        return _xlsx_chunks(query)
+    raise ExportFormatError(f'Unsupported export format: {file_format}')
+
+
+def _value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _csv_chunks(query):
+    header_written = False
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    yield '\ufeff'  # BOM, so Excel opens cyrillic text correctly
+    for columns, rows in stream_rows(query):
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _json_chunks(query):
+    yield '['
+    separator = ''
+    for columns, rows in stream_rows(query):
+        chunk = ','.join(json.dumps({column: _value(value) for column, value in zip(columns, row)},
+                                    ensure_ascii=False) for row in rows)
+        yield separator + chunk
+        separator = ','
+    yield ']'
+
+
+def _xlsx_chunks(query, chunk_size=64 * 1024):
+    """
+    openpyxl write-only workbook keeps only the current row in memory, the file is written
+    to a temporary file and streamed from it
+    """
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    header_written = False
+    for columns, rows in stream_rows(query):
+        if not header_written:
+            sheet.append(columns)
+            header_written = True
+        for row in rows:
+            sheet.append(list(row))
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as xlsx_file:
+            while True:
+                chunk = xlsx_file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+
+# Memory cap of the rendered hardware table rows, 0 disables the cache
+ROW_CACHE_MB = float(os.environ.get('HARDWARE_ROW_CACHE_MB', 64))
+
+
+class FragmentCache:
+    """
+    LRU cache of rendered fragments (html of the table rows) in the memory of the process.
+    Keys contain everything the fragment depends on (log dates of the rows), so entries are never
+    invalidated: a changed row gets a new key and the old entry is evicted when the cache is full.
+    The size of an entry is estimated from the length of its strings
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (size, fragment)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_render(self, key, render):
+        """
+        :param key: hashable key of the fragment
+        :param render: function() -> fragment, called on a miss
+        """
+        fragment = self.get(key)
+        if fragment is None:
+            fragment = render()
+            self.put(key, fragment)
+        return fragment
+
+    def get(self, key):
+        """
+        Cached fragment, None on a miss
+        """
+        if self.max_bytes <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def put(self, key, fragment):
+        size = _size(key) + _size(fragment)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[0]
+            self._entries[key] = (size, fragment)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size_kib': round(self.size / 1024, 1),
+                'max_kib': round(self.max_bytes / 1024, 1),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 3) if requests else None,
+                'evictions': self.evictions,
+            }
+
+
+def _size(value) -> int:
+    """
+    Approximate memory of a fragment: strings, tuples, lists and dicts of them
+    """
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_size(key) + _size(item) for key, item in value.items())
+    return sys.getsizeof(value)
+
+
+row_cache = FragmentCache(int(ROW_CACHE_MB * 1024 * 1024))
@@ -0,0 +1,239 @@
+import csv
+import io
+import itertools
+from collections import Counter
+from datetime import date, datetime
+from sqlalchemy.exc import IntegrityError
+from modules.model import ArrangeStatus, Hardware, HoldingsSummary, chunks, hardware_changed, reference_cache
+from modules.session_manager import load_session
+
+
+# Same field names as the hardware form (Hardware.__init__),
+# condition/type/brand are names (or ids) instead of ids
+COLUMNS = ['hardware_id', 'hardware_name', 'condition', 'type', 'brand', 'validation_date', 'serial', 'description']
+REQUIRED_COLUMNS = ['hardware_id', 'hardware_name', 'condition', 'type', 'brand']
+DATE_FORMATS = ['%Y-%m-%d', '%d.%m.%Y']
+BATCH_SIZE = 1000
+
+
+class ImportFormatError(ValueError):
+    """
+    File can not be imported at all (unknown format, missing columns)
+    """
+
+
+class HardwareImport:
+    """
+    Bulk import of hardware from CSV/XLSX file.
+    File is read as a stream and processed in batches: every batch is validated (one query for already
+    existing ids), valid rows are inserted with one executemany and committed. Invalid rows are
+    skipped and reported, they do not stop the import
+    """
+
+    def __init__(self, file, file_format='csv', batch_size=BATCH_SIZE):
+        """
+        :param file: binary file object
+        :param file_format: 'csv' or 'xlsx'
+        :param batch_size: rows per insert/commit
+        """
+        self.file = file
+        self.file_format = file_format.lower().lstrip('.')
+        self.batch_size = batch_size
+        self.db_session = None
+        self.lookups = {}
+        self.seen_ids = set()
+        self.imported = 0
+        self.errors = []  # (row number, hardware_id, message)
+
+    def __call__(self) -> dict:
+        self.db_session = load_session()
+        self.lookups = self.load_lookups()
+        rows = self.read_rows()
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            self.import_batch(batch)
+
+        return self.report()
+
+    def report(self) -> dict:
+        return {'imported': self.imported, 'failed': len(self.errors),
+                'errors': [{'row': row, 'hardware_id': hardware_id, 'message': message}
+                           for row, hardware_id, message in sorted(self.errors, key=lambda error: error[0])]}
+
+    @staticmethod
+    def load_lookups() -> dict:
+        """
+        name (lower case) or id -> id of brands, types and conditions. Loaded once for the whole file
+        """
+        def lookup(snapshots, id_field):
+            result = {}
+            for row in snapshots:
+                row_id = getattr(row, id_field)
+                result[str(row_id)] = row_id
+                if row.name:
+                    result[row.name.strip().lower()] = row_id
+            return result
+
+        return {
+            'condition': lookup(reference_cache.hardware_conditions(), 'condition_id'),
+            'type': lookup(reference_cache.hardware_types(), 'type_id'),
+            'brand': lookup(reference_cache.brands(), 'brand_id'),
+        }
+
+    def read_rows(self):
+        """
+        Generator of (row number, {column: value}) from the file
+        """
+        if self.file_format == 'csv':
+            rows = csv.reader(io.TextIOWrapper(self.file, encoding='utf-8-sig', newline=''))
+        elif self.file_format == 'xlsx':
+            rows = self._xlsx_rows()
+        else:
+            raise ImportFormatError(f'Unsupported file format: {self.file_format}')
+
+        header = next(rows, None)
+        if header is None:
+            raise ImportFormatError('File is empty')
+        header = [str(column or '').strip().lower() for column in header]
+        missing = [column for column in REQUIRED_COLUMNS if column not in header]
+        if missing:
+            raise ImportFormatError(f'Missing columns: {", ".join(missing)}')
+
+        for row_num, values in enumerate(rows, start=2):
+            row = dict(zip(header, values))
+            if any(value not in (None, '') for value in row.values()):
+                yield row_num, row
+
+    def _xlsx_rows(self):
+        try:
+            import openpyxl
+        except ImportError:
+            raise ImportFormatError('XLSX import requires openpyxl (pip install openpyxl)')
+
+        workbook = openpyxl.load_workbook(self.file, read_only=True, data_only=True)
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+    def import_batch(self, batch):
+        valid = []
+        for row_num, row in batch:
+            try:
+                valid.append((row_num, self.validate_row(row)))
+            except ValueError as error:
+                self.errors.append((row_num, row.get('hardware_id'), str(error)))
+
+        valid = self.exclude_existing(valid)
+        if not valid:
+            return
+
+        try:
+            self.db_session.bulk_insert_mappings(Hardware, [values for _, values in valid])
+            self.add_to_summary([values for _, values in valid])
+            self.db_session.commit()
+            self.imported += len(valid)
+            hardware_changed([values['hardware_id'] for _, values in valid])
+        except IntegrityError:
+            # Hardware inserted concurrently, find the failing rows one by one
+            self.db_session.rollback()
+            for row_num, values in valid:
+                self.insert_row(row_num, values)
+
+    def insert_row(self, row_num, values):
+        try:
+            self.db_session.bulk_insert_mappings(Hardware, [values])
+            self.add_to_summary([values])
+            self.db_session.commit()
+            self.imported += 1
+            hardware_changed([values['hardware_id']])
+        except IntegrityError as error:
+            self.db_session.rollback()
+            self.errors.append((row_num, values['hardware_id'], f'Can not be saved: {error.orig}'))
+
+    def add_to_summary(self, rows):
+        """
+        New hardware is free and has no owner
+        """
+        HoldingsSummary.apply(self.db_session, Counter(
+            (HoldingsSummary.NOBODY, values['hardware_type_id'], ArrangeStatus.FREE) for values in rows))
+
+    def validate_row(self, row) -> dict:
+        """
+        Convert row of the file to values of the hardware table
+        :raise ValueError: with the reason if the row is invalid
+        """
+        hardware_id = self._text(row.get('hardware_id'))
+        if not hardware_id.isdigit() or int(hardware_id) <= 0:
+            raise ValueError(f'Invalid inventory number: {hardware_id!r}')
+        hardware_id = int(hardware_id)
+        if hardware_id in self.seen_ids:
+            raise ValueError(f'Inventory number {hardware_id} is repeated in the file')
+        self.seen_ids.add(hardware_id)
+
+        name = self._text(row.get('hardware_name'))
+        if not name:
+            raise ValueError('Name is empty')
+
+        return {
+            'hardware_id': hardware_id,
+            'name': name,
+            'hardware_condition_id': self._lookup('condition', row),
+            'hardware_type_id': self._lookup('type', row),
+            'hardware_brand_id': self._lookup('brand', row),
+            'validation_date': self._date(row.get('validation_date')),
+            'serial_num': self._text(row.get('serial')) or None,
+            'description': self._text(row.get('description')) or None,
+        }
+
+    def exclude_existing(self, valid) -> list:
+        """
+        Report and drop rows with inventory numbers which are already in the DB
+        """
+        ids = [values['hardware_id'] for _, values in valid]
+        existing = set()
+        for hardware_ids in chunks(ids):
+            existing.update(hardware_id for hardware_id, in self.db_session.query(Hardware.hardware_id)
+                            .filter(Hardware.hardware_id.in_(hardware_ids)))
+
+        result = []
+        for row_num, values in valid:
+            if values['hardware_id'] in existing:
+                self.errors.append((row_num, values['hardware_id'], 'Inventory number already exists'))
+            else:
+                result.append((row_num, values))
+        return result
+
+    def _lookup(self, field, row):
+        value = self._text(row.get(field))
+        if not value:
+            raise ValueError(f'{field.capitalize()} is empty')
+        try:
+            return self.lookups[field][value.lower()]
+        except KeyError:
+            raise ValueError(f'Unknown {field}: {value!r}')
+
+    @staticmethod
+    def _date(value):
+        if value in (None, ''):
+            return date.today()
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.strptime(str(value).strip(), date_format).date()
+            except ValueError:
+                pass
+        raise ValueError(f'Invalid date: {value!r}')
+
+    @staticmethod
+    def _text(value) -> str:
+        if value is None:
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))  # numbers from xlsx
+        return str(value).strip()
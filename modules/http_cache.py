@@ -0,0 +1,113 @@
+import functools
+import hashlib
+import os
+from flask import request, session, make_response, send_from_directory
+
+
+# Fingerprinted static files never change, browsers may keep them for a year
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+
+class StaticAssets:
+    """
+    Static files are linked with the content hash in the name (bootstrap.css -> bootstrap.3f2a9c1d0b.css),
+    so they can be cached forever and a changed file gets a new url.
+    url_for('static', filename=...) in the templates returns fingerprinted names automatically.
+    The manifest is built on startup, restart the server after changing static files
+    """
+
+    def __init__(self):
+        self.static_folder = None
+        self.fingerprinted = {}  # file name -> fingerprinted name
+        self.original = {}  # fingerprinted name -> file name
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.build_manifest()
+        app.url_defaults(self.url_defaults)
+        app.view_functions['static'] = self.send_static_file
+
+    def build_manifest(self):
+        self.fingerprinted, self.original = {}, {}
+        for root, _, files in os.walk(self.static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.static_folder).replace(os.sep, '/')
+                fingerprinted = self.fingerprint(filename, path)
+                self.fingerprinted[filename] = fingerprinted
+                self.original[fingerprinted] = filename
+
+    @staticmethod
+    def fingerprint(filename, path) -> str:
+        with open(path, 'rb') as static_file:
+            content_hash = hashlib.sha256(static_file.read()).hexdigest()[:10]
+        base, extension = os.path.splitext(filename)
+        return f'{base}.{content_hash}{extension}'
+
+    def url_defaults(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.fingerprinted.get(values['filename'], values['filename'])
+
+    def send_static_file(self, filename):
+        original = self.original.get(filename)
+        if original is None:
+            # not fingerprinted (e.g. source maps requested by the browser), default caching
+            return send_from_directory(self.static_folder, filename)
+        response = send_from_directory(self.static_folder, original, max_age=STATIC_MAX_AGE)
+        response.cache_control.immutable = True
+        return response
+
+
+static_assets = StaticAssets()
+
+
+def versioned(get_version, get_key=None):
+    """
+    Decorator of views which depend only on the DB data and the url. The strong ETag of the response
+    is built from the change version (get_version()) and the url; a request with the same
+    If-None-Match gets 304 without running the view.
+    Pages with flashed messages are not cached, they are shown once
+    :param get_key: returns what else the response depends on (e.g. today's date of a default date)
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            key = get_key() if get_key is not None else ''
+            etag = hashlib.sha256(f'{get_version()}|{app_version()}|{request.full_path}|{key}'.encode()) \
+                .hexdigest()[:32]
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # the browser must ask again every time, the server answers 304 while nothing changed
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+@functools.lru_cache(maxsize=1)
+def app_version() -> str:
+    """
+    Hash of the templates and static files: a new deploy changes the ETags of all pages
+    """
+    from flask import current_app
+
+    content_hash = hashlib.sha256()
+    for fingerprinted in sorted(static_assets.original):
+        content_hash.update(fingerprinted.encode())
+    for root, _, files in sorted(os.walk(os.path.join(current_app.root_path, current_app.template_folder))):
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as template:
+                content_hash.update(template.read())
+    return content_hash.hexdigest()[:16]
+
+
+def init_app(app):
+    static_assets.init_app(app)
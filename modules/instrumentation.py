@@ -0,0 +1,262 @@
+import bisect
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from flask import g, request, has_request_context, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from modules.session_manager import pool_stats
+
+
+logger = logging.getLogger(__name__)
+
+# Request and SQL metrics. When disabled no hooks are registered at all
+METRICS_ENABLED = os.environ.get('HARDWARE_METRICS', '0') == '1'
+# Requests slower than this are logged with their slowest statements
+SLOW_REQUEST_MS = int(os.environ.get('HARDWARE_SLOW_REQUEST_MS', 1000))
+SLOWEST_STATEMENTS = 5
+SLOW_REQUESTS_KEPT = 50
+STATEMENT_TEXT_LENGTH = 300
+# Request opts in to the Server-Timing response header with this request header
+SERVER_TIMING_HEADER = 'X-Server-Timing'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics:
+    """
+    Timings of one request: wall time, statements and their time, template rendering
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.slowest = []  # heap of (seconds, n, statement)
+
+    def add_statement(self, statement, seconds):
+        self.statements += 1
+        self.db_time += seconds
+        item = (seconds, self.statements, statement)
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, item)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def slowest_statements(self) -> list:
+        return [{'sec': round(seconds, 6), 'statement': statement[:STATEMENT_TEXT_LENGTH]}
+                for seconds, _, statement in sorted(self.slowest, reverse=True)]
+
+    def server_timing(self, total) -> str:
+        app_time = max(total - self.db_time - self.template_time, 0.0)
+        return f'db;dur={self.db_time * 1000:.1f};desc="{self.statements} statements", ' \
+               f'tpl;dur={self.template_time * 1000:.1f}, app;dur={app_time * 1000:.1f}, ' \
+               f'total;dur={total * 1000:.1f}'
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list:
+        result, total = [], 0
+        for bucket, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bucket, total))
+        return result
+
+
+class MetricsRegistry:
+    """
+    Process wide aggregates of the request metrics, exported in Prometheus text format
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)  # (endpoint, method, status) -> count
+            self.durations = defaultdict(Histogram)  # endpoint -> request duration
+            self.statements = defaultdict(int)  # endpoint -> statements
+            self.db_seconds = defaultdict(float)  # endpoint -> DB time
+            self.template_seconds = defaultdict(float)  # endpoint -> template rendering time
+            self.statement_durations = Histogram()
+            self.slow_requests = deque(maxlen=SLOW_REQUESTS_KEPT)
+
+    def record_statement(self, seconds):
+        with self._lock:
+            self.statement_durations.observe(seconds)
+
+    def record_request(self, metrics: RequestMetrics, endpoint, method, status, total):
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            self.durations[endpoint].observe(total)
+            self.statements[endpoint] += metrics.statements
+            self.db_seconds[endpoint] += metrics.db_time
+            self.template_seconds[endpoint] += metrics.template_time
+
+        if total * 1000 >= SLOW_REQUEST_MS:
+            slow_request = {'endpoint': endpoint, 'path': request.full_path, 'status': status,
+                            'sec': round(total, 6), 'db_sec': round(metrics.db_time, 6),
+                            'statements': metrics.statements, 'template_sec': round(metrics.template_time, 6),
+                            'slowest_statements': metrics.slowest_statements()}
+            with self._lock:
+                self.slow_requests.append(slow_request)
+            logger.warning('Slow request %s %.3f s: %s statements, DB %.3f s, template %.3f s, slowest: %s',
+                           request.full_path, total, metrics.statements, metrics.db_time, metrics.template_time,
+                           slow_request['slowest_statements'][:1])
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            _header(lines, 'hardware_http_requests_total', 'counter', 'HTTP requests')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(_sample('hardware_http_requests_total', count,
+                                     endpoint=endpoint, method=method, status=status))
+
+            _header(lines, 'hardware_http_request_duration_seconds', 'histogram', 'Request wall time')
+            for endpoint, histogram in sorted(self.durations.items()):
+                _histogram(lines, 'hardware_http_request_duration_seconds', histogram, endpoint=endpoint)
+
+            for name, help_text, values in [
+                ('hardware_db_statements_total', 'SQL statements executed by requests', self.statements),
+                ('hardware_db_seconds_total', 'Time requests spent in SQL statements', self.db_seconds),
+                ('hardware_template_seconds_total', 'Time requests spent rendering templates', self.template_seconds),
+            ]:
+                _header(lines, name, 'counter', help_text)
+                for endpoint, value in sorted(values.items()):
+                    lines.append(_sample(name, value, endpoint=endpoint))
+
+            _header(lines, 'hardware_db_statement_duration_seconds', 'histogram',
+                    'SQL statement time (requests and background work)')
+            _histogram(lines, 'hardware_db_statement_duration_seconds', self.statement_durations)
+
+        pool = pool_stats.as_dict()
+        for name, help_text, value in [
+            ('hardware_db_pool_checkouts_total', 'Connection pool checkouts', pool['checkouts']),
+            ('hardware_db_pool_connects_total', 'New DB connections', pool['connects']),
+            ('hardware_db_pool_wait_seconds_total', 'Time spent waiting for a free connection', pool['wait_total_sec']),
+        ]:
+            _header(lines, name, 'counter', help_text)
+            lines.append(_sample(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def slow_requests_list(self) -> list:
+        with self._lock:
+            return list(reversed(self.slow_requests))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _header(lines, name, metric_type, help_text):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {metric_type}')
+
+
+def _sample(name, value, **labels) -> str:
+    if isinstance(value, float):
+        value = f'{value:.6f}'
+    if not labels:
+        return f'{name} {value}'
+    label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+    return f'{name}{{{label_text}}} {value}'
+
+
+def _histogram(lines, name, histogram, **labels):
+    for bucket, count in histogram.cumulative():
+        lines.append(_sample(f'{name}_bucket', count, **labels, le=bucket))
+    lines.append(_sample(f'{name}_bucket', histogram.count, **labels, le='+Inf'))
+    lines.append(_sample(f'{name}_sum', histogram.sum, **labels))
+    lines.append(_sample(f'{name}_count', histogram.count, **labels))
+
+
+metrics = MetricsRegistry()
+
+
+def _current_metrics():
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+# -- SQLAlchemy hooks (all engines)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instrumentation_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_instrumentation_start', None)
+    if start is None:
+        return
+    seconds = time.perf_counter() - start
+    metrics.record_statement(seconds)
+    request_metrics = _current_metrics()
+    if request_metrics is not None:
+        request_metrics.add_statement(statement, seconds)
+
+
+# -- Flask hooks
+
+def _before_request():
+    g.request_metrics = RequestMetrics()
+
+
+def _after_request(response):
+    request_metrics = g.pop('request_metrics', None)
+    if request_metrics is None:
+        return response
+    total = request_metrics.elapsed()
+    metrics.record_request(request_metrics, request.endpoint or 'unknown', request.method, response.status_code,
+                           total)
+    if request.headers.get(SERVER_TIMING_HEADER) == '1':
+        response.headers['Server-Timing'] = request_metrics.server_timing(total)
+    return response
+
+
+def _before_render_template(sender, template, context, **extra):
+    if g.get('request_metrics') is not None:
+        g.template_start = time.perf_counter()
+
+
+def _template_rendered(sender, template, context, **extra):
+    request_metrics = g.get('request_metrics')
+    start = g.pop('template_start', None)
+    if request_metrics is not None and start is not None:
+        request_metrics.template_time += time.perf_counter() - start
+
+
+def init_app(app):
+    """
+    Register request, template and SQL hooks if HARDWARE_METRICS=1.
+    Times of streamed responses (exports) don't include sending the body
+    """
+    if not METRICS_ENABLED:
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
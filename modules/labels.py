@@ -0,0 +1,328 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+from modules.fragment_cache import FragmentCache
+
+
+LABEL_WORKERS = int(os.environ.get('HARDWARE_LABEL_WORKERS', os.cpu_count() or 2))
+# Memory cap of the rendered labels, 0 disables the cache
+LABEL_CACHE_MB = float(os.environ.get('HARDWARE_LABEL_CACHE_MB', 32))
+LABELS_MAX = 20000  # labels per request
+LABEL_CHUNK = 500  # labels rendered per pool task, fewer missing labels are rendered in the process
+
+CODE128 = 'code128'
+QR = 'qr'
+SYMBOLOGIES = (CODE128, QR)
+FORMATS = {
+    'html': 'text/html',
+    'svg': 'image/svg+xml',
+    'pdf': 'application/pdf',
+}
+
+# Label sheet in mm: page size, grid of labels, label size, offset of the first label and gaps between labels
+LabelLayout = namedtuple('LabelLayout', 'name page_width page_height columns rows label_width label_height '
+                                        'left top gap_x gap_y')
+LAYOUTS = {
+    'a4-3x8': LabelLayout('a4-3x8', 210, 297, 3, 8, 70, 37, 0, 0.5, 0, 0),
+    'a4-2x7': LabelLayout('a4-2x7', 210, 297, 2, 7, 99.1, 38.1, 4.65, 15.15, 2.5, 0),
+}
+DEFAULT_LAYOUT = 'a4-3x8'
+
+# Label to render: everything the label shows, the cache key is built from it
+Label = namedtuple('Label', 'hardware_id name serial_num log_date')
+
+# Code 128 bar/space widths of the symbol values 0-106 (103-105 start A/B/C, 106 stop)
+CODE128_PATTERNS = [
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+]
+CODE128_START_B = 104
+CODE128_START_C = 105
+CODE128_STOP = 106
+QUIET_ZONE = 10  # modules of white space on both sides of the bars
+# Fixed QR mask: the code stays valid (the mask is stored in the code), choosing the best of 8 masks
+# makes an inventory code 4 times slower to encode
+QR_MASK = 0
+
+
+class LabelError(ValueError):
+    """
+    Invalid label request or missing optional dependency
+    """
+
+
+def code128_values(text) -> list:
+    """
+    Symbol values of the text with start, check and stop symbols.
+    Inventory codes (even number of digits) use code set C, two digits per symbol, other text code set B
+    """
+    if text.isdigit() and len(text) % 2 == 0:
+        values = [CODE128_START_C] + [int(text[i:i + 2]) for i in range(0, len(text), 2)]
+    else:
+        if any(not 32 <= ord(char) < 128 for char in text):
+            raise LabelError(f'Code 128 can not encode {text!r}')
+        values = [CODE128_START_B] + [ord(char) - 32 for char in text]
+    check = (values[0] + sum(position * value for position, value in enumerate(values[1:], start=1))) % 103
+    return values + [check, CODE128_STOP]
+
+
+def code128_modules(text) -> list:
+    """
+    Widths of the bars and spaces in modules, starting with a bar
+    """
+    return [int(width) for value in code128_values(text) for width in CODE128_PATTERNS[value]]
+
+
+def code128_svg(text, x, y, width, height) -> str:
+    """
+    Bars of the text as one svg path fitted into the box (with the quiet zones)
+    """
+    widths = code128_modules(text)
+    module = width / (sum(widths) + 2 * QUIET_ZONE)
+    position = x + QUIET_ZONE * module
+    path = []
+    for index, modules in enumerate(widths):
+        if index % 2 == 0:
+            path.append(f'M{position:.3f} {y:.3f}h{modules * module:.3f}v{height:.3f}h{-modules * module:.3f}z')
+        position += modules * module
+    return f'<path d="{"".join(path)}"/>'
+
+
+def qr_svg(text, x, y, size) -> str:
+    """
+    QR code of the text as one svg path of dark modules (runs of a row joined), needs segno
+    """
+    try:
+        import segno
+    except ImportError:
+        raise LabelError('QR labels require segno (pip install segno)')
+
+    matrix = [list(row) for row in segno.make(text, error='m', micro=False, mask=QR_MASK).matrix_iter(scale=1, border=0)]
+    module = size / len(matrix)
+    path = []
+    for row_index, row in enumerate(matrix):
+        column = 0
+        while column < len(row):
+            if not row[column]:
+                column += 1
+                continue
+            start = column
+            while column < len(row) and row[column]:
+                column += 1
+            path.append(f'M{x + start * module:.3f} {y + row_index * module:.3f}'
+                        f'h{(column - start) * module:.3f}v{module:.3f}h{-(column - start) * module:.3f}z')
+    return f'<path d="{"".join(path)}"/>'
+
+
+def _text(value, x, y, size, width, bold=False, anchor='start') -> str:
+    """
+    One line of text, cut to fit the width (average glyph is about 0.55 of the font size)
+    """
+    value = str(value or '')
+    max_chars = max(int(width / (size * 0.55)), 1)
+    if len(value) > max_chars:
+        value = value[:max_chars - 1] + '…'
+    weight = ' font-weight="bold"' if bold else ''
+    return f'<text x="{x:.2f}" y="{y:.2f}" font-size="{size}"{weight} text-anchor="{anchor}">{escape(value)}</text>'
+
+
+def render_label(label: Label, symbology, layout: LabelLayout) -> str:
+    """
+    Svg group of one label in the coordinates of the label (mm)
+    """
+    code = str(label.hardware_id).zfill(8)  # Hardware.code_format
+    width, height = layout.label_width, layout.label_height
+    margin = 2.5
+    serial = f'S/N {label.serial_num}' if label.serial_num else ''
+    if symbology == QR:
+        size = height - 2 * margin
+        text_x = margin + size + 2
+        text_width = width - text_x - margin
+        parts = [
+            qr_svg(code, margin, margin, size),
+            _text(code, text_x, margin + 5, 4.2, text_width, bold=True),
+            _text(label.name, text_x, margin + 11, 3, text_width),
+            _text(serial, text_x, margin + 16, 2.5, text_width),
+        ]
+    else:
+        text_width = width - 2 * margin
+        bars_top, bars_height = margin + 4.5, height * 0.45
+        parts = [
+            _text(label.name, width / 2, margin + 3, 3, text_width, anchor='middle'),
+            code128_svg(code, margin, bars_top, text_width, bars_height),
+            _text(code, width / 2, bars_top + bars_height + 4, 3.8, text_width, bold=True, anchor='middle'),
+            _text(serial, width / 2, height - margin, 2.5, text_width, anchor='middle'),
+        ]
+    return f'<g>{"".join(parts)}</g>'
+
+
+def render_labels(labels, symbology, layout_name) -> list:
+    """
+    Svg of the labels. Runs in the pool worker processes
+    """
+    layout = LAYOUTS[layout_name]
+    return [render_label(Label(*label), symbology, layout) for label in labels]
+
+
+def parse_ids(text) -> list:
+    """
+    Hardware ids from '1,2,10-20' (ranges are inclusive)
+    """
+    ids = []
+    for part in filter(None, (part.strip() for part in (text or '').split(','))):
+        first, _, last = part.partition('-')
+        try:
+            first, last = int(first), int(last or first)
+        except ValueError:
+            raise LabelError(f'Invalid hardware id {part!r}')
+        if last < first or last - first >= LABELS_MAX:
+            raise LabelError(f'Invalid range {part!r}')
+        ids.extend(range(first, last + 1))
+        if len(ids) > LABELS_MAX:
+            raise LabelError(f'At most {LABELS_MAX} labels per request')
+    return ids
+
+
+def load_labels(hardware_ids=None, search=None) -> list:
+    """
+    Labels of the hardware ids (in the given order) or of the hardware matching the table search
+    """
+    # imported here, pool workers import this module and don't need the models
+    from modules.model import Brand, Hardware, HardwareCondition, HardwareType, chunks
+    from modules.session_manager import load_session
+
+    query = load_session().query(Hardware).with_entities(Hardware.hardware_id, Hardware.name, Hardware.serial_num,
+                                                         Hardware.log_date)
+    if hardware_ids:
+        labels = {}
+        for ids in chunks(sorted(set(hardware_ids))):
+            for row in query.filter(Hardware.hardware_id.in_(ids)):
+                labels[row.hardware_id] = Label(*row)
+        return [labels[hardware_id] for hardware_id in dict.fromkeys(hardware_ids) if hardware_id in labels]
+
+    if search:
+        query = query.outerjoin(HardwareCondition, Hardware.hardware_condition) \
+            .outerjoin(HardwareType, Hardware.hardware_type) \
+            .outerjoin(Brand, Hardware.hardware_brand) \
+            .filter(Hardware.search_filter(search))
+    rows = query.order_by(Hardware.hardware_id).limit(LABELS_MAX + 1).all()
+    if len(rows) > LABELS_MAX:
+        raise LabelError(f'More than {LABELS_MAX} hardware match, narrow the search')
+    return [Label(*row) for row in rows]
+
+
+class LabelSheets:
+    """
+    Label sheets of inventory codes. Labels are rendered to svg in a process pool in chunks and kept
+    in an LRU cache keyed by everything the label shows (hardware_id, name, serial_num, log_date),
+    so a reprint renders only labels of new or changed hardware. Pages are assembled in the request,
+    PDF is converted from the html of the pages by the PDF acts pool (wkhtmltopdf)
+    """
+
+    def __init__(self, workers=LABEL_WORKERS, cache_mb=LABEL_CACHE_MB):
+        self.workers = workers
+        self.cache = FragmentCache(int(cache_mb * 1024 * 1024))
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: workers don't inherit DB connections and locks of the server process
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    @staticmethod
+    def check(symbology, layout_name):
+        if symbology not in SYMBOLOGIES:
+            raise LabelError(f'Unsupported symbology {symbology}, expected one of {", ".join(SYMBOLOGIES)}')
+        if layout_name not in LAYOUTS:
+            raise LabelError(f'Unknown layout {layout_name}, expected one of {", ".join(LAYOUTS)}')
+
+    def render(self, labels, symbology=CODE128, layout_name=DEFAULT_LAYOUT) -> list:
+        """
+        Svg of every label, cached ones are not rendered again
+        """
+        self.check(symbology, layout_name)
+        keys = [(label, symbology, layout_name) for label in labels]
+        fragments = [self.cache.get(key) for key in keys]
+        missing = [index for index, fragment in enumerate(fragments) if fragment is None]
+        if not missing:
+            return fragments
+
+        missing_labels = [tuple(labels[index]) for index in missing]
+        if len(missing) < 2 * LABEL_CHUNK or self.workers < 2:
+            rendered = render_labels(missing_labels, symbology, layout_name)
+        else:
+            rendered = []
+            for chunk in self._map(missing_labels, symbology, layout_name):
+                rendered.extend(chunk)
+        for index, fragment in zip(missing, rendered):
+            fragments[index] = fragment
+            self.cache.put(keys[index], fragment)
+        return fragments
+
+    def _map(self, labels, symbology, layout_name):
+        chunks = [labels[start:start + LABEL_CHUNK] for start in range(0, len(labels), LABEL_CHUNK)]
+        try:
+            futures = [self.executor.submit(render_labels, chunk, symbology, layout_name) for chunk in chunks]
+        except BrokenProcessPool:
+            # a worker died (e.g. killed by OOM), start a new pool
+            self.shutdown()
+            futures = [self.executor.submit(render_labels, chunk, symbology, layout_name) for chunk in chunks]
+        return (future.result() for future in futures)
+
+    @staticmethod
+    def pages(fragments, layout_name=DEFAULT_LAYOUT) -> list:
+        """
+        Svg documents of the sheets, labels placed row by row
+        """
+        layout = LAYOUTS[layout_name]
+        per_page = layout.columns * layout.rows
+        pages = []
+        for first in range(0, len(fragments), per_page):
+            placed = []
+            for position, fragment in enumerate(fragments[first:first + per_page]):
+                row, column = divmod(position, layout.columns)
+                x = layout.left + column * (layout.label_width + layout.gap_x)
+                y = layout.top + row * (layout.label_height + layout.gap_y)
+                placed.append(f'<g transform="translate({x:.2f} {y:.2f})">{fragment}</g>')
+            pages.append(f'<svg xmlns="http://www.w3.org/2000/svg" width="{layout.page_width}mm" '
+                         f'height="{layout.page_height}mm" viewBox="0 0 {layout.page_width} {layout.page_height}" '
+                         f'font-family="Arial, sans-serif">{"".join(placed)}</svg>')
+        return pages
+
+    @staticmethod
+    def pdf_path(html) -> str:
+        import modules.pdf_acts as pdf_acts
+
+        content_hash = hashlib.sha256(html.encode()).hexdigest()[:16]
+        return os.path.join(pdf_acts.PDF_CACHE_DIR, f'labels-{content_hash}.pdf')
+
+    def stats(self) -> dict:
+        return dict(self.cache.stats(), workers=self.workers)
+
+
+label_sheets = LabelSheets()
@@ -1,14 +1,56 @@
 from sqlalchemy.ext.automap import automap_base
-from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Index, cast, or_, and_
 from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
-from sqlalchemy.orm import relationship
+from sqlalchemy import event, inspect, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, relationship, joinedload, contains_eager
 from sqlalchemy.sql.expression import func
+from collections import Counter, namedtuple
 from datetime import datetime, date
-from modules.session_manager import load_session
+from flask import has_request_context, request
+import getpass
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from modules.session_manager import load_session, get_engine, get_engine_for_read
+from modules.search_index import search_index
 
 
+logger = logging.getLogger(__name__)
+
 Base = automap_base()
 
+# MSSQL allows 2100 parameters per statement, long IN lists are split into chunks
+IN_CLAUSE_CHUNK = 1000
+
+
+def chunks(items, size=IN_CLAUSE_CHUNK):
+    """
+    Split list into lists of at most size items
+    """
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ArrangeConflict(Exception):
+    """
+    Hardware of the act was changed by another act after validation
+    """
+
+
+# Unique and primary key violations (SQL Server errors 2627 and 2601, SQLite, PostgreSQL): a row was inserted
+# by a concurrent transaction. Other integrity errors (foreign keys, NOT NULL) are errors of the data
+UNIQUE_VIOLATION_MARKERS = ('(2627)', '(2601)', 'UNIQUE constraint failed', 'duplicate key')
+
+
+def is_unique_violation(error: IntegrityError) -> bool:
+    return any(marker in str(error.orig) for marker in UNIQUE_VIOLATION_MARKERS)
+
+
 # === Arrange
 
 
@@ -54,13 +96,30 @@ class ArrangeStatus(Base):
 class ArrangeHardware(Base):
 
     STATUS_MESSAGES = {
-        0: {'message': 'Done.', 'status': 'bg-success'},
+        0: {'message': 'Done. Act № {}', 'status': 'bg-success'},
         1: {'message': 'Hardware {} is in use', 'status': 'bg-danger'},
         2: {'message': 'Hardware {} belong to another worker', 'status': 'bg-danger'},
-
+        3: {'message': 'Hardware {} was changed by another act, please try again', 'status': 'bg-danger'},
+        4: {'message': 'The act refers to a worker, operation or hardware which does not exist', 'status': 'bg-danger'},
     }
 
+    # stages reported to on_progress
+    VALIDATING = 'validating'
+    APPLYING = 'applying'
+    SAVING = 'saving'
+
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_MAX_PAGE_SIZE = 200
+
     __tablename__ = 'arranges'
+    # History pages are read by (hardware or worker, doc_date), see migrations/002_arranges_history_indexes.sql
+    __table_args__ = (
+        Index('ix_arranges_hardware_doc_date', 'hardware_id', 'doc_date', 'arrange_id'),
+        Index('ix_arranges_employee_doc_date', 'employee_id', 'doc_date', 'arrange_id'),
+        Index('ix_arranges_employee2_doc_date', 'employee2_id', 'doc_date', 'arrange_id'),
+        Index('ix_arranges_doc_num', 'doc_num'),
+        Index('ix_arranges_doc_date', 'doc_date', 'doc_num'),
+    )
 
     arrange_id = Column(Integer, primary_key=True, autoincrement=True, unique=True)
     hardware_id = Column(Integer, ForeignKey('hardware.hardware_id'))
@@ -80,36 +139,94 @@ class ArrangeHardware(Base):
     it_worker = relationship('Worker', foreign_keys=[it_worker_id])
 
     def __init__(self, **kwargs):
-        print('KWARGS ------------> ', kwargs)
+        logger.debug('Arrange act form: %s', kwargs)
         self.hardware_id = self._convert_hardware_code(kwargs['hardware_id'])
         self.it_worker_id = int(kwargs['it_worker'][0])
         self.employee_id = int(kwargs['employee'][0])
         self.operation_id = int(kwargs['operation'][0])
-        self.doc_num = kwargs['doc_num'][0]
-        self.doc_date = kwargs['doc_date'][0]
+        self.doc_num = int(kwargs['doc_num'][0])
+        self.doc_date = self._convert_doc_date(kwargs['doc_date'][0])
         self.employee2_id = int(kwargs['employee_2'][0]) if kwargs['employee_2'][0] else None
         self.hardware_arrange = []
         self.db_session = None
         self.unavailable_hardware = []
+        # function(stage, items done) called while the act is applied (progress of the async jobs)
+        self.on_progress = None
+        # number allocated in advance (batch of acts), otherwise allocated when the act is saved
+        self.reserved_doc_num = None
+        # the act may be applied by a background job, the user is taken from the request which made it
+        self.changed_by = audit_user()
 
     def __repr__(self):
         return f'Arrange(hardware = {self.hardware}, it_worker_id = {self.it_worker}, employee = {self.employee}' \
                f'operation = {self.operation} '
 
     def __call__(self):
+        """
+        Validate and apply the act in one transaction. Nothing is written if validation fails
+        or any statement fails.
+        Updates are conditional (e.g. ACCEPT only updates hardware which is still free), so if another act
+        took the same hardware after validation the act is rolled back and reported as unavailable
+        """
         self.db_session = load_session()
+        committed = False
+        try:
+            self.report_progress(self.VALIDATING)
+            self.hardware_arrange = self.get_hardware()
+            status_code = self.arrange()
+            if status_code == 0:
+                self.db_session.commit()
+                committed = True
+            else:
+                self.db_session.rollback()
+        except ArrangeConflict:
+            self.db_session.rollback()
+            status_code = self.resolve_conflict()
+        except IntegrityError as error:
+            self.db_session.rollback()
+            if is_unique_violation(error):
+                status_code = self.resolve_conflict()
+            else:
+                logger.warning('Arrange act rejected by the DB: %s', error.orig)
+                status_code = 4
+        except Exception:
+            self.db_session.rollback()
+            raise
+
+        # outside of the try: the act is saved, nothing after the commit may roll it back or fail it
+        if committed:
+            hardware_changed(self.hardware_id)
+        return self.get_status_message(status_code)
+
+    def report_progress(self, stage, done=0):
+        if self.on_progress is not None:
+            self.on_progress(stage, done)
+
+    @hybrid_method
+    def resolve_conflict(self):
+        """
+        Re-read hardware after the concurrent change to report which hardware is unavailable now
+        """
+        self.db_session.expire_all()
         self.hardware_arrange = self.get_hardware()
-        self.create_missing_hardware()
-        return self.arrange()
+        status_code = self.validate_operation()
+        if status_code == 0:
+            self.unavailable_hardware = self.hardware_arrange
+            status_code = 3
+        self.db_session.rollback()
+        return status_code
 
     def arrange(self):
         status_code = self.validate_operation()
         if status_code != 0:
-            return self.get_status_message(status_code)
+            return status_code
 
+        self.doc_num = self.reserved_doc_num or DocCounter.allocate(DocCounter.ARRANGE)
+        self.create_missing_hardware()
         self.arrange_to_employee()
+        self.report_progress(self.SAVING, len(self.hardware_arrange))
         self.save_arrange_to_db()
-        return self.get_status_message(status_code)
+        return status_code
 
     @staticmethod
     def _convert_hardware_code(code):
@@ -117,9 +234,18 @@ class ArrangeHardware(Base):
             return [int(x) for x in code]
         return code
 
+    @staticmethod
+    def _convert_doc_date(doc_date):
+        if isinstance(doc_date, str):
+            return date.fromisoformat(doc_date) if doc_date else date.today()
+        return doc_date
+
     @hybrid_method
     def get_hardware(self) -> list:
-        result = self.db_session.query(Hardware).filter(Hardware.hardware_id.in_(self.hardware_id)).all()
+        result = []
+        for hardware_ids in chunks(self.hardware_id):
+            result += self.db_session.query(Hardware).options(joinedload(Hardware.hardware_use))\
+                .filter(Hardware.hardware_id.in_(hardware_ids)).all()
         return result
 
     @hybrid_method
@@ -130,7 +256,7 @@ class ArrangeHardware(Base):
         :return:
         """
         if status_code == 0:
-            return self.STATUS_MESSAGES[status_code]['message'],\
+            return self.STATUS_MESSAGES[status_code]['message'].format(self.doc_num),\
                    self.STATUS_MESSAGES[status_code]['status']
         else:
             return self.STATUS_MESSAGES[status_code]['message'].format(self.unavailable_hardware), \
@@ -139,15 +265,13 @@ class ArrangeHardware(Base):
     @hybrid_method
     def create_missing_hardware(self):
         """
-        Create hardware which is not in the db table Hardware_use
+        Create hardware which is not in the db table Hardware_use (one multi-row insert, no commit)
         :return:
         """
-        for hardware_ in self.hardware_arrange:
-            if not hardware_.hardware_use:
-                new_hdw = HardwareUse(hardware_id=hardware_.hardware_id)
-                hardware_.hardware_use = new_hdw
-
-        self.db_session.commit()
+        missing = [{'hardware_id': hardware_.hardware_id} for hardware_ in self.hardware_arrange
+                   if not hardware_.hardware_use]
+        if missing:
+            self.db_session.execute(HardwareUse.__table__.insert(), missing)
 
     @hybrid_method
     def validate_operation(self):
@@ -168,10 +292,12 @@ class ArrangeHardware(Base):
     @hybrid_method
     def check_hardware_use_status(self) -> list:
         """
-        Get list of hardware which in arrange status == "in use"
+        Get list of hardware which in arrange status == "in use".
+        Hardware without row in Hardware_use is free
         :return:
         """
-        return [hardware for hardware in self.hardware_arrange if hardware.hardware_use.status_id == 2]
+        return [hardware for hardware in self.hardware_arrange
+                if hardware.hardware_use and hardware.hardware_use.status_id == ArrangeStatus.IN_USE]
 
     @hybrid_method
     def check_hardware_owner(self) -> list:
@@ -179,7 +305,8 @@ class ArrangeHardware(Base):
         Get list of hardware which is not belong to the employee
         :return:
         """
-        return [hardware for hardware in self.hardware_arrange if hardware.hardware_use.employee_id != self.employee_id]
+        return [hardware for hardware in self.hardware_arrange
+                if not hardware.hardware_use or hardware.hardware_use.employee_id != self.employee_id]
 
     @hybrid_method
     def arrange_to_employee(self):
@@ -187,45 +314,307 @@ class ArrangeHardware(Base):
         If operation == RETURN then change status of all hardware to FREE
         elif operation == ACCEPT then change status and owner to employee
         elif operation == TRANSFER then change status and owner to employee2
+        Hardware is updated only if it is still in the state checked by validate_operation()
         :return:
         """
+        target = self.operation_target()
+        if target is not None:
+            status_id, employee_id, expected = target
+            self.proceed_arrange(status_id=status_id, employee_id=employee_id, expected=expected)
+
+    @hybrid_method
+    def operation_target(self):
+        """
+        :return: (status_id, owner, condition on hardware_use the hardware must match) after the operation,
+                 None if the operation doesn't change hardware use
+        """
+        hardware_use = HardwareUse.__table__
         if self.operation_id == ArrangeOperation.RETURN:  # Сдал
-            self.proceed_arrange(status_id=ArrangeStatus.FREE)
+            return ArrangeStatus.FREE, None, hardware_use.c.employee_id == self.employee_id
         elif self.operation_id == ArrangeOperation.ACCEPT:
-            self.proceed_arrange(status_id=ArrangeStatus.IN_USE, employee_id=self.employee_id)
+            return ArrangeStatus.IN_USE, self.employee_id, hardware_use.c.status_id == ArrangeStatus.FREE
         elif self.operation_id == ArrangeOperation.TRANSFER:
-            self.proceed_arrange(status_id=ArrangeStatus.IN_USE, employee_id=self.employee2_id)
+            return ArrangeStatus.IN_USE, self.employee2_id, hardware_use.c.employee_id == self.employee_id
+        return None
 
     @hybrid_method
-    def proceed_arrange(self, status_id, employee_id=None):
+    def proceed_arrange(self, status_id, employee_id=None, expected=None):
+        """
+        Set status, owner and act of all hardware in the act with one UPDATE per chunk of ids
+        and move the hardware between rows of the holdings summary (no commit)
+        :param expected: condition all updated rows must match, otherwise ArrangeConflict is raised
+        """
+        hardware_use = HardwareUse.__table__
+        summary_changes = Counter()
         for hardware_ in self.hardware_arrange:
-            hardware_.hardware_use.doc_date = self.doc_date
-            hardware_.hardware_use.doc_num = self.doc_num
-            hardware_.hardware_use.status_id = status_id
-            hardware_.hardware_use.employee_id = employee_id
-
-        self.db_session.commit()
+            summary_changes[HoldingsSummary.key(hardware_)] -= 1
+            summary_changes[HoldingsSummary.key(hardware_, employee_id=employee_id, status_id=status_id)] += 1
+
+        done = 0
+        for hardware_ids in chunks([hardware_.hardware_id for hardware_ in self.hardware_arrange]):
+            self.report_progress(self.APPLYING, done)
+            statement = hardware_use.update().where(hardware_use.c.hardware_id.in_(hardware_ids))
+            if expected is not None:
+                statement = statement.where(expected)
+            result = self.db_session.execute(
+                statement.values(doc_date=self.doc_date, doc_num=self.doc_num, status_id=status_id,
+                                 employee_id=employee_id)
+            )
+            if result.rowcount != len(hardware_ids):
+                raise ArrangeConflict()
+            done += len(hardware_ids)
+
+        HoldingsSummary.apply(self.db_session, summary_changes)
 
     @hybrid_method
     def save_arrange_to_db(self):
-        arr_to_create = []
-        for hardware_ in self.hardware_arrange:
-            hardware_info = hardware_.__dict__
-            hardware_info.
-            new_arr = ArrangeHardware(**hardware_info)
-            arr_to_create.append(new_arr)
+        """
+        Insert the act into the arranges history, one row per hardware (one executemany, no commit)
+        """
+        arr_to_create = self.history_rows()
+        if arr_to_create:
+            self.db_session.execute(ArrangeHardware.__table__.insert(), arr_to_create)
+            OwnershipSnapshotRun.invalidate_from(self.db_session, self.doc_date)
+            AuditOutbox.add(self.db_session, self.audit_rows())
+
+    @hybrid_method
+    def history_rows(self) -> list:
+        """
+        Rows of the arranges history of the act, one per hardware
+        """
+        return [{
+            'hardware_id': hardware_.hardware_id,
+            'employee_id': self.employee_id,
+            'it_worker_id': self.it_worker_id,
+            'employee2_id': self.employee2_id,
+            'operation_id': self.operation_id,
+            'doc_num': self.doc_num,
+            'doc_date': self.doc_date,
+        } for hardware_ in self.hardware_arrange]
+
+    @hybrid_method
+    def audit_rows(self, before=None) -> list:
+        """
+        Audit outbox rows of the act, one per hardware with its status and owner before and after the act
+        :param before: (status_id, owner) per hardware of hardware_arrange, the loaded hardware use by default
+        """
+        target = self.operation_target()
+        if target is None:
+            return []
+        if before is None:
+            before = [(hardware_.hardware_use.status_id or ArrangeStatus.FREE, hardware_.hardware_use.employee_id)
+                      if hardware_.hardware_use else (ArrangeStatus.FREE, None) for hardware_ in self.hardware_arrange]
+        rows = []
+        for hardware_, (status_id, employee_id) in zip(self.hardware_arrange, before):
+            changes = AuditOutbox.diff({'status_id': status_id, 'employee_id': employee_id},
+                                       {'status_id': target[0], 'employee_id': target[1]})
+            rows.append(AuditOutbox.row(hardware_.hardware_id, AuditOutbox.ARRANGE, changes, self.changed_by,
+                                        doc_num=self.doc_num))
+        return rows
+
+    @classmethod
+    def get_hardware_arrangement(cls, hardware_id, after=None, limit=HISTORY_PAGE_SIZE):
+        """
+        Arrange history of the hardware, newest first
+        :return: (list of arranges, cursor of the next page or None)
+        """
+        return cls.get_history(ArrangeHardware.hardware_id == hardware_id, after=after, limit=limit)
 
-        self.db_session.add_all(arr_to_create)
-        self.db_session.commit()
+    @classmethod
+    def get_worker_arrangement(cls, worker_id, after=None, limit=HISTORY_PAGE_SIZE):
+        """
+        Acts where the worker gave or received hardware, newest first
+        :return: (list of arranges, cursor of the next page or None)
+        """
+        criteria = or_(ArrangeHardware.employee_id == worker_id, ArrangeHardware.employee2_id == worker_id)
+        return cls.get_history(criteria, after=after, limit=limit)
 
     @classmethod
-    def get_hardware_arrangement(cls, hardware_id):
+    def get_history(cls, criteria, after=None, limit=HISTORY_PAGE_SIZE):
+        """
+        Page of the arrange history ordered by (doc_date, arrange_id) descending.
+        Keyset pagination: the next page starts after the last row of the previous one,
+        so deep pages cost the same as the first one
+        :param criteria: filter of the history rows
+        :param after: cursor returned with the previous page
+        :param limit: page size
+        :return: (list of arranges, cursor of the next page or None)
+        """
+        limit = max(1, min(limit, cls.HISTORY_MAX_PAGE_SIZE))
         db_session = load_session()
-        result = db_session.query(ArrangeHardware).filter(ArrangeHardware.hardware_id == hardware_id).\
-            order_by(ArrangeHardware.doc_date).all()
+        query = db_session.query(ArrangeHardware).filter(criteria).options(
+            joinedload(ArrangeHardware.hardware),
+            joinedload(ArrangeHardware.operation),
+            joinedload(ArrangeHardware.employee),
+            joinedload(ArrangeHardware.employee2),
+            joinedload(ArrangeHardware.it_worker),
+        )
+        if after:
+            doc_date, arrange_id = cls.decode_cursor(after)
+            query = query.filter(or_(
+                ArrangeHardware.doc_date < doc_date,
+                and_(ArrangeHardware.doc_date == doc_date, ArrangeHardware.arrange_id < arrange_id),
+            ))
+        result = query.order_by(ArrangeHardware.doc_date.desc(), ArrangeHardware.arrange_id.desc())\
+            .limit(limit + 1).all()
+
+        next_cursor = cls.encode_cursor(result[limit - 1]) if len(result) > limit else None
+        return result[:limit], next_cursor
 
-        # db_session.close()
-        return result
+    @classmethod
+    def get_act(cls, doc_num) -> list:
+        """
+        All rows of the act with everything the printed act shows
+        """
+        db_session = load_session()
+        return db_session.query(ArrangeHardware).filter(ArrangeHardware.doc_num == doc_num).options(
+            joinedload(ArrangeHardware.hardware).joinedload(Hardware.hardware_brand),
+            joinedload(ArrangeHardware.operation),
+            joinedload(ArrangeHardware.employee),
+            joinedload(ArrangeHardware.employee2),
+            joinedload(ArrangeHardware.it_worker),
+        ).order_by(ArrangeHardware.hardware_id).all()
+
+    @classmethod
+    def get_act_numbers(cls, date_from, date_to) -> list:
+        """
+        Numbers of the acts dated in the period (inclusive)
+        """
+        db_session = load_session()
+        result = db_session.query(ArrangeHardware.doc_num).distinct()\
+            .filter(ArrangeHardware.doc_date.between(date_from, date_to))\
+            .order_by(ArrangeHardware.doc_num).all()
+        return [doc_num for doc_num, in result]
+
+    @staticmethod
+    def encode_cursor(arrange) -> str:
+        return f'{arrange.doc_date.isoformat()}_{arrange.arrange_id}'
+
+    @staticmethod
+    def decode_cursor(cursor: str):
+        """
+        :raise ValueError: if the cursor is malformed
+        """
+        doc_date, arrange_id = cursor.split('_')
+        return date.fromisoformat(doc_date), int(arrange_id)
+
+    def to_dict(self) -> dict:
+        return {
+            'arrange_id': self.arrange_id,
+            'doc_num': self.doc_num,
+            'doc_date': self.doc_date.isoformat() if self.doc_date else None,
+            'operation': {'id': self.operation_id, 'name': self.operation.name if self.operation else None},
+            'hardware': {'id': self.hardware_id, 'name': self.hardware.name if self.hardware else None},
+            'employee': _worker_dict(self.employee_id, self.employee),
+            'employee2': _worker_dict(self.employee2_id, self.employee2),
+            'it_worker': _worker_dict(self.it_worker_id, self.it_worker),
+        }
+
+
+def _worker_dict(worker_id, worker):
+    if worker_id is None:
+        return None
+    return {'id': worker_id, 'name': worker.name if worker else None}
+
+
+class DocCounter(Base):
+    """
+    Document number sequences (e.g arrange act numbers).
+    Numbers are allocated with a single-row UPDATE in a short transaction of its own,
+    so concurrent acts never get the same number and don't wait for each other.
+    A number is lost (gap) if the act using it is rolled back
+    """
+    ARRANGE = 'arrange'
+    # Incremented after every committed change of hardware, its use or reference data (HTTP ETags)
+    CHANGE_VERSION = 'change_version'
+
+    __tablename__ = 'doc_counters'
+
+    name = Column(String(50), primary_key=True)
+    last_value = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'DocCounter(name={self.name}, last_value={self.last_value})'
+
+    @classmethod
+    def allocate(cls, name, count=1) -> int:
+        """
+        Allocate count consecutive numbers
+        :return: first allocated number
+        """
+        table = cls.__table__
+        engine = get_engine()
+        for _ in range(2):
+            with engine.begin() as conn:
+                result = conn.execute(table.update().where(table.c.name == name)
+                                      .values(last_value=table.c.last_value + count))
+                if result.rowcount == 1:
+                    last_value = conn.execute(select(table.c.last_value).where(table.c.name == name)).scalar()
+                    return last_value - count + 1
+            cls._create(name)
+        raise RuntimeError(f'Document counter {name} can not be created')
+
+    @classmethod
+    def peek(cls, name) -> int:
+        """
+        Next number without allocating it
+        """
+        table = cls.__table__
+        with get_engine_for_read().connect() as conn:
+            last_value = conn.execute(select(table.c.last_value).where(table.c.name == name)).scalar()
+            if last_value is None:
+                last_value = cls._initial_value(conn)
+        return last_value + 1
+
+    @classmethod
+    def current(cls, name) -> int:
+        """
+        Last allocated number (0 if the counter is not used yet)
+        """
+        table = cls.__table__
+        with get_engine_for_read().connect() as conn:
+            return conn.execute(select(table.c.last_value).where(table.c.name == name)).scalar() or 0
+
+    @classmethod
+    def _create(cls, name):
+        """
+        First use of the counter. Act numbers continue from the acts already in the DB
+        """
+        try:
+            with get_engine().begin() as conn:
+                last_value = cls._initial_value(conn) if name == cls.ARRANGE else 0
+                conn.execute(cls.__table__.insert().values(name=name, last_value=last_value))
+        except IntegrityError:
+            pass  # created by concurrent allocation
+
+    @staticmethod
+    def _initial_value(conn) -> int:
+        last_use = conn.execute(select(func.max(HardwareUse.__table__.c.doc_num))).scalar()
+        last_arrange = conn.execute(select(func.max(ArrangeHardware.__table__.c.doc_num))).scalar()
+        return max(last_use or 0, last_arrange or 0)
+
+
+def hardware_changed(hardware_ids):
+    """
+    Call after commit of a change of hardware or its use (edit, import, arrange act):
+    bumps the change version and updates the search index.
+    The change is already committed, so errors are logged and not raised
+    """
+    try:
+        DocCounter.allocate(DocCounter.CHANGE_VERSION)
+    except Exception:
+        logger.exception('Change version not bumped after the change of %d hardware', len(hardware_ids))
+    try:
+        search_index.hardware_changed(hardware_ids)
+    except Exception:
+        logger.exception('Search index not updated after the change of %d hardware', len(hardware_ids))
+
+
+def change_version() -> int:
+    """
+    Version of the inventory data, changes after every committed write (HTTP ETags)
+    """
+    return DocCounter.current(DocCounter.CHANGE_VERSION)
 
 
 class PreArrange:
@@ -237,36 +626,236 @@ class PreArrange:
         self.doc_num = self.get_next_doc_num()
         self.arrange_operations = self.get_arrange_operations()
         self.doc_date = date.today()
+        # sent back with the form, a second submit of the same form is not applied again (async mode)
+        self.idempotency_key = uuid.uuid4().hex
 
-    def get_workers(self, it_workers: bool) -> list:
+    @staticmethod
+    def get_workers(it_workers: bool) -> tuple:
         """
         Get all rows from workers DB table with department id == 1 (i.e IT workers)
         :param it_workers: <bool> if True: return it workers else return all except it workers
-        :return -> list: List of it workers
+        :return -> tuple: snapshots of the workers from the reference cache
         """
         if it_workers:
-            return self.db_session.query(Worker).filter(Worker.department_id == 1).all()
+            return reference_cache.it_workers()
         else:
-            return self.db_session.query(Worker).filter(Worker.department_id != 1).all()
+            return reference_cache.workers()
 
-    def get_next_doc_num(self):
+    @staticmethod
+    def get_next_doc_num():
         """
-        Get the last document number from DB table HardwareUse
+        Number the next act will most likely get. The number is not reserved,
+        the act gets its number from DocCounter when it is saved
         :return:
         """
-        last_doc_num = self.db_session.query(func.max(HardwareUse.doc_num)).scalar()
-        if not last_doc_num:
-            return 1
+        return DocCounter.peek(DocCounter.ARRANGE)
 
-        return last_doc_num + 1
-
-    def get_arrange_operations(self):
-        return self.db_session.query(ArrangeOperation).all()
+    @staticmethod
+    def get_arrange_operations():
+        return reference_cache.arrange_operations()
 
     def get_selected_hardware(self, hardware_id: list):
         return self.db_session.query(Hardware).filter(Hardware.hardware_id.in_(hardware_id)).all()
 
 
+# === Arrange jobs
+
+
+class ArrangeJob(Base):
+    """
+    Arrange act submitted for background processing (modules/arrange_jobs.py).
+    idempotency_key is unique: the same form submitted twice returns the first job instead of a new act.
+    Rows are written in short transactions of their own, never inside the transaction of the act.
+    The process running the job renews heartbeat, a queued or running job without it is failed by fail_stale()
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    __tablename__ = 'arrange_jobs'
+
+    job_id = Column(String(32), primary_key=True)
+    idempotency_key = Column(String(100), nullable=False, unique=True)
+    status = Column(String(20), nullable=False, default=QUEUED)
+    hardware_count = Column(Integer, nullable=False, default=0)
+    doc_num = Column(Integer, nullable=True)
+    message = Column(String, nullable=True)
+    message_status = Column(String(30), nullable=True)  # css class of STATUS_MESSAGES
+    created = Column(DateTime, default=datetime.now)
+    finished = Column(DateTime, nullable=True)
+    heartbeat = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'ArrangeJob(job_id={self.job_id}, status={self.status}, doc_num={self.doc_num})'
+
+    @classmethod
+    def create(cls, job_id, idempotency_key, hardware_count) -> bool:
+        """
+        :return: False if a job with the idempotency key already exists
+        """
+        now = datetime.now()
+        try:
+            with get_engine().begin() as conn:
+                conn.execute(cls.__table__.insert().values(job_id=job_id, idempotency_key=idempotency_key,
+                                                           status=cls.QUEUED, hardware_count=hardware_count,
+                                                           created=now, heartbeat=now))
+        except IntegrityError:
+            return False
+        return True
+
+    @classmethod
+    def beat(cls, job_ids):
+        """
+        Renew the heartbeat of the jobs queued or running in this process
+        """
+        table = cls.__table__
+        with get_engine().begin() as conn:
+            conn.execute(table.update().where(table.c.job_id.in_(job_ids)).values(heartbeat=datetime.now()))
+
+    @classmethod
+    def fail_stale(cls, job_id, stale_before, message) -> bool:
+        """
+        Fail the queued or running job if its heartbeat is older than stale_before: its process stopped
+        and the DB rolled back the act
+        :return: True if the job was failed
+        """
+        table = cls.__table__
+        with get_engine().begin() as conn:
+            result = conn.execute(table.update().where(table.c.job_id == job_id,
+                                                       table.c.status.in_((cls.QUEUED, cls.RUNNING)),
+                                                       or_(table.c.heartbeat.is_(None),
+                                                           table.c.heartbeat < stale_before))
+                                  .values(status=cls.FAILED, message=message, message_status='bg-danger',
+                                          finished=datetime.now()))
+        return result.rowcount > 0
+
+    @classmethod
+    def release_key(cls, idempotency_key) -> bool:
+        """
+        Give the idempotency key of a failed job to a new job: the failed act was rolled back, a retry applies it.
+        The failed job keeps its own id as the key
+        :return: True if the key was released
+        """
+        table = cls.__table__
+        with get_engine().begin() as conn:
+            result = conn.execute(table.update().where(table.c.idempotency_key == idempotency_key,
+                                                       table.c.status == cls.FAILED)
+                                  .values(idempotency_key=table.c.job_id))
+        return result.rowcount > 0
+
+    @classmethod
+    def update(cls, job_id, **values):
+        table = cls.__table__
+        with get_engine().begin() as conn:
+            conn.execute(table.update().where(table.c.job_id == job_id).values(**values))
+
+    @classmethod
+    def get(cls, job_id=None, idempotency_key=None) -> dict:
+        """
+        Job by id or by idempotency key, None if not found
+        """
+        table = cls.__table__
+        criteria = table.c.job_id == job_id if job_id is not None else table.c.idempotency_key == idempotency_key
+        with get_engine().connect() as conn:
+            row = conn.execute(select(table).where(criteria)).mappings().first()
+        return dict(row) if row else None
+
+
+# === Audit
+
+
+def audit_user() -> str:
+    """
+    Who makes the change: the user authenticated by the web server (REMOTE_USER) or the client address,
+    the OS user outside of requests (cli)
+    """
+    if has_request_context():
+        return (request.remote_user or request.remote_addr or '')[:100]
+    return f'{getpass.getuser()}@cli'[:100]
+
+
+class AuditOutbox(Base):
+    """
+    Changes of the hardware written in the transaction of the change: one row per edit or per hardware
+    of an arrange act with the changed fields {"field": [before, after]}.
+    modules/audit.py moves the rows to the append-only audit_log in batches, one row per field
+    """
+    EDIT = 'edit'
+    ARRANGE = 'arrange'
+
+    __tablename__ = 'audit_outbox'
+
+    outbox_id = Column(Integer, primary_key=True, autoincrement=True)
+    hardware_id = Column(Integer, nullable=False)
+    action = Column(String(20), nullable=False)
+    changes = Column(String, nullable=False)  # compact JSON
+    changed_by = Column(String(100), nullable=True)
+    doc_num = Column(Integer, nullable=True)  # act of the arrange
+    changed = Column(DateTime, default=datetime.now)
+
+    @staticmethod
+    def audit_value(value):
+        """
+        Values are compared and stored as text: form values are strings, the DB values are not
+        """
+        if value is None or value == '':
+            return None
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        return str(value)
+
+    @classmethod
+    def diff(cls, before: dict, after: dict) -> dict:
+        """
+        {field: [before, after]} of the fields which changed
+        """
+        changes = {}
+        for field, value in after.items():
+            old, new = cls.audit_value(before.get(field)), cls.audit_value(value)
+            if old != new:
+                changes[field] = [old, new]
+        return changes
+
+    @classmethod
+    def row(cls, hardware_id, action, changes: dict, changed_by, doc_num=None) -> dict:
+        return {'hardware_id': hardware_id, 'action': action, 'changed_by': changed_by, 'doc_num': doc_num,
+                'changes': json.dumps(changes, ensure_ascii=False, separators=(',', ':')), 'changed': datetime.now()}
+
+    @classmethod
+    def add(cls, db_session, rows: list):
+        """
+        Insert the rows in the transaction of the change (one executemany, no commit)
+        """
+        rows = [row for row in rows if row['changes'] != '{}']
+        if rows:
+            db_session.execute(cls.__table__.insert(), rows)
+
+
+class AuditLog(Base):
+    """
+    Field level audit trail, rows are only inserted (by the flusher of modules/audit.py).
+    (outbox_id, field) is unique, so an outbox row flushed twice by two processes is rejected
+    """
+    __tablename__ = 'audit_log'
+    __table_args__ = (
+        Index('ix_audit_log_hardware', 'hardware_id', 'audit_id'),
+        Index('ix_audit_log_changed_by', 'changed_by', 'audit_id'),
+        Index('uq_audit_log_outbox_field', 'outbox_id', 'field', unique=True),
+    )
+
+    audit_id = Column(Integer, primary_key=True, autoincrement=True)
+    outbox_id = Column(Integer, nullable=False)
+    hardware_id = Column(Integer, nullable=False)
+    action = Column(String(20), nullable=False)
+    field = Column(String(50), nullable=False)
+    old_value = Column(String, nullable=True)
+    new_value = Column(String, nullable=True)
+    changed_by = Column(String(100), nullable=True)
+    doc_num = Column(Integer, nullable=True)
+    changed = Column(DateTime, nullable=False)
+
+
 # === Hardware
 
 class Brand(Base):
@@ -326,6 +915,10 @@ class Hardware(Base):
     hardware_type = relationship('HardwareType', viewonly='True')
     hardware_use = relationship('HardwareUse', backref='hardware_use', uselist=False)
 
+    # fields of the edit form, their changes are written to the audit log
+    AUDITED_FIELDS = ('name', 'hardware_condition_id', 'hardware_type_id', 'hardware_brand_id', 'validation_date',
+                      'serial_num', 'description')
+
     def __init__(self, **hardware_data):
         self.hardware_id = int(hardware_data['hardware_id'])
         self.name = hardware_data['hardware_name']
@@ -339,17 +932,82 @@ class Hardware(Base):
     def __repr__(self):
         return f'Hardware(hardware_id={self.hardware_id}, name={self.name}'
 
-    @hybrid_method
-    def get_list_of_hardware(self):
+    @staticmethod
+    def table_columns() -> list:
+        """
+        Columns of the hardware table (hardwareList.html) in the order they are displayed
+        """
+        return [
+            Hardware.hardware_id,
+            Hardware.name,
+            Hardware.validation_date,
+            Hardware.serial_num,
+            HardwareCondition.name,
+            HardwareType.name,
+            Brand.name,
+            Hardware.description,
+            HardwareUse.status_id,
+        ]
+
+    @classmethod
+    def get_hardware_page(cls, start=0, length=10, search=None, order_column=1, order_dir='asc'):
+        """
+        One page of the hardware table. Filtering, sorting and paging are done by the DB
+        :param start: offset of the first row
+        :param length: number of rows, None for all rows
+        :param search: text to search in the table columns
+        :param order_column: index of the column in table_columns()
+        :param order_dir: 'asc' or 'desc'
+        :return: (total number of rows, number of rows after search, list of hardware)
+        """
         db_session = load_session()
-        result = db_session.query(Hardware).all()
-        return result
+        records_total = db_session.query(func.count(Hardware.hardware_id)).scalar()
+
+        query = db_session.query(Hardware)\
+            .outerjoin(Hardware.hardware_condition)\
+            .outerjoin(Hardware.hardware_type)\
+            .outerjoin(Hardware.hardware_brand)\
+            .outerjoin(Hardware.hardware_use)
+
+        records_filtered = records_total
+        if search:
+            query = query.filter(cls.search_filter(search))
+            records_filtered = query.with_entities(func.count(Hardware.hardware_id)).scalar()
+
+        columns = cls.table_columns()
+        column = columns[order_column] if 0 <= order_column < len(columns) else Hardware.name
+        query = query.order_by(column.desc() if order_dir == 'desc' else column.asc(), Hardware.hardware_id)
+        query = query.options(
+            contains_eager(Hardware.hardware_condition),
+            contains_eager(Hardware.hardware_type),
+            contains_eager(Hardware.hardware_brand),
+            contains_eager(Hardware.hardware_use).joinedload(HardwareUse.employee),
+        )
+        query = query.offset(start)
+        if length is not None:
+            query = query.limit(length)
+
+        return records_total, records_filtered, query.all()
+
+    @staticmethod
+    def search_filter(search: str):
+        """
+        Filter for the hardware table search: inventory code, name, serial number, description,
+        condition, type and brand
+        """
+        text_columns = [Hardware.name, Hardware.serial_num, Hardware.description,
+                        HardwareCondition.name, HardwareType.name, Brand.name]
+        conditions = [column.contains(search, autoescape=True) for column in text_columns]
+        if search.isdigit():
+            # Inventory code is shown zero-padded (e.g 00000042)
+            code = search.lstrip('0') or '0'
+            conditions.append(cast(Hardware.hardware_id, String).contains(code, autoescape=True))
+        return or_(*conditions)
 
     @classmethod
     def get_hardware(cls, hardware_id):
         db_session = load_session()
         hrdw = db_session.query(Hardware).filter(Hardware.hardware_id == hardware_id).scalar()
-        db_session.close()
         return hrdw
 
     @hybrid_property
@@ -361,6 +1019,15 @@ class Hardware(Base):
         db_session = load_session()
         hardware = db_session.query(Hardware).filter(Hardware.hardware_id == self.hardware_id).scalar()
 
+        if (hardware.hardware_type_id or None) != (self.hardware_type_id or None):
+            HoldingsSummary.apply(db_session, {
+                HoldingsSummary.key(hardware): -1,
+                HoldingsSummary.key(hardware, hardware_type_id=self.hardware_type_id): 1,
+            })
+        changes = AuditOutbox.diff({field: getattr(hardware, field) for field in self.AUDITED_FIELDS},
+                                   {field: getattr(self, field) for field in self.AUDITED_FIELDS})
+        if changes:
+            AuditOutbox.add(db_session, [AuditOutbox.row(self.hardware_id, AuditOutbox.EDIT, changes, audit_user())])
         hardware.name = self.name
         hardware.hardware_condition_id = self.hardware_condition_id
         hardware.hardware_type_id = self.hardware_type_id
@@ -369,7 +1036,7 @@ class Hardware(Base):
         hardware.serial_num = self.serial_num
         hardware.description = self.description
         db_session.commit()
-        db_session.close()
+        hardware_changed([self.hardware_id])
 
 
 class HardwareEdit:
@@ -379,10 +1046,9 @@ class HardwareEdit:
     def __call__(self):
         db_session = load_session()
         self.hardware = db_session.query(Hardware).filter(Hardware.hardware_id == self.hardware_id).scalar()
-        self.hardware_conditions = db_session.query(HardwareCondition).all()
-        self.hardware_types = db_session.query(HardwareType).all()
-        self.hardware_brands = db_session.query(Brand).all()
-        db_session.close()
+        self.hardware_conditions = reference_cache.hardware_conditions()
+        self.hardware_types = reference_cache.hardware_types()
+        self.hardware_brands = reference_cache.brands()
 
 # === Hardware Use
 
@@ -425,6 +1091,7 @@ class Department(Base):
     """
     Workers departments (e.g HR, IT and etc..)
     """
+    IT = 1
 
     __tablename__ = 'departments'
 
@@ -458,5 +1125,368 @@ class Worker(Base):
     def __repr__(self):
         return f'Worker(worker_id = {self.worker_id}, name = {self.name}, department = {self.department.name})'
 
+    @classmethod
+    def get_worker(cls, worker_id):
+        db_session = load_session()
+        return db_session.query(Worker).filter(Worker.worker_id == worker_id).scalar()
+
+
+# === Holdings summary
+
+
+class HoldingsSummary(Base):
+    """
+    Materialized hardware counts by owner, hardware type and arrange status.
+    Updated incrementally in the transaction which changes the hardware (arrange act, import, type edit),
+    so the dashboard reads a table which size depends on the number of workers and types, not of hardware.
+    Rows are never deleted by the updates (count may be 0), rebuild() recomputes the table from scratch
+    """
+    NOBODY = 0  # employee_id of hardware without owner
+    NO_TYPE = 0  # hardware_type_id of hardware without type
+
+    __tablename__ = 'holdings_summary'
+
+    employee_id = Column(Integer, primary_key=True, autoincrement=False)
+    hardware_type_id = Column(Integer, primary_key=True, autoincrement=False)
+    status_id = Column(Integer, primary_key=True, autoincrement=False)
+    hardware_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'HoldingsSummary(employee_id={self.employee_id}, hardware_type_id={self.hardware_type_id}, ' \
+               f'status_id={self.status_id}, hardware_count={self.hardware_count})'
+
+    @classmethod
+    def key(cls, hardware, employee_id=None, status_id=None, hardware_type_id=None) -> tuple:
+        """
+        (employee_id, hardware_type_id, status_id) of the hardware, arguments override the current values.
+        Hardware without row in Hardware_use is free and has no owner
+        """
+        hardware_use = hardware.hardware_use
+        if employee_id is None and status_id is None:
+            employee_id = hardware_use.employee_id if hardware_use else None
+        if status_id is None:
+            status_id = hardware_use.status_id if hardware_use and hardware_use.status_id else ArrangeStatus.FREE
+        if hardware_type_id is None:
+            hardware_type_id = hardware.hardware_type_id
+        return employee_id or cls.NOBODY, hardware_type_id or cls.NO_TYPE, status_id
+
+    @classmethod
+    def apply(cls, db_session, changes: dict):
+        """
+        Add count changes {key: +-n} to the summary (no commit).
+        Keys are updated in sorted order, so concurrent transactions lock rows in the same order
+        """
+        table = cls.__table__
+        for (employee_id, hardware_type_id, status_id), count in sorted(changes.items()):
+            if not count:
+                continue
+            result = db_session.execute(
+                table.update()
+                .where(table.c.employee_id == employee_id, table.c.hardware_type_id == hardware_type_id,
+                       table.c.status_id == status_id)
+                .values(hardware_count=table.c.hardware_count + count)
+            )
+            if result.rowcount == 0:
+                db_session.execute(table.insert().values(employee_id=employee_id, hardware_type_id=hardware_type_id,
+                                                         status_id=status_id, hardware_count=count))
+
+    @classmethod
+    def rebuild(cls) -> int:
+        """
+        Recompute the summary from hardware and hardware_use in one transaction
+        :return: number of summary rows
+        """
+        table = cls.__table__
+        hardware = Hardware.__table__
+        hardware_use = HardwareUse.__table__
+        employee_id = func.coalesce(hardware_use.c.employee_id, cls.NOBODY)
+        hardware_type_id = func.coalesce(hardware.c.id_type, cls.NO_TYPE)
+        status_id = func.coalesce(hardware_use.c.status_id, ArrangeStatus.FREE)
+        counts = select(employee_id, hardware_type_id, status_id, func.count()) \
+            .select_from(hardware.outerjoin(hardware_use)) \
+            .group_by(employee_id, hardware_type_id, status_id)
+
+        with get_engine().begin() as conn:
+            conn.execute(table.delete())
+            result = conn.execute(table.insert().from_select(
+                ['employee_id', 'hardware_type_id', 'status_id', 'hardware_count'], counts))
+        # cached /holdings pages (ETags) show the rebuilt totals
+        DocCounter.allocate(DocCounter.CHANGE_VERSION)
+        return result.rowcount
+
+    @classmethod
+    def totals(cls) -> list:
+        """
+        Hardware count by type and status: [(type name, status name, count)]
+        """
+        table = cls.__table__
+        query = select(HardwareType.__table__.c.name, ArrangeStatus.__table__.c.name,
+                       func.sum(table.c.hardware_count)) \
+            .select_from(table
+                         .outerjoin(HardwareType.__table__, HardwareType.__table__.c.type_id == table.c.hardware_type_id)
+                         .outerjoin(ArrangeStatus.__table__, ArrangeStatus.__table__.c.arr_status_id == table.c.status_id)) \
+            .where(table.c.hardware_count != 0) \
+            .group_by(HardwareType.__table__.c.name, ArrangeStatus.__table__.c.name) \
+            .order_by(HardwareType.__table__.c.name, ArrangeStatus.__table__.c.name)
+        return cls._read(query)
+
+    @classmethod
+    def by_department(cls) -> list:
+        """
+        Hardware in use by department and type: [(department name, type name, count)]
+        """
+        table = cls.__table__
+        department = Department.__table__
+        query = select(department.c.name, HardwareType.__table__.c.name, func.sum(table.c.hardware_count)) \
+            .select_from(table
+                         .join(Worker.__table__, Worker.__table__.c.worker_id == table.c.employee_id)
+                         .outerjoin(department)
+                         .outerjoin(HardwareType.__table__, HardwareType.__table__.c.type_id == table.c.hardware_type_id)) \
+            .where(table.c.status_id == ArrangeStatus.IN_USE, table.c.hardware_count != 0) \
+            .group_by(department.c.name, HardwareType.__table__.c.name) \
+            .order_by(department.c.name, HardwareType.__table__.c.name)
+        return cls._read(query)
+
+    @classmethod
+    def by_worker(cls) -> list:
+        """
+        Hardware in use by worker: [(worker id, worker name, department name, count)], biggest holders first
+        """
+        table = cls.__table__
+        worker = Worker.__table__
+        hardware_count = func.sum(table.c.hardware_count)
+        query = select(worker.c.worker_id, worker.c.name, Department.__table__.c.name, hardware_count) \
+            .select_from(table
+                         .join(worker, worker.c.worker_id == table.c.employee_id)
+                         .outerjoin(Department.__table__)) \
+            .where(table.c.status_id == ArrangeStatus.IN_USE, table.c.hardware_count != 0) \
+            .group_by(worker.c.worker_id, worker.c.name, Department.__table__.c.name) \
+            .order_by(hardware_count.desc(), worker.c.name)
+        return cls._read(query)
+
+    @staticmethod
+    def _read(query) -> list:
+        with get_engine_for_read().connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+
+# === Ownership snapshots
+
+
+class OwnershipSnapshot(Base):
+    """
+    Owner of every hardware in use at the end of snapshot_date, rebuilt from the arranges history
+    (modules/ownership.py). Past ownership is read from the nearest snapshot plus the acts after it
+    """
+    __tablename__ = 'ownership_snapshots'
+    __table_args__ = (
+        Index('ix_ownership_snapshots_employee', 'snapshot_date', 'employee_id'),
+    )
+
+    snapshot_date = Column(Date, primary_key=True)
+    hardware_id = Column(Integer, primary_key=True, autoincrement=False)
+    employee_id = Column(Integer, nullable=False)
+    doc_num = Column(Integer, nullable=True)  # act which gave the hardware to the employee
+    doc_date = Column(Date, nullable=True)
+
+
+class OwnershipSnapshotRun(Base):
+    """
+    Complete snapshot of the date. Snapshot rows without a run are not used (being written or invalidated)
+    """
+    __tablename__ = 'ownership_snapshot_runs'
+
+    snapshot_date = Column(Date, primary_key=True)
+    hardware_count = Column(Integer, nullable=False, default=0)
+    events = Column(Integer, nullable=False, default=0)  # acts replayed to build the snapshot
+    created = Column(DateTime, default=datetime.now)
+
+    @classmethod
+    def invalidate_from(cls, db_session, doc_date):
+        """
+        Act dated in the past changes the snapshots of its date and later ones (no commit).
+        Snapshots are taken only for past days, an act of today doesn't need the statement
+        """
+        if doc_date is None or doc_date >= date.today():
+            return
+        table = cls.__table__
+        db_session.execute(table.delete().where(table.c.snapshot_date >= doc_date))
+
+
+# === Stocktake
+
+
+class Stocktake(Base):
+    """
+    Stocktake by scanning inventory codes (modules/stocktake.py): expected holdings are copied
+    to stocktake_expected when the stocktake is opened, scans are appended to stocktake_scans.
+    scan_count is the sequence of the scans: it is incremented in the transaction saving the scans,
+    the row lock makes the transactions of one stocktake commit in the order of their numbers
+    """
+    OPEN = 'open'
+    CLOSED = 'closed'
+
+    __tablename__ = 'stocktakes'
+
+    stocktake_id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), nullable=True)
+    department_id = Column(Integer, nullable=True)  # scope, None for all hardware in use
+    status = Column(String(20), nullable=False, default=OPEN)
+    expected_count = Column(Integer, nullable=False, default=0)
+    scan_count = Column(Integer, nullable=False, default=0)
+    created = Column(DateTime, default=datetime.now)
+    closed = Column(DateTime, nullable=True)
+
+
+class StocktakeExpected(Base):
+    """
+    Owner of every hardware in use of the scope when the stocktake was opened
+    """
+    __tablename__ = 'stocktake_expected'
+
+    stocktake_id = Column(Integer, primary_key=True, autoincrement=False)
+    hardware_id = Column(Integer, primary_key=True, autoincrement=False)
+    employee_id = Column(Integer, nullable=False)
+
+
+class StocktakeScan(Base):
+    """
+    Scanned inventory code: hardware found at the place of the worker (location_id).
+    seq is the number of the scan in the stocktake (Stocktake.scan_count)
+    """
+    __tablename__ = 'stocktake_scans'
+
+    stocktake_id = Column(Integer, primary_key=True, autoincrement=False)
+    seq = Column(Integer, primary_key=True, autoincrement=False)
+    hardware_id = Column(Integer, nullable=False)
+    location_id = Column(Integer, nullable=False)
+    scanner = Column(String(50), nullable=True)
+    scanned = Column(DateTime, default=datetime.now)
+
+
+# === Reference data cache
+
+
+class ReferenceCache:
+    """
+    In-process cache of the small, rarely changed tables (brands, types, conditions, operations, workers).
+    Rows are returned as immutable snapshots (tuples of namedtuples) which are not bound to any session.
+    Entries expire after ttl seconds and are invalidated when the tables are changed through the ORM
+    """
+
+    # cache entry -> (model, filter)
+    ENTRIES = {
+        'brands': lambda: (Brand, None),
+        'hardware_types': lambda: (HardwareType, None),
+        'hardware_conditions': lambda: (HardwareCondition, None),
+        'arrange_operations': lambda: (ArrangeOperation, None),
+        'it_workers': lambda: (Worker, Worker.department_id == Department.IT),
+        'workers': lambda: (Worker, Worker.department_id != Department.IT),
+    }
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # name -> (expire time, snapshot)
+        self._row_types = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name) -> tuple:
+        entry = self._entries.get(name)
+        if entry and entry[0] > time.monotonic():
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+
+        snapshot = self._load(name)
+        with self._lock:
+            self.misses += 1
+            self._entries[name] = (time.monotonic() + self.ttl, snapshot)
+        return snapshot
+
+    def _load(self, name) -> tuple:
+        model, criteria = self.ENTRIES[name]()
+        row_type = self._row_type(model)
+        query = load_session().query(*[getattr(model, field) for field in row_type._fields])
+        if criteria is not None:
+            query = query.filter(criteria)
+        return tuple(row_type(*row) for row in query)
+
+    def _row_type(self, model):
+        if model not in self._row_types:
+            fields = [column.key for column in inspect(model).column_attrs]
+            self._row_types[model] = namedtuple(f'{model.__name__}Snapshot', fields)
+        return self._row_types[model]
+
+    def invalidate(self, *names):
+        """
+        Drop cache entries. Without names drop everything
+        """
+        with self._lock:
+            for name in names or list(self._entries):
+                self._entries.pop(name, None)
+
+    def invalidate_tables(self, table_names):
+        """
+        Drop cache entries built from the given DB tables
+        """
+        names = [name for name, entry in self.ENTRIES.items() if entry()[0].__tablename__ in table_names]
+        if names:
+            self.invalidate(*names)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': sorted(self._entries),
+                'ttl_sec': self.ttl,
+            }
+
+    def brands(self):
+        return self.get('brands')
+
+    def hardware_types(self):
+        return self.get('hardware_types')
+
+    def hardware_conditions(self):
+        return self.get('hardware_conditions')
+
+    def arrange_operations(self):
+        return self.get('arrange_operations')
+
+    def it_workers(self):
+        return self.get('it_workers')
+
+    def workers(self):
+        return self.get('workers')
+
+
+reference_cache = ReferenceCache(ttl=int(os.environ.get('HARDWARE_REFERENCE_CACHE_TTL', 300)))
+
+REFERENCE_TABLES = {'brands', 'hardware_types', 'hardware_conditions', 'arrange_operations', 'workers'}
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_reference_changes(session, flush_context):
+    changed = {inspect(obj).mapper.persist_selectable.name for obj in session.new | session.dirty | session.deleted}
+    changed &= REFERENCE_TABLES
+    if changed:
+        session.info.setdefault('changed_reference_tables', set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_reference_cache(session):
+    changed = session.info.pop('changed_reference_tables', None)
+    if changed:
+        reference_cache.invalidate_tables(changed)
+        DocCounter.allocate(DocCounter.CHANGE_VERSION)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_reference_changes(session):
+    session.info.pop('changed_reference_tables', None)
+
 
 Base.prepare()
@@ -0,0 +1,251 @@
+import calendar
+import logging
+from datetime import date, timedelta
+from sqlalchemy import func, or_, select
+from modules.model import ArrangeHardware, ArrangeOperation, Department, Hardware, OwnershipSnapshot, \
+    OwnershipSnapshotRun, Worker, chunks
+from modules.session_manager import get_engine, get_engine_for_read
+
+
+logger = logging.getLogger(__name__)
+
+# Operations which change the owner of the hardware, other acts are skipped by the replay
+OWNER_CHANGES = (ArrangeOperation.ACCEPT, ArrangeOperation.RETURN, ArrangeOperation.TRANSFER)
+PERIODS = ('week', 'month', 'quarter')
+YIELD_PER = 10000
+INSERT_CHUNK = 10000
+
+
+class OwnershipError(ValueError):
+    """
+    Snapshot can not be taken for the date
+    """
+
+
+def owner_after(operation_id, employee_id, employee2_id):
+    """
+    Owner of the hardware after the act, None if the hardware is free
+    """
+    if operation_id == ArrangeOperation.ACCEPT:
+        return employee_id
+    if operation_id == ArrangeOperation.TRANSFER:
+        return employee2_id
+    return None
+
+
+def hardware_owner(hardware_id, as_of: date) -> dict:
+    """
+    Owner of the hardware at the end of the day: the last act of the hardware up to the day
+    (index ix_arranges_hardware_doc_date), no snapshot is needed
+    :return: {'hardware_id', 'employee_id', 'doc_num', 'doc_date'}, employee_id is None if the hardware was free
+    """
+    arranges = ArrangeHardware.__table__
+    query = select(arranges.c.operation_id, arranges.c.employee_id, arranges.c.employee2_id,
+                   arranges.c.doc_num, arranges.c.doc_date) \
+        .where(arranges.c.hardware_id == hardware_id, arranges.c.doc_date <= as_of,
+               arranges.c.operation_id.in_(OWNER_CHANGES)) \
+        .order_by(arranges.c.doc_date.desc(), arranges.c.arrange_id.desc()) \
+        .limit(1)
+    with get_engine_for_read().connect() as conn:
+        row = conn.execute(query).first()
+    if row is None:
+        return {'hardware_id': hardware_id, 'employee_id': None, 'doc_num': None, 'doc_date': None}
+    return {'hardware_id': hardware_id, 'employee_id': owner_after(row.operation_id, row.employee_id, row.employee2_id),
+            'doc_num': row.doc_num, 'doc_date': row.doc_date}
+
+
+def department_workers(department_id) -> list:
+    """
+    Current workers of the department, None if there is no such department
+    """
+    workers = Worker.__table__
+    departments = Department.__table__
+    with get_engine_for_read().connect() as conn:
+        if conn.execute(select(departments.c.department_id)
+                        .where(departments.c.department_id == department_id)).first() is None:
+            return None
+        return list(conn.execute(select(workers.c.worker_id).where(workers.c.department_id == department_id))
+                    .scalars())
+
+
+def holdings(worker_ids, as_of: date) -> dict:
+    """
+    Hardware held by the workers at the end of the day: rows of the nearest snapshot up to the day
+    plus the acts of the workers after the snapshot
+    :param worker_ids: owners to report, None for all hardware in use
+    :return: {'hardware': [{'hardware_id', 'employee_id', 'doc_num', 'doc_date'}], 'snapshot_date', 'events_replayed'}
+    """
+    worker_ids = None if worker_ids is None else sorted(set(worker_ids))
+    with get_engine_for_read().connect() as conn:
+        snapshot_date = nearest_snapshot(conn, as_of)
+        owners = _snapshot_owners(conn, snapshot_date, worker_ids) if snapshot_date else {}
+        replayed = _replay(conn, owners, snapshot_date, as_of, worker_ids)
+    return {
+        'hardware': [{'hardware_id': hardware_id, 'employee_id': employee_id, 'doc_num': doc_num, 'doc_date': doc_date}
+                     for hardware_id, (employee_id, doc_num, doc_date) in sorted(owners.items())],
+        'snapshot_date': snapshot_date,
+        'events_replayed': replayed,
+    }
+
+
+def hardware_names(hardware_ids) -> dict:
+    """
+    hardware_id -> (name, serial number)
+    """
+    hardware = Hardware.__table__
+    names = {}
+    with get_engine_for_read().connect() as conn:
+        for ids in chunks(hardware_ids):
+            for row in conn.execute(select(hardware.c.hardware_id, hardware.c.name, hardware.c.serial_num)
+                                    .where(hardware.c.hardware_id.in_(ids))):
+                names[row.hardware_id] = (row.name, row.serial_num)
+    return names
+
+
+def nearest_snapshot(conn, as_of: date, before=False):
+    """
+    Date of the latest complete snapshot up to the day (before the day if before=True), None if there is none
+    """
+    runs = OwnershipSnapshotRun.__table__
+    condition = runs.c.snapshot_date < as_of if before else runs.c.snapshot_date <= as_of
+    return conn.execute(select(func.max(runs.c.snapshot_date)).where(condition)).scalar()
+
+
+def _snapshot_owners(conn, snapshot_date, worker_ids) -> dict:
+    """
+    hardware_id -> (employee_id, doc_num, doc_date) of the snapshot, only the hardware of the workers if given
+    """
+    snapshots = OwnershipSnapshot.__table__
+    query = select(snapshots.c.hardware_id, snapshots.c.employee_id, snapshots.c.doc_num, snapshots.c.doc_date) \
+        .where(snapshots.c.snapshot_date == snapshot_date)
+    owners = {}
+    if worker_ids is None:
+        result = conn.execution_options(stream_results=True, yield_per=YIELD_PER).execute(query)
+        for row in result:
+            owners[row.hardware_id] = (row.employee_id, row.doc_num, row.doc_date)
+        return owners
+    for ids in chunks(worker_ids):
+        for row in conn.execute(query.where(snapshots.c.employee_id.in_(ids))):
+            owners[row.hardware_id] = (row.employee_id, row.doc_num, row.doc_date)
+    return owners
+
+
+def _events(conn, date_from, date_to, worker_ids):
+    """
+    Acts changing the owner in (date_from, date_to] in the order of the history (doc_date, arrange_id).
+    With worker_ids only the acts the workers took part in: hardware gets to or leaves the workers only by them
+    """
+    arranges = ArrangeHardware.__table__
+    query = select(arranges.c.arrange_id, arranges.c.hardware_id, arranges.c.operation_id, arranges.c.employee_id,
+                   arranges.c.employee2_id, arranges.c.doc_num, arranges.c.doc_date) \
+        .where(arranges.c.doc_date <= date_to, arranges.c.operation_id.in_(OWNER_CHANGES))
+    if date_from is not None:
+        query = query.where(arranges.c.doc_date > date_from)
+    if worker_ids is None:
+        query = query.order_by(arranges.c.doc_date, arranges.c.arrange_id)
+        yield from conn.execution_options(stream_results=True, yield_per=YIELD_PER).execute(query)
+        return
+
+    # transfer between workers of different chunks is found twice
+    events = {}
+    for ids in chunks(worker_ids):
+        for row in conn.execute(query.where(or_(arranges.c.employee_id.in_(ids), arranges.c.employee2_id.in_(ids)))):
+            events[row.arrange_id] = row
+    yield from sorted(events.values(), key=lambda row: (row.doc_date, row.arrange_id))
+
+
+def _replay(conn, owners, date_from, date_to, worker_ids) -> int:
+    """
+    Apply the acts of (date_from, date_to] to owners (hardware_id -> (employee_id, doc_num, doc_date))
+    :return: number of acts replayed
+    """
+    workers = None if worker_ids is None else set(worker_ids)
+    replayed = 0
+    for event in _events(conn, date_from, date_to, worker_ids):
+        replayed += 1
+        employee_id = owner_after(event.operation_id, event.employee_id, event.employee2_id)
+        if employee_id is None or (workers is not None and employee_id not in workers):
+            owners.pop(event.hardware_id, None)
+        else:
+            owners[event.hardware_id] = (employee_id, event.doc_num, event.doc_date)
+    return replayed
+
+
+def take_snapshot(snapshot_date: date) -> dict:
+    """
+    Owners of all hardware at the end of the day, built from the previous snapshot and the acts after it.
+    Only past days: acts of today may still come. A back-dated act committed meanwhile makes the snapshot
+    outdated, then it is not saved (OwnershipSnapshotRun.invalidate_from() can't see a run not saved yet)
+    :return: {'snapshot_date', 'hardware_count', 'events', 'base'}
+    """
+    if snapshot_date >= date.today():
+        raise OwnershipError(f'Snapshot of {snapshot_date} can be taken only after the day is over')
+    arranges = ArrangeHardware.__table__
+    snapshots = OwnershipSnapshot.__table__
+    runs = OwnershipSnapshotRun.__table__
+
+    # the snapshot is written to the primary, so it is built from the primary too
+    with get_engine().connect() as conn:
+        last_arrange_id = conn.execute(select(func.max(arranges.c.arrange_id))).scalar() or 0
+        base = nearest_snapshot(conn, snapshot_date, before=True)
+        owners = _snapshot_owners(conn, base, None) if base else {}
+        events = _replay(conn, owners, base, snapshot_date, None)
+
+    with get_engine().begin() as conn:
+        conn.execute(runs.delete().where(runs.c.snapshot_date == snapshot_date))
+        conn.execute(snapshots.delete().where(snapshots.c.snapshot_date == snapshot_date))
+        for hardware_ids in chunks(sorted(owners), INSERT_CHUNK):
+            conn.execute(snapshots.insert(), [
+                {'snapshot_date': snapshot_date, 'hardware_id': hardware_id, 'employee_id': owners[hardware_id][0],
+                 'doc_num': owners[hardware_id][1], 'doc_date': owners[hardware_id][2]}
+                for hardware_id in hardware_ids
+            ])
+        late = conn.execute(select(arranges.c.arrange_id)
+                            .where(arranges.c.arrange_id > last_arrange_id, arranges.c.doc_date <= snapshot_date)
+                            .limit(1)).first()
+        if late is None:
+            conn.execute(runs.insert().values(snapshot_date=snapshot_date, hardware_count=len(owners), events=events))
+    if late is not None:
+        raise OwnershipError(f'Acts dated {snapshot_date} or earlier were saved while the snapshot was taken')
+    logger.info('Ownership snapshot of %s: %d hardware, %d acts replayed since %s',
+                snapshot_date, len(owners), events, base)
+    return {'snapshot_date': snapshot_date, 'hardware_count': len(owners), 'events': events, 'base': base}
+
+
+def period_ends(first: date, until: date, period='month') -> list:
+    """
+    Last days of the periods (week ends on Sunday) from the period of the first day up to until
+    """
+    if period not in PERIODS:
+        raise ValueError(f'Unknown period {period}, expected one of {", ".join(PERIODS)}')
+    ends = []
+    day = first
+    while True:
+        if period == 'week':
+            end = day + timedelta(days=6 - day.weekday())
+        else:
+            month = day.month if period == 'month' else (day.month - 1) // 3 * 3 + 3
+            end = date(day.year, month, calendar.monthrange(day.year, month)[1])
+        if end > until:
+            return ends
+        ends.append(end)
+        day = end + timedelta(days=1)
+
+
+def backfill(until: date = None, period='month') -> list:
+    """
+    Take the missing snapshots of the period ends from the first act up to until (yesterday at most), oldest first,
+    so every snapshot is built from the previous one
+    :return: results of take_snapshot()
+    """
+    yesterday = date.today() - timedelta(days=1)
+    until = min(until or yesterday, yesterday)
+    arranges = ArrangeHardware.__table__
+    runs = OwnershipSnapshotRun.__table__
+    with get_engine().connect() as conn:
+        first = conn.execute(select(func.min(arranges.c.doc_date))).scalar()
+        existing = set(conn.execute(select(runs.c.snapshot_date)).scalars())
+    if first is None:
+        return []
+    return [take_snapshot(snapshot_date) for snapshot_date in period_ends(first, until, period)
+            if snapshot_date not in existing]
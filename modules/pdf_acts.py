@@ -0,0 +1,243 @@
+import glob
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import render_template
+
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PDF_WORKERS = int(os.environ.get('HARDWARE_PDF_WORKERS', 2))
+PDF_CACHE_DIR = os.environ.get('HARDWARE_PDF_CACHE_DIR', os.path.join(BASE_DIR, '.pdf_cache'))
+PDF_OPTIONS = {'encoding': 'UTF-8', 'quiet': '', 'enable-local-file-access': ''}
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+NOT_FOUND = 'not_found'
+
+# period exports followed by the polls of their clients, the oldest are forgotten above this
+EXPORTS_MAX = 100
+# flask prune-pdf-cache removes files older than this
+PDF_CACHE_DAYS = int(os.environ.get('HARDWARE_PDF_CACHE_DAYS', 30))
+
+
+def render_pdf(html, path):
+    """
+    Convert html to pdf file with wkhtmltopdf. Runs in the worker process
+    """
+    import pdfkit
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    pdfkit.from_string(html, tmp_path, options=PDF_OPTIONS)
+    os.replace(tmp_path, path)
+    return path
+
+
+class PdfActs:
+    """
+    PDF acts rendered off the request path in a bounded process pool.
+    Html of the act is rendered in the request (cheap), wkhtmltopdf runs in the pool.
+    Results are cached on disk by act number and hash of the act html, so an unchanged act
+    is never rendered twice (also across server processes). A new render of an act (its html changed)
+    removes the older files of the act, a new zip of a period the older zips of the period
+    """
+
+    def __init__(self, cache_dir=PDF_CACHE_DIR, workers=PDF_WORKERS):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._jobs = {}  # pdf path -> future, until the pdf is written or its failure is reported
+        self._act_paths = {}  # doc_num -> pdf path of the acts being rendered (polls don't render the html again)
+        self._exports = {}  # (date_from, date_to) -> {doc_num: pdf path} of the exports being rendered
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: workers don't inherit DB connections and locks of the server process
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def pdf_path(self, doc_num, html) -> str:
+        content_hash = hashlib.sha256(html.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f'act-{doc_num}-{content_hash}.pdf')
+
+    def submit(self, doc_num):
+        """
+        Start rendering of the act (if it is not rendered or rendering yet). Needs app context
+        :return: pdf path or None if the act does not exist
+        """
+        with self._lock:
+            path = self._act_paths.get(doc_num)
+            if path is not None and path in self._jobs:
+                return path
+        html = self.render_html(doc_num)
+        if html is None:
+            return None
+        path = self.submit_html(html, self.pdf_path(doc_num, html))
+        with self._lock:
+            if path in self._jobs:
+                self._act_paths[doc_num] = path
+        return path
+
+    def submit_html(self, html, path) -> str:
+        """
+        Start rendering of the html to the pdf path (if it is not rendered or rendering yet)
+        """
+        with self._lock:
+            if os.path.exists(path) or (path in self._jobs and not self._jobs[path].done()):
+                return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            future = self.executor.submit(render_pdf, html, path)
+        except BrokenProcessPool:
+            # a worker died (e.g. killed by OOM), start a new pool
+            self.shutdown()
+            future = self.executor.submit(render_pdf, html, path)
+        with self._lock:
+            self._jobs[path] = future
+        future.add_done_callback(lambda done: self._job_done(path, done))
+        return path
+
+    def _job_done(self, path, future):
+        with self._lock:
+            for doc_num in [doc_num for doc_num, act_path in self._act_paths.items() if act_path == path]:
+                del self._act_paths[doc_num]
+            # a failure is kept until status() reports it
+            if future.exception() is None and self._jobs.get(path) is future:
+                del self._jobs[path]
+        if future.exception() is None:
+            # act-<doc_num>-<hash>.pdf: renders of the act before its html changed
+            remove_superseded(path, glob.escape(path.rsplit('-', 1)[0]) + '-*.pdf')
+
+    def prune(self, max_age_days=PDF_CACHE_DAYS) -> int:
+        """
+        Remove cached PDFs, zips and left temporary files older than max_age_days
+        :return: number of removed files
+        """
+        oldest = time.time() - max_age_days * 86400
+        removed = 0
+        for path in glob.glob(os.path.join(self.cache_dir, '*')):
+            try:
+                if os.path.isfile(path) and os.path.getmtime(path) < oldest:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass  # removed by another process meanwhile
+        return removed
+
+    def status(self, path) -> dict:
+        if path is None:
+            return {'status': NOT_FOUND}
+        if os.path.exists(path):
+            return {'status': READY}
+
+        with self._lock:
+            future = self._jobs.get(path)
+            if future is None:
+                return {'status': NOT_FOUND}
+            if not future.done():
+                return {'status': PENDING}
+            del self._jobs[path]
+        if future.exception() is not None:
+            # reported once, the next request renders it again
+            return {'status': FAILED, 'error': str(future.exception())}
+        return {'status': READY}
+
+    @staticmethod
+    def render_html(doc_num):
+        """
+        Html of the act from the arranges history
+        """
+        # imported here, pool workers import this module and don't need the models
+        from modules.model import ArrangeHardware
+
+        act = ArrangeHardware.get_act(doc_num)
+        if not act:
+            return None
+        return render_template('act_pdf.html', act=act, first=act[0],
+                               stylesheet=os.path.join(BASE_DIR, 'static', 'bootstrap.min.css'))
+
+    def export(self, date_from, date_to) -> tuple:
+        """
+        Submit all acts of the period on the first request, later requests of the same period (polls)
+        only check the status of the submitted acts
+        :return: ({doc_num: pdf path}, status summary)
+        """
+        from modules.model import ArrangeHardware
+
+        key = (date_from, date_to)
+        with self._lock:
+            paths = self._exports.get(key)
+        if paths is None:
+            paths = {doc_num: self.submit(doc_num) for doc_num in ArrangeHardware.get_act_numbers(date_from, date_to)}
+            with self._lock:
+                self._exports[key] = paths
+                while len(self._exports) > EXPORTS_MAX:
+                    del self._exports[next(iter(self._exports))]
+
+        status = self.export_status(paths)
+        if status['status'] != PENDING:
+            # finished: a later request of the period looks for new acts again
+            with self._lock:
+                self._exports.pop(key, None)
+        return paths, status
+
+    def export_status(self, paths: dict) -> dict:
+        statuses = {doc_num: self.status(path)['status'] for doc_num, path in paths.items()}
+        summary = {'acts': len(statuses),
+                   'ready': sum(status == READY for status in statuses.values()),
+                   # not found: the act is gone or its failure was reported to another request
+                   'failed': [doc_num for doc_num, status in statuses.items() if status in (FAILED, NOT_FOUND)]}
+        summary['status'] = READY if summary['ready'] == summary['acts'] else \
+            FAILED if summary['failed'] else PENDING
+        return summary
+
+    def export_zip(self, paths: dict, name) -> str:
+        """
+        Pack rendered acts of the period into one zip file (cached by the list of act files)
+        """
+        content_hash = hashlib.sha256('|'.join(sorted(paths.values())).encode()).hexdigest()[:16]
+        zip_path = os.path.join(self.cache_dir, f'acts-{name}-{content_hash}.zip')
+        if not os.path.exists(zip_path):
+            tmp_path = f'{zip_path}.{os.getpid()}.tmp'
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for doc_num, path in sorted(paths.items()):
+                    archive.write(path, f'act-{doc_num}.pdf')
+            os.replace(tmp_path, zip_path)
+            remove_superseded(zip_path, glob.escape(os.path.join(self.cache_dir, f'acts-{name}-')) + '*.zip')
+        return zip_path
+
+
+def remove_superseded(path, pattern):
+    """
+    Remove the cached files matching the pattern except the path
+    """
+    for old_path in glob.glob(pattern):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass  # removed by another process meanwhile
+            except OSError:
+                logger.warning('Superseded file %s was not removed', old_path, exc_info=True)
+
+
+pdf_acts = PdfActs()
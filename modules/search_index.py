@@ -0,0 +1,324 @@
+import bisect
+import heapq
+import itertools
+import math
+import operator
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import select
+from modules.session_manager import get_engine
+
+
+SEARCH_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+SEARCH_INDEX_TTL = int(os.environ.get('HARDWARE_SEARCH_INDEX_TTL', 600))
+PREFIX_SCAN = 20  # scanned index terms per requested result, bounds short prefixes like "a"
+FUZZY_MIN_SIMILARITY = 0.5  # share of the query trigrams a fuzzy match must contain
+FUZZY_MAX_CANDIDATES = 5000
+BULK_REINDEX = 50  # more changed documents are reindexed with one sort of the terms list
+
+HARDWARE = 'hardware'
+WORKER = 'worker'
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text) -> str:
+    return ' '.join(_TOKEN_RE.findall(str(text or '').lower()))
+
+
+def trigrams(term) -> set:
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+def word_trigrams(terms) -> set:
+    """
+    Trigrams of the single words. Numbers (inventory codes, ids) are searched by prefix only
+    """
+    return set().union(*[trigrams(term) for term in terms if ' ' not in term and not term.isdigit()])
+
+
+class SearchIndex:
+    """
+    In-memory typeahead index of hardware (inventory code, serial number, name) and workers (name).
+    Prefix matches are found by bisect in the sorted list of index terms, fragments and typos
+    by trigram posting sets. The index is built on the first search and rebuilt in the background
+    every ttl seconds (changes made by other server processes); changes of this process are applied
+    incrementally with hardware_changed()
+    """
+
+    def __init__(self, ttl=SEARCH_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._built_at = None
+        self._building = False
+        self._changed_while_building = set()
+        self._workers_snapshot = None
+        self._docs = {}  # (kind, id) -> result dict
+        self._terms = {}  # (kind, id) -> index terms
+        self._sorted_terms = []  # sorted (term, (kind, id))
+        self._trigrams = defaultdict(set)  # trigram -> {(kind, id)}
+
+    # -- search
+
+    def search(self, query, limit=SEARCH_LIMIT) -> list:
+        """
+        Top limit matches: exact terms first, then prefixes (shorter terms first), then fuzzy matches
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        self.ensure_built()
+
+        with self._lock:
+            scores = self._prefix_matches(query, limit)
+            # codes and serial numbers found by prefix don't need similar looking numbers
+            if len(scores) < limit and not (scores and any(char.isdigit() for char in query)):
+                self._fuzzy_matches(query, scores, limit)
+            best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], self._docs[item[0]]['label']))
+            return [dict(self._docs[key], score=round(score, 3)) for key, score in best]
+
+    def _prefix_matches(self, query, limit) -> dict:
+        scores = {}
+        terms = self._sorted_terms
+        i = bisect.bisect_left(terms, (query,))
+        end = min(len(terms), i + limit * PREFIX_SCAN)
+        while i < end and terms[i][0].startswith(query):
+            term, key = terms[i]
+            score = 3.0 if term == query else 2.0 + len(query) / len(term)
+            if score > scores.get(key, 0):
+                scores[key] = score
+            i += 1
+        return scores
+
+    def _fuzzy_matches(self, query, scores, limit):
+        """
+        Documents which contain at least FUZZY_MIN_SIMILARITY of the query trigrams (fragments and typos).
+        Documents with all trigrams come first, partial matches are counted only if they are not enough
+        """
+        postings = sorted((self._trigrams.get(gram, set()) for gram in word_trigrams(query.split())), key=len)
+        if not postings:
+            return
+        # documents with all trigrams are equally good, any limit of them are taken
+        for key in itertools.islice(set.intersection(*postings).difference(scores), limit):
+            scores[key] = 1.0
+        if len(scores) >= limit:
+            return
+
+        # a document with `required` trigrams is in one of the (trigrams - required + 1) rarest posting sets.
+        # Scanning stops when enough documents with the best possible number of trigrams are found
+        required = max(1, math.ceil(len(postings) * FUZZY_MIN_SIMILARITY))
+        best_possible = sum(1 for posting in postings if posting)
+        wanted = limit - len(scores)
+        checked = set()
+        for posting in postings[:len(postings) - required + 1]:
+            for key in posting:
+                if key in scores or key in checked:
+                    continue
+                checked.add(key)
+                hits = sum(key in other for other in postings)
+                if hits >= required:
+                    scores[key] = hits / len(postings)
+                    if hits == best_possible:
+                        wanted -= 1
+                if wanted <= 0 or len(checked) >= FUZZY_MAX_CANDIDATES:
+                    return
+
+    # -- building
+
+    def ensure_built(self):
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self.rebuild()
+        elif time.monotonic() - self._built_at > self.ttl and not self._building:
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+        self._refresh_workers()
+
+    def _rebuild_in_background(self):
+        if not self._build_lock.acquire(blocking=False):
+            return
+        try:
+            self.rebuild()
+        finally:
+            self._build_lock.release()
+
+    def rebuild(self):
+        """
+        Build the whole index from the DB. The old index keeps serving searches while the new one is built
+        """
+        with self._lock:
+            self._building = True
+            self._changed_while_building = set()
+        try:
+            index = SearchIndex(ttl=self.ttl)
+            for doc in _load_hardware():
+                index._add(doc, _hardware_terms(doc), keep_sorted=False)
+            index._sorted_terms.sort()
+
+            with self._lock:
+                self._docs, self._terms = index._docs, index._terms
+                self._sorted_terms, self._trigrams = index._sorted_terms, index._trigrams
+                self._workers_snapshot = None
+                self._built_at = time.monotonic()
+                changed = self._changed_while_building
+        finally:
+            with self._lock:
+                self._building = False
+        if changed:
+            self.hardware_changed(changed)
+
+    def _refresh_workers(self):
+        """
+        Worker documents follow the reference data cache (reindexed when its snapshot is reloaded)
+        """
+        from modules.model import reference_cache
+
+        snapshot = (reference_cache.it_workers(), reference_cache.workers())
+        if self._workers_snapshot and all(map(operator.is_, snapshot, self._workers_snapshot)):
+            return
+        with self._lock:
+            for key in [key for key in self._docs if key[0] == WORKER]:
+                self._remove(key)
+            for worker in snapshot[0] + snapshot[1]:
+                self._add({'type': WORKER, 'id': worker.worker_id, 'label': worker.name or '', 'name': worker.name},
+                          _terms([worker.name, str(worker.worker_id)]))
+            self._workers_snapshot = snapshot
+
+    # -- incremental updates
+
+    def hardware_changed(self, hardware_ids):
+        """
+        Reindex hardware after it was created or changed (edit, import, arrange act). Call after commit
+        """
+        if self._built_at is None and not self._building:
+            return  # nothing to update, the index is built from the DB on the first search
+        hardware_ids = set(hardware_ids)
+        docs = {doc['id']: doc for doc in _load_hardware(hardware_ids)}
+        with self._lock:
+            if self._building:
+                self._changed_while_building.update(hardware_ids)
+
+            reindex = []
+            for hardware_id in hardware_ids:
+                key = (HARDWARE, hardware_id)
+                doc = docs.get(hardware_id)
+                terms = _hardware_terms(doc) if doc else ()
+                if doc and self._terms.get(key) == terms:
+                    self._docs[key] = doc  # e.g. only the owner changed
+                else:
+                    reindex.append((key, doc, terms))
+
+            if len(reindex) <= BULK_REINDEX:
+                for key, doc, terms in reindex:
+                    self._remove(key)
+                    if doc:
+                        self._add(doc, terms)
+            else:
+                self._bulk_reindex(reindex)
+
+    def _bulk_reindex(self, reindex):
+        """
+        Many documents at once (import batch): filter and re-sort the terms list once
+        instead of moving it on every insert
+        """
+        keys = {key for key, _, _ in reindex}
+        self._sorted_terms = [entry for entry in self._sorted_terms if entry[1] not in keys]
+        for key, doc, terms in reindex:
+            self._discard_trigrams(self._terms.get(key, ()), key)
+            self._docs.pop(key, None)
+            self._terms.pop(key, None)
+            if doc:
+                self._add(doc, terms, keep_sorted=False)
+        self._sorted_terms.sort()
+
+    def _add(self, doc, terms, keep_sorted=True):
+        """
+        :param keep_sorted: False for the bulk build, the terms list is sorted once at the end
+        """
+        key = (doc['type'], doc['id'])
+        self._docs[key] = doc
+        self._terms[key] = terms
+        if keep_sorted:
+            for term in terms:
+                bisect.insort(self._sorted_terms, (term, key))
+        else:
+            self._sorted_terms.extend((term, key) for term in terms)
+        postings = self._trigrams
+        for gram in word_trigrams(terms):
+            postings[gram].add(key)
+
+    def _remove(self, key):
+        self._docs.pop(key, None)
+        terms = self._terms.pop(key, ())
+        for term in terms:
+            i = bisect.bisect_left(self._sorted_terms, (term, key))
+            if i < len(self._sorted_terms) and self._sorted_terms[i] == (term, key):
+                del self._sorted_terms[i]
+        self._discard_trigrams(terms, key)
+
+    def _discard_trigrams(self, terms, key):
+        for gram in word_trigrams(terms):
+            posting = self._trigrams.get(gram)
+            if posting is not None:
+                posting.discard(key)
+                if not posting:
+                    del self._trigrams[gram]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'documents': len(self._docs),
+                'terms': len(self._sorted_terms),
+                'trigrams': len(self._trigrams),
+                'age_sec': None if self._built_at is None else round(time.monotonic() - self._built_at),
+                'ttl_sec': self.ttl,
+            }
+
+
+def _terms(texts) -> tuple:
+    """
+    Index terms of the texts: every word and the whole text (for multi-word prefixes)
+    """
+    terms = set()
+    for text in texts:
+        text = normalize(text)
+        if text:
+            terms.add(text)
+            terms.update(text.split())
+    return tuple(sorted(terms))
+
+
+def _hardware_terms(doc) -> tuple:
+    return _terms([doc['code'], str(doc['id']), doc['serial'], doc['name']])
+
+
+def _load_hardware(hardware_ids=None):
+    """
+    Generator of hardware documents (with the current owner) from the DB
+    """
+    from modules.model import Hardware, HardwareUse, Worker, chunks
+
+    hardware = Hardware.__table__
+    hardware_use = HardwareUse.__table__
+    employee = Worker.__table__
+    query = select(hardware.c.hardware_id, hardware.c.name, hardware.c.serial_num, employee.c.name) \
+        .select_from(hardware.outerjoin(hardware_use)
+                     .outerjoin(employee, employee.c.worker_id == hardware_use.c.employee_id))
+
+    queries = [query] if hardware_ids is None else \
+        [query.where(hardware.c.hardware_id.in_(ids)) for ids in chunks(sorted(hardware_ids))]
+    with get_engine().connect() as conn:
+        for statement in queries:
+            for hardware_id, name, serial_num, owner in conn.execution_options(stream_results=True)\
+                    .execute(statement):
+                code = str(hardware_id).zfill(8)
+                yield {'type': HARDWARE, 'id': hardware_id, 'label': f'{code} {name or ""}'.strip(), 'code': code,
+                       'name': name, 'serial': serial_num, 'owner': owner}
+
+
+search_index = SearchIndex()
@@ -0,0 +1,64 @@
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Reference data loaded by every worker process before it takes requests
+WARM_REFERENCE_DATA = os.environ.get('HARDWARE_WARM_REFERENCE_DATA', '1') == '1'
+
+
+def preload():
+    """
+    Import and prepare the app once in the master process of a forking server (gunicorn --preload):
+    models are mapped, templates compiled and
+    the static files hashed, then the DB connections opened for it are closed, so forked workers
+    share the prepared app and open their own connections.
+    Nothing here may start threads or process pools: they are not copied to the workers
+    :return: flask app
+    """
+    start = time.perf_counter()
+    from app import app
+    import modules.http_cache as http_cache
+    import modules.session_manager as session_manager
+
+    with app.app_context():
+        templates = compile_templates(app)
+        http_cache.app_version()
+    session_manager.dispose_engines()
+    logger.info('App preloaded in %.0f ms: %d templates compiled', (time.perf_counter() - start) * 1000, templates)
+    return app
+
+
+def compile_templates(app) -> int:
+    """
+    Compile all templates into the jinja cache of the app
+    :return: number of templates
+    """
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def warm_up_worker():
+    """
+    Load the reference data in a new worker process, so its first requests don't wait for it.
+    Connections of the master were dropped after fork (modules/session_manager.py), the worker opens its own
+    """
+    if not WARM_REFERENCE_DATA:
+        return
+    import modules.model as model
+    from modules.session_manager import remove_session
+
+    start = time.perf_counter()
+    try:
+        for name in model.ReferenceCache.ENTRIES:
+            model.reference_cache.get(name)
+    except Exception:
+        # the worker still serves, the data is loaded by the first request which needs it
+        logger.exception('Reference data warm-up failed in worker %s', os.getpid())
+    finally:
+        remove_session()
+    logger.info('Worker %s warmed up in %.0f ms', os.getpid(), (time.perf_counter() - start) * 1000)
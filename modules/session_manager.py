@@ -1,5 +1,130 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+import functools
+import os
+import threading
+import time
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+
+DB = {
+    'user': os.environ.get('HARDWARE_DB_USER', ''),
+    'pw': os.environ.get('HARDWARE_DB_PASSWORD', ''),
+    'server': os.environ.get('HARDWARE_DB_SERVER', 'localhost'),
+    'database': os.environ.get('HARDWARE_DB_NAME', 'hardware'),
+    'driver': os.environ.get('HARDWARE_DB_DRIVER', 'driver=ODBC+Driver+17+for+SQL+Server'),
+}
+
+# Full SQLAlchemy URL. Overrides DB above (e.g. sqlite:///local.db for development)
+DB_URL = os.environ.get('HARDWARE_DB_URL')
+
+POOL = {
+    'pool_size': int(os.environ.get('HARDWARE_DB_POOL_SIZE', 10)),
+    'max_overflow': int(os.environ.get('HARDWARE_DB_MAX_OVERFLOW', 20)),
+    'pool_timeout': int(os.environ.get('HARDWARE_DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(os.environ.get('HARDWARE_DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.environ.get('HARDWARE_DB_POOL_PRE_PING', '1') == '1',
+}
+
+# Read-only replica. Requests of the views marked with @read_only read from it
+DB_READ_URL = os.environ.get('HARDWARE_DB_READ_URL')
+# After a write the user reads from the primary for this long, so the replica lag doesn't hide own changes
+READ_STICKY_SEC = int(os.environ.get('HARDWARE_DB_READ_STICKY_SEC', 10))
+STICKY_COOKIE = 'db_primary_until'
+
+# SQL statements are logged only when explicitly asked for
+SQL_ECHO = os.environ.get('HARDWARE_SQL_ECHO', '0') == '1'
+
+
+class PoolStats:
+    """
+    Connection pool counters: number of checkouts and time spent waiting for a free connection
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.connects = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'wait_total_sec': round(self.wait_total, 6),
+                'wait_max_sec': round(self.wait_max, 6),
+                'wait_avg_sec': round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    QueuePool which measures how long every checkout waited for a connection
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start)
+
+
+def get_db_url():
+    """
+    Build database url from the settings
+    :return: <str> SQLAlchemy database url
+    """
+    if DB_URL:
+        return DB_URL
+
+    return f"mssql+pyodbc://{DB['user']}:{DB['pw']}@{DB['server']}/{DB['database']}?{DB['driver']}"
+
+
+def make_engine(url, echo=SQL_ECHO, **options):
+    """
+    Create engine with the pooled connection settings
+    :param url: database url
+    :param echo: log sql statements
+    :param options: extra create_engine() options, override POOL settings
+    :return engine: sql connection engine
+    """
+    engine_options = {'echo': echo}
+    in_memory_db = url.startswith('sqlite') and (':memory:' in url or url.rstrip('/') == 'sqlite:')
+    if not in_memory_db:
+        engine_options.update(POOL, poolclass=MeteredQueuePool)
+    if url.startswith('mssql+pyodbc'):
+        # Send executemany() parameters in one round trip (bulk inserts of acts and imports)
+        engine_options['fast_executemany'] = True
+    engine_options.update(options)
+
+    engine = create_engine(url, **engine_options)
+    event.listen(engine, 'connect', lambda dbapi_conn, conn_record: pool_stats.record_connect())
+    return engine
+
+
+_engine = None
+_engine_lock = threading.Lock()
 
 
 def create_connection_to_sql():
@@ -7,16 +132,168 @@ def create_connection_to_sql():
     Create connection engine to sql database
     :return engine: sql connection engine
     """
-    
+    return make_engine(get_db_url())
 
-    engine = create_engine(f"mssql+pyodbc://{DB['user']}:{DB['pw']}@{DB['server']}/{DB['database']}?{DB['driver']}",
-                           echo=True)
-    return engine
+
+def get_engine():
+    """
+    Process wide engine. Created once on the first use
+    :return engine: sql connection engine
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_connection_to_sql()
+    return _engine
+
+
+_read_engine = None
+
+
+def get_read_engine():
+    """
+    Process wide engine of the replica (HARDWARE_DB_READ_URL), the primary engine if no replica is set
+    """
+    global _read_engine
+    if not DB_READ_URL:
+        return get_engine()
+    if _read_engine is None:
+        with _engine_lock:
+            if _read_engine is None:
+                _read_engine = make_engine(DB_READ_URL)
+    return _read_engine
 
 
-def load_session():
-    """"""
-    engine = create_connection_to_sql()
+def read_only(view):
+    """
+    Decorator of views which only read: their session and get_engine_for_read() use the replica
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def use_replica() -> bool:
+    """
+    The current request is read-only and the user did not write recently
+    """
+    if not DB_READ_URL or not has_request_context() or not g.get('db_read_only'):
+        return False
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) < time.time()
+    except ValueError:
+        return True
+
+
+def get_engine_for_read():
+    """
+    Engine for reads which may lag behind the primary a little: the replica in read-only requests
+    and outside of requests (cli reports), the primary in other requests
+    """
+    if has_request_context() and not use_replica():
+        return get_engine()
+    return get_read_engine()
+
+
+def mark_write():
+    """
+    The request changed data: the user reads from the primary for READ_STICKY_SEC
+    """
+    if has_request_context():
+        g.db_written = True
+
+
+def _set_sticky_cookie(response):
+    if DB_READ_URL and g.get('db_written'):
+        response.set_cookie(STICKY_COOKIE, f'{time.time() + READ_STICKY_SEC:.3f}', max_age=READ_STICKY_SEC,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+@event.listens_for(Session, 'after_commit')
+def _mark_commit(session):
+    mark_write()
+
+
+def _session_scope_id():
+    """
+    Sessions live as long as the flask app context (i.e. one request).
+    Outside of the app context (cli, background threads) session is per thread
+    """
+    if has_app_context():
+        return id(g._get_current_object())
+    return threading.get_ident()
+
+
+session_factory = sessionmaker()
+db_session_registry = scoped_session(session_factory, scopefunc=_session_scope_id)
 
-    db_session = Session(bind=engine)
-    return db_session
+
+def load_session() -> Session:
+    """
+    Get session of the current request (or thread). The same session is returned on every call
+    during the request and closed in the request teardown. Read-only requests get a session of the replica
+    :return: sqlalchemy Session
+    """
+    if session_factory.kw.get('bind') is None:
+        session_factory.configure(bind=get_engine())
+    if use_replica() and not db_session_registry.registry.has():
+        return db_session_registry(bind=get_read_engine())
+    return db_session_registry()
+
+
+def remove_session(exception=None):
+    """
+    Close session of the current request (or thread) and return connection to the pool
+    """
+    db_session_registry.remove()
+
+
+def dispose_engines(close=True):
+    """
+    Drop the pooled connections of the process engines, new ones are opened on the next use
+    :param close: False in a forked child: the connections belong to the parent, they are only forgotten
+    """
+    for engine in (_engine, _read_engine):
+        if engine is not None:
+            engine.dispose(close=close)
+
+
+def _after_fork_in_child():
+    # a connection used by two processes mixes their statements and results
+    dispose_engines(close=False)
+    # a lock held by another thread of the parent at fork time is never released in the child: new locks
+    global _engine_lock
+    _engine_lock = threading.Lock()
+    pool_stats._lock = threading.Lock()
+    pool_stats.reset()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def pool_status() -> dict:
+    """
+    Current state of the connection pool and checkout metrics
+    """
+    status = pool_stats.as_dict()
+    pool = get_engine().pool
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(),
+                      checked_in=pool.checkedin())
+    if DB_READ_URL and isinstance(get_read_engine().pool, QueuePool):
+        read_pool = get_read_engine().pool
+        status['replica'] = {'size': read_pool.size(), 'checked_out': read_pool.checkedout(),
+                             'overflow': read_pool.overflow(), 'checked_in': read_pool.checkedin()}
+    return status
+
+
+def init_app(app):
+    """
+    Register session teardown and the read-your-writes cookie for the flask app
+    """
+    app.teardown_appcontext(remove_session)
+    app.after_request(_set_sticky_cookie)
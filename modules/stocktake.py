@@ -0,0 +1,346 @@
+import csv
+import io
+import itertools
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import func, literal, select
+from modules.model import ArrangeStatus, Hardware, HardwareUse, Stocktake, StocktakeExpected, StocktakeScan, Worker, \
+    chunks
+from modules.session_manager import get_engine
+
+
+logger = logging.getLogger(__name__)
+
+SCAN_BATCH_MAX = 5000  # scans per request
+SCAN_FILE_BATCH = 1000  # scans of an uploaded file saved and reconciled at once
+LIST_PAGE_SIZE = 100
+LIST_MAX_PAGE_SIZE = 1000
+ID_MAX = 2 ** 31 - 1  # INT columns of hardware_id and location_id
+
+MISSING = 'missing'  # expected, not scanned yet
+FOUND = 'found'  # scanned at the place of its owner
+MISASSIGNED = 'misassigned'  # scanned at the place of another worker
+UNEXPECTED = 'unexpected'  # scanned, but free or unknown in the DB
+LISTS = (MISSING, FOUND, MISASSIGNED, UNEXPECTED)
+
+
+class StocktakeError(ValueError):
+    """
+    Scans can not be accepted (closed stocktake, invalid batch or file)
+    """
+
+
+def parse_code(code):
+    """
+    Hardware id of the scanned inventory code (zero-padded digits), None if it is not a code
+    """
+    code = str(code).strip()
+    # isdigit() alone accepts digits like '²' which int() rejects
+    if not (code.isascii() and code.isdigit()):
+        return None
+    hardware_id = int(code)
+    return hardware_id if 0 < hardware_id <= ID_MAX else None
+
+
+def parse_location(location):
+    """
+    Worker id of the scan location, None if it is not an id
+    """
+    try:
+        location_id = int(location)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return location_id if 0 < location_id <= ID_MAX else None
+
+
+class StocktakeState:
+    """
+    Reconciliation of one stocktake in the memory of the process: hash index of the expected holdings
+    (hardware_id -> owner) and the lists updated by every scan, so a batch costs O(scans of the batch)
+    """
+
+    def __init__(self, expected: dict):
+        self.expected = expected
+        self.missing = set(expected)
+        self.scanned = {}  # hardware_id -> location of the last scan
+        self.scan_seqs = {}  # hardware_id -> seq of the last scan
+        self.found = set()
+        self.misassigned = {}  # hardware_id -> (expected owner, location)
+        self.unexpected = {}  # hardware_id -> location
+        self.owners = {}  # hardware_id -> owner in the DB of scanned hardware outside the expected holdings
+        self.unknown = set()  # scanned ids without hardware
+        self.last_seq = 0
+        self.lock = threading.Lock()
+
+    def apply(self, hardware_id, location_id):
+        """
+        Reconcile one scan (in the order of seq). A hardware scanned again is reconciled by its last scan
+        """
+        self._forget(hardware_id)
+        self.scanned[hardware_id] = location_id
+        self.missing.discard(hardware_id)
+        owner = self.expected[hardware_id] if hardware_id in self.expected else self.owners.get(hardware_id)
+        if owner is None:
+            self.unexpected[hardware_id] = location_id
+        elif owner == location_id:
+            self.found.add(hardware_id)
+        else:
+            self.misassigned[hardware_id] = (owner, location_id)
+
+    def _forget(self, hardware_id):
+        self.found.discard(hardware_id)
+        self.misassigned.pop(hardware_id, None)
+        self.unexpected.pop(hardware_id, None)
+
+    def status(self, hardware_id) -> str:
+        if hardware_id in self.found:
+            return FOUND
+        if hardware_id in self.misassigned:
+            return MISASSIGNED
+        if hardware_id in self.unexpected:
+            return UNEXPECTED
+        return MISSING
+
+    def item(self, hardware_id) -> dict:
+        status = self.status(hardware_id)
+        item = {'hardware_id': hardware_id, 'status': status,
+                'expected_employee_id': self.expected.get(hardware_id, self.owners.get(hardware_id)),
+                'location_id': self.scanned.get(hardware_id)}
+        if status == UNEXPECTED:
+            item['known'] = hardware_id not in self.unknown
+        return item
+
+    def counts(self) -> dict:
+        return {'expected': len(self.expected), 'scanned': len(self.scanned), MISSING: len(self.missing),
+                FOUND: len(self.found), MISASSIGNED: len(self.misassigned), UNEXPECTED: len(self.unexpected)}
+
+    def page(self, list_name, after=None, limit=LIST_PAGE_SIZE) -> tuple:
+        """
+        Items of the list ordered by hardware_id
+        :return: (items, cursor of the next page or None)
+        """
+        ids = {MISSING: self.missing, FOUND: self.found, MISASSIGNED: self.misassigned,
+               UNEXPECTED: self.unexpected}[list_name]
+        after = int(after) if after else None
+        ids = sorted(hardware_id for hardware_id in ids if after is None or hardware_id > after)
+        items = [self.item(hardware_id) for hardware_id in ids[:limit]]
+        return items, str(ids[limit - 1]) if len(ids) > limit else None
+
+
+class Stocktakes:
+    """
+    Stocktakes of the process. Scans are saved to the DB first, then every process serving the stocktake
+    applies the scans it has not seen yet (seq above the last one applied) to its state,
+    so scanners may send batches to any server process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}  # stocktake_id -> StocktakeState
+
+    @staticmethod
+    def open(name=None, department_id=None) -> dict:
+        """
+        Start a stocktake of the hardware in use (of the workers of the department if given)
+        """
+        stocktakes = Stocktake.__table__
+        expected = StocktakeExpected.__table__
+        hardware_use = HardwareUse.__table__
+        with get_engine().begin() as conn:
+            stocktake_id = conn.execute(stocktakes.insert().values(
+                name=name, department_id=department_id, status=Stocktake.OPEN, expected_count=0, scan_count=0,
+                created=datetime.now())).inserted_primary_key[0]
+            holdings = select(literal(stocktake_id), hardware_use.c.hardware_id, hardware_use.c.employee_id) \
+                .where(hardware_use.c.status_id == ArrangeStatus.IN_USE, hardware_use.c.employee_id.isnot(None))
+            if department_id is not None:
+                workers = Worker.__table__
+                holdings = holdings.join_from(hardware_use, workers, workers.c.worker_id == hardware_use.c.employee_id) \
+                    .where(workers.c.department_id == department_id)
+            conn.execute(expected.insert().from_select(['stocktake_id', 'hardware_id', 'employee_id'], holdings))
+            count = conn.execute(select(func.count()).select_from(expected)
+                                 .where(expected.c.stocktake_id == stocktake_id)).scalar()
+            conn.execute(stocktakes.update().where(stocktakes.c.stocktake_id == stocktake_id)
+                         .values(expected_count=count))
+        logger.info('Stocktake %s opened: %d hardware expected', stocktake_id, count)
+        return Stocktakes.get(stocktake_id)
+
+    @staticmethod
+    def get(stocktake_id) -> dict:
+        """
+        Stocktake row, None if not found
+        """
+        stocktakes = Stocktake.__table__
+        with get_engine().connect() as conn:
+            row = conn.execute(select(stocktakes).where(stocktakes.c.stocktake_id == stocktake_id)).mappings().first()
+        if row is None:
+            return None
+        stocktake = dict(row)
+        for field in ('created', 'closed'):
+            stocktake[field] = stocktake[field].isoformat(timespec='seconds') if stocktake[field] else None
+        return stocktake
+
+    def close(self, stocktake_id) -> dict:
+        """
+        Close the stocktake, its state is dropped by the summary
+        """
+        stocktakes = Stocktake.__table__
+        with get_engine().begin() as conn:
+            conn.execute(stocktakes.update().where(stocktakes.c.stocktake_id == stocktake_id)
+                         .values(status=Stocktake.CLOSED, closed=datetime.now()))
+        return self.summary(stocktake_id)
+
+    def state(self, stocktake_id) -> StocktakeState:
+        """
+        State of the stocktake with all saved scans applied. Only states of open stocktakes are kept,
+        a closed one is built again from the DB on every read
+        """
+        with self._lock:
+            state = self._states.get(stocktake_id)
+            if state is None:
+                state = StocktakeState(self._load_expected(stocktake_id))
+                stocktake = self.get(stocktake_id)
+                if stocktake is not None and stocktake['status'] == Stocktake.OPEN:
+                    self._states[stocktake_id] = state
+        with state.lock:
+            self._catch_up(stocktake_id, state)
+        return state
+
+    @staticmethod
+    def _load_expected(stocktake_id) -> dict:
+        expected = StocktakeExpected.__table__
+        with get_engine().connect() as conn:
+            return dict(conn.execute(select(expected.c.hardware_id, expected.c.employee_id)
+                                     .where(expected.c.stocktake_id == stocktake_id)).all())
+
+    def _catch_up(self, stocktake_id, state):
+        """
+        Apply the scans saved since the last catch-up (under state.lock)
+        """
+        scans = StocktakeScan.__table__
+        with get_engine().connect() as conn:
+            rows = conn.execute(select(scans.c.seq, scans.c.hardware_id, scans.c.location_id)
+                                .where(scans.c.stocktake_id == stocktake_id, scans.c.seq > state.last_seq)
+                                .order_by(scans.c.seq)).all()
+            self._load_owners(conn, state, {row.hardware_id for row in rows})
+        for row in rows:
+            state.apply(row.hardware_id, row.location_id)
+        if rows:
+            state.last_seq = rows[-1].seq
+
+    @staticmethod
+    def _load_owners(conn, state, hardware_ids):
+        """
+        Current owners of the scanned hardware which is not in the expected holdings
+        """
+        hardware_ids = [hardware_id for hardware_id in hardware_ids
+                        if hardware_id not in state.expected and hardware_id not in state.owners]
+        hardware = Hardware.__table__
+        hardware_use = HardwareUse.__table__
+        for ids in chunks(hardware_ids):
+            found = set()
+            for row in conn.execute(select(hardware.c.hardware_id, hardware_use.c.status_id, hardware_use.c.employee_id)
+                                    .select_from(hardware.outerjoin(hardware_use))
+                                    .where(hardware.c.hardware_id.in_(ids))):
+                found.add(row.hardware_id)
+                state.owners[row.hardware_id] = row.employee_id if row.status_id == ArrangeStatus.IN_USE else None
+            for hardware_id in set(ids) - found:
+                state.owners[hardware_id] = None
+                state.unknown.add(hardware_id)
+
+    def add_scans(self, stocktake_id, scans: list) -> dict:
+        """
+        Save and reconcile a batch of scans
+        :param scans: [{'code', 'location', 'scanner'}]
+        :return: reconciliation of every accepted scan, rejected codes and the counts of the lists
+        """
+        if len(scans) > SCAN_BATCH_MAX:
+            raise StocktakeError(f'At most {SCAN_BATCH_MAX} scans per batch, {len(scans)} given')
+
+        rows, rejected = [], []
+        scanned = datetime.now()
+        for scan in scans:
+            hardware_id = parse_code(scan.get('code', ''))
+            location_id = parse_location(scan.get('location'))
+            if hardware_id is None or location_id is None:
+                rejected.append(scan.get('code'))
+                continue
+            rows.append({'stocktake_id': stocktake_id, 'hardware_id': hardware_id, 'location_id': location_id,
+                         'scanner': str(scan.get('scanner') or '')[:50] or None, 'scanned': scanned})
+
+        stocktakes = Stocktake.__table__
+        with get_engine().begin() as conn:
+            # takes the numbers and locks the stocktake row until the scans are committed
+            result = conn.execute(stocktakes.update()
+                                  .where(stocktakes.c.stocktake_id == stocktake_id, stocktakes.c.status == Stocktake.OPEN)
+                                  .values(scan_count=stocktakes.c.scan_count + len(rows)))
+            if result.rowcount != 1:
+                if self.get(stocktake_id) is None:
+                    return None
+                raise StocktakeError(f'Stocktake {stocktake_id} is closed')
+            last_seq = conn.execute(select(stocktakes.c.scan_count)
+                                    .where(stocktakes.c.stocktake_id == stocktake_id)).scalar()
+            for seq, row in enumerate(rows, start=last_seq - len(rows) + 1):
+                row['seq'] = seq
+            if rows:
+                conn.execute(StocktakeScan.__table__.insert(), rows)
+
+        state = self.state(stocktake_id)
+        with state.lock:
+            results = [state.item(hardware_id) for hardware_id in dict.fromkeys(row['hardware_id'] for row in rows)]
+            counts = state.counts()
+        return {'accepted': len(rows), 'rejected': rejected, 'results': results, 'counts': counts}
+
+    def import_file(self, stocktake_id, file) -> dict:
+        """
+        Scans from a CSV file (columns code, location and optional scanner) in batches
+        :param file: binary file object
+        """
+        reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+        try:
+            fieldnames = reader.fieldnames
+        except UnicodeDecodeError:
+            raise StocktakeError('CSV file must be UTF-8')
+        if not fieldnames or not {'code', 'location'} <= {name.strip().lower() for name in fieldnames}:
+            raise StocktakeError('CSV columns code and location are required')
+        rows = ({key.strip().lower(): value for key, value in row.items() if key} for row in reader)
+        accepted, rejected = 0, []
+        while True:
+            # the file is decoded while it is read: batches before an invalid line are already saved
+            try:
+                batch = list(itertools.islice(rows, SCAN_FILE_BATCH))
+            except UnicodeDecodeError:
+                raise StocktakeError(f'CSV file must be UTF-8, {accepted} scan(s) before the invalid line saved')
+            if not batch:
+                break
+            result = self.add_scans(stocktake_id, batch)
+            if result is None:
+                return None
+            accepted += result['accepted']
+            rejected += result['rejected']
+        return dict(self.summary(stocktake_id), accepted=accepted, rejected=rejected)
+
+    def summary(self, stocktake_id) -> dict:
+        stocktake = self.get(stocktake_id)
+        if stocktake is None:
+            return None
+        state = self.state(stocktake_id)
+        if stocktake['status'] != Stocktake.OPEN:
+            # closed in this or another process
+            with self._lock:
+                self._states.pop(stocktake_id, None)
+        with state.lock:
+            stocktake['counts'] = state.counts()
+        return stocktake
+
+    def items(self, stocktake_id, list_name, after=None, limit=LIST_PAGE_SIZE) -> tuple:
+        """
+        Page of the list (missing, found, misassigned, unexpected)
+        :return: (items, cursor of the next page or None)
+        """
+        state = self.state(stocktake_id)
+        with state.lock:
+            return state.page(list_name, after=after, limit=min(max(limit, 1), LIST_MAX_PAGE_SIZE))
+
+
+stocktakes = Stocktakes()
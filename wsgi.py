@@ -0,0 +1,6 @@
+"""
+WSGI entry point of the multi-process servers: gunicorn -c gunicorn.conf.py
+"""
+from modules.serving import preload
+
+app = preload()